@@ -20,10 +20,10 @@ __version__ = '$Id$'
 __author__ = 'Gummbum, (c) 2011'
 
 
-"""10_minimap.py - An example using sub-window as a minimap for Gummworld2.
+"""10_minimap.py - An example using the Minimap component of Gummworld2.
 
-This demonstrates accessing Screen, Camera and World to convert their dimensions
-for a particular use.
+The minimap draws a shrunken copy of the map once, and refreshes the sprite
+markers on it at a fixed interval, independent of the frame rate.
 
 It also demonstrates use of BucketSprite and BucketGroup, two classes that work
 together in Gummworld2 to manage sprites in the traditional pygame manner.
@@ -44,7 +44,7 @@ import paths
 import gummworld2
 from gummworld2 import (
     context, toolkit,
-    Engine, State, BucketSprite, BucketGroup, SubPixelSurface, View, Vec2d,
+    Engine, State, BucketSprite, BucketGroup, Minimap, Vec2d,
 )
 
 
@@ -72,68 +72,6 @@ class Sprite(BucketSprite):
         self.position += self.dir
 
 
-class Minimap(object):
-    
-    def __init__(self):
-        
-        # The minimap is a subsurface upon which the whole world is projected.
-        self.mini_screen = View(
-            State.screen.surface, pygame.Rect(475,25,100,100))
-        
-        # tiny_rect will be drawn on the minimap to indicate the visible area of
-        # the world (the screen, aka camera).
-        self.tiny_rect = self.mini_screen.rect.copy()
-        size = Vec2d(State.screen.size)
-        size.x = float(size.x)
-        size.y = float(size.y)
-        size = size / State.world.rect.size * self.mini_screen.rect.size
-        self.tiny_rect.size = round(size.x),round(size.y)
-        
-        # A dot represents a full sprite on the minimap. SubPixelSurface is a
-        # generated set of antialiased images that give the illusion of movement
-        # smaller than one pixel. If we did not do this the dots would have an
-        # annoying jerky movement.
-        dot = pygame.surface.Surface((1,1))
-        dot.fill(Color('white'))
-        self.dot = SubPixelSurface(dot)
-        
-        # Pre-compute some reusable values.
-        mini_screen = self.mini_screen
-        mini_surf = mini_screen.surface
-        mini_size = mini_screen.rect.size
-        self.mini_size = mini_size
-        
-        full_size = Vec2d(State.world.rect.size)
-        full_size.x = float(full_size.x)
-        full_size.y = float(full_size.y)
-        self.full_size = full_size
-
-    def draw(self, sprite_group):
-        mini_screen = self.mini_screen
-        mini_surf = mini_screen.surface
-        
-        # Position the "visible area" tiny_rect, aka camera, within the minimap
-        # so we can draw it as a filled rect.
-        full_size = self.full_size
-        mini_size = self.mini_size
-        tiny_pos = State.camera.rect.topleft / full_size * mini_size
-        self.tiny_rect.topleft = round(tiny_pos.x),round(tiny_pos.y)
-        
-        # Draw the minimap...
-        mini_screen.clear()
-        # Draw the camera area as a filled rect.
-        pygame.draw.rect(mini_surf, Color(200,0,255), self.tiny_rect)
-        # Draw sprites as dots.
-        for s in sprite_group:
-            pos = s.rect.topleft / full_size * mini_size
-            dot = self.dot.at(pos.x, pos.y)
-            mini_surf.blit(dot, pos, None, BLEND_RGBA_ADD)
-        
-        # Draw a border.
-        pygame.draw.rect(State.screen.surface, (99,99,99),
-            mini_screen.parent_rect.inflate(2,2), 1)
-
-
 class App(Engine):
     
     def __init__(self):
@@ -144,9 +82,6 @@ class App(Engine):
             tile_size=(128,128), map_size=(10,10),
             frame_speed=0)
         
-        # Set up the minimap.
-        self.minimap = Minimap()
-        
         # Make some default content.
         toolkit.make_tiles()
         map = State.map
@@ -154,6 +89,10 @@ class App(Engine):
         for i in range(50):
             self.sprite_group.add(Sprite())
         
+        # Set up the minimap. The markers are refreshed ten times a second.
+        self.minimap = Minimap(pygame.Rect(475,25,100,100),
+            entities=self.sprite_group, interval=0.1)
+        
         State.clock.schedule_interval(self.set_caption, 2.)
         
         self.move_x = 0
@@ -184,7 +123,7 @@ class App(Engine):
         State.screen.clear()
         toolkit.draw_tiles()
         self.draw_balls()
-        self.minimap.draw(self.sprite_group)
+        self.minimap.draw()
         State.screen.flip()
         
     def draw_balls(self):
@@ -25,6 +25,9 @@ cameras in Gummworld2.
 
 This demo leverages State.save() and State.restore() to manage simultaneously
 scrolling maps.
+
+The tiles are drawn with toolkit.draw_tiles_cached(), which draws from chunks
+cached on the map. Any other camera viewing the same map reuses the chunks.
 """
 
 
@@ -122,7 +125,7 @@ class App(Engine):
         for view in (self.view1, self.view2):
             State.restore(view)
             view.clear()
-            toolkit.draw_tiles()
+            toolkit.draw_tiles_cached()
         State.screen.flip()
         
     def on_key_down(self, unicode, key, mod):
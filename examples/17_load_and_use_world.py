@@ -66,7 +66,7 @@ class App(Engine):
         
         entities,tilesheets = toolkit.load_entities(
             data.filepath('map', 'mini2.entities'))
-        State.world.add(*entities)
+        State.world.add_bulk(entities)
         
         # I like huds.
         toolkit.make_hud()
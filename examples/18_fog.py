@@ -21,9 +21,14 @@ __author__ = 'Gummbum, (c) 2011'
 
 
 """18_fog.py - A demo combining a Tiled Map Editor map, Gummworld2 Editor
-entities, and some fog images created with DR0ID's gradients module.
+entities, and fog of war.
 
-For the fog gradients: http://www.pygame.org/project-gradients-307-3051.html
+The fog is a gummworld2.Fog, which remembers the tiles the avatar has explored.
+Unexplored tiles are black, explored tiles are dimmed, and tiles within sight
+radius are clear.
+
+The fog images in data/image were created with DR0ID's gradients module, and
+are no longer used by this demo. For the fog gradients: http://www.pygame.org/project-gradients-307-3051.html
 
 # Here it is...
 import math
@@ -110,18 +115,9 @@ class App(Engine):
         
         State.speed = 3
         
-        self.fog = None
-        self.fog_rect = None
-        self.fogs = [
-            pygame.image.load(data.filepath('image', name))
-            for name in (
-                'fog-128.png',
-                'fog-156.png',
-                'fog-184.png',
-                'fog-212.png',
-                'fog-240.png',
-            )
-        ]
+        self.fog = Fog(self.map.tile_size, self.map.map_size)
+        self.fog_radius = None
+        self.fog_radii = (128, 156, 184, 212, 240)
         self.fogn = self.set_fog(0)
     
     def update(self, dt):
@@ -130,6 +126,7 @@ class App(Engine):
         if self.mouse_down:
             self.update_mouse_movement(pygame.mouse.get_pos())
         self.update_camera_position()
+        self.fog.update([(State.camera.position, self.fog_radius)])
     
     def update_mouse_movement(self, pos):
         # Angle of movement.
@@ -230,8 +227,7 @@ class App(Engine):
         State.screen.flip()
     
     def draw_fog(self):
-        State.screen.blit(self.fog, self.fog_rect,
-            special_flags=BLEND_RGBA_MULT)
+        self.fog.draw()
     
     def draw_avatar(self):
         camera = State.camera
@@ -239,8 +235,7 @@ class App(Engine):
         camera.surface.blit(avatar.image, avatar.screen_position)
     
     def set_fog(self, n):
-        self.fog = self.fogs[n%len(self.fogs)]
-        self.fog_rect = self.fog.get_rect(center=State.screen.center)
+        self.fog_radius = self.fog_radii[n%len(self.fog_radii)]
         return n
     
     def on_mouse_button_down(self, pos, button):
@@ -264,7 +259,7 @@ class App(Engine):
 
 def load_world(filepath):
     entities,tilesheets = toolkit.load_entities(filepath)
-    State.world.add_list(entities)
+    State.world.add_bulk(entities)
 
 
 if __name__ == '__main__':
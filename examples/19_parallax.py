@@ -33,6 +33,7 @@ from pygame.locals import *
 import paths
 import gummworld2
 from gummworld2 import context, State, Engine, MapLayer, Vec2d, toolkit
+from gummworld2 import ParallaxRenderer
 
 
 class App(Engine):
@@ -54,6 +55,9 @@ class App(Engine):
             frame_speed=0)
         
         make_map()
+        # The far sky is blurry anyway; keep its chunks at half resolution.
+        self.renderer = ParallaxRenderer()
+        self.renderer.set_resolution(0, 0.5)
         pos = State.map.rect.centerx, State.map.rect.height * 2//3
         State.camera.init_position(pos)
         self.test_rect = Rect(State.camera.rect)
@@ -81,13 +85,7 @@ class App(Engine):
         State.screen.flip()
     
     def draw_tiles(self):
-        draw = toolkit.draw_parallax_tiles_of_layer
-        camera = State.camera
-        map = State.map
-        for layeri,layer in enumerate(State.map.layers):
-            parallax = layer.parallax
-            #draw(camera, map, layer, parallax)
-            toolkit.draw_tiles_of_layer(layeri, parallax.x, parallax.y)
+        self.renderer.draw()
     
     def on_key_down(self, unicode, key, mod):
         if key == K_DOWN: self.move.y += State.speed
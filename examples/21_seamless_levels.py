@@ -39,8 +39,8 @@ The maps' tiles are procedurally created. As such, the images can visibly break
 at the map edges. It can be hard to spot in the trees, but is quite obvious in
 the mountain range.
 
-Tiles are rendered top to bottom, and left to right spanning maps. See
-toolkit.draw_parallax_tiles().
+Tiles are rendered layer by layer, spanning maps, by a ParallaxRenderer. All
+maps' layers line up at the center of the combined maps.
 """
 
 
@@ -53,6 +53,7 @@ import paths
 import gummworld2
 from gummworld2 import context, model, toolkit
 from gummworld2 import State, Engine, Map, MapLayer, View, Vec2d
+from gummworld2 import ParallaxRenderer
 
 
 class Level(Engine):
@@ -148,8 +149,10 @@ class LevelManager(Engine):
         self.levels = [Level0(rect), Level1(rect)]
         self.current = 0        # current "primary" level has draw precedence
         self.on_screen = []     # levels that are on screen
-        self.cam_rects = {}     # camera rect for each layer
-        self.tiles = {}         # tiles for each layer
+        
+        maps = [l.map for l in self.levels]
+        world_rect = maps[0].rect.unionall([m.rect for m in maps[1:]])
+        self.renderer = ParallaxRenderer(maps, origin=world_rect.center)
         
         self.levels[0].set_state()
         State.clock.update_callback = self.update
@@ -188,23 +191,11 @@ class LevelManager(Engine):
                 if level.world.rect.collidepoint(State.camera.position):
                     self.current = current = i
                     break
-        # Build the tile list to render.
-        self.cam_rects.clear()
-        self.tiles.clear()
-        for level in self.levels:
-            map = level.map
-            for layer in map.layers:
-                parallax = layer.parallax
-                tile_range,pax_rect = toolkit.get_parallax_tile_range(
-                    State.camera, map, layer, parallax)
-                layer.tile_range = tile_range
-                layer.parallax_rect = pax_rect
     
     def draw(self, dt):
         State.camera.interpolate()
         State.screen.clear()
-        maps = [l.map for l in self.levels]
-        toolkit.draw_parallax_tiles(maps, State.screen)
+        self.renderer.draw()
         State.screen.flip()
     
     def on_key_down(self, unicode, key, mod):
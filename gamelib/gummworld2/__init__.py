@@ -53,22 +53,40 @@ from screen import Screen, View
 from map import Map, MapLayer
 from camera import Camera
 from gameclock import GameClock
+from jobs import JobManager
 from popup_menu import PopupMenu
 from ui import HUD, Stat, Statf
 from canvas import Canvas
 from sprite import CameraTargetSprite, BucketSprite, BucketGroup
+from renderqueue import RenderQueue
+from fog import Fog
+from minimap import Minimap
+from tilecache import ChunkCache, shared_cache
+from parallax import ParallaxRenderer
+from entitystore import RegionStore
+from assets import AssetManager, asset_manager
+from textcache import TextCache, GlyphAtlas, text_cache, glyph_atlas
 
-from engine import run, Engine, NO_WORLD, SIMPLE_WORLD, QUADTREE_WORLD, PYMUNK_WORLD
+from engine import run, Engine, NO_WORLD, SIMPLE_WORLD, QUADTREE_WORLD, PYMUNK_WORLD, ARRAY_WORLD
 
 
 # Toolkits and utilities
+import assets
 import context
 import model
 import data
+import entitystore
+import fog
 import geometry
+import jobs
+import minimap
+import parallax
 import pygame_utils
 import popup_menu
+import renderqueue
 import state
+import textcache
+import tilecache
 import ui
 import toolkit
 
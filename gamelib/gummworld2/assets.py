@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """assets.py - A cache of loaded images and sounds for Gummworld2.
+
+An AssetManager keeps decoded assets keyed by kind and absolute file path, so
+each file is read and decoded once. The cache has a budget in bytes; when it is
+exceeded the least recently used assets are dropped until usage falls to three
+quarters of the budget.
+
+Assets that are in use can be pinned with acquire() and unpinned with
+release(). Pinned assets are never dropped, even if that keeps the cache over
+budget. Assets fetched with get() are not pinned; the caller's reference stays
+valid, but the cache may drop its own.
+
+preload() decodes files on worker threads. pygame releases the GIL while it
+decodes an image, so a level's assets can be loaded while the current level
+keeps running. Converting a surface to the display's pixel format must be done
+on the main thread, so preloaded images are stored as decoded, and converted()
+converts each one once, the first time it is asked for.
+
+Usage:
+
+    job = asset_manager.preload(next_level_images)
+    ...
+    if job.done:
+        for name in next_level_images:
+            asset_manager.acquire(name)
+        for name in this_level_images:
+            asset_manager.release(name)
+        ...
+        image = asset_manager.converted('hero.png', alpha=True)
+"""
+
+
+import os
+import threading
+import Queue
+
+import pygame
+from pygame.locals import RLEACCEL
+
+
+def image_loader(path):
+    """Return the decoded image at path and its size in bytes.
+    """
+    image = pygame.image.load(path)
+    w,h = image.get_size()
+    return image, w * h * image.get_bytesize()
+
+
+def sound_loader(path):
+    """Return the pygame.mixer.Sound at path and its estimated size in bytes.
+    The mixer must be initialized.
+    """
+    sound = pygame.mixer.Sound(path)
+    freq,format,channels = pygame.mixer.get_init()
+    nbytes = int(sound.get_length() * freq) * channels * (abs(format) // 8)
+    return sound, nbytes
+
+
+class PreloadJob(object):
+    """Progress of an AssetManager.preload() call.
+
+    Attributes:
+        total -> Integer. The number of files to load.
+        loaded -> Integer. The number of files loaded so far.
+        errors -> A list of (name, message) for files that failed to load.
+        done -> Boolean, read-only. True when every file is loaded or failed.
+        progress -> Float, read-only. The fraction of files finished, 0.0 to
+            1.0.
+    Methods:
+        wait() -> Block until the job is done.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.loaded = 0
+        self.errors = []
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def _finished(self, error=None):
+        """Internal use. Count a file as loaded, or as failed if error is not
+        None. Called by the worker threads.
+        """
+        with self._lock:
+            if error is None:
+                self.loaded += 1
+            else:
+                self.errors.append(error)
+
+    @property
+    def done(self):
+        with self._lock:
+            return self.loaded + len(self.errors) >= self.total
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 1.0
+        with self._lock:
+            return float(self.loaded + len(self.errors)) / self.total
+
+    def wait(self, timeout=None):
+        """Block until the job is done, or until timeout seconds have passed.
+        Return self.done.
+        """
+        for t in self.threads:
+            t.join(timeout)
+        return self.done
+
+
+class AssetManager(object):
+    """A byte-budgeted cache of decoded assets.
+
+    Parameters:
+        max_bytes -> Integer. The memory budget in bytes. Zero means no limit.
+    Attributes:
+        loaders -> Dict. {kind : loader}, where loader(path) returns (asset,
+            nbytes). 'image' and 'sound' are predefined.
+        hits, misses, evictions, nbytes -> Cache activity and usage.
+    Methods:
+        get() -> An asset, loading it if needed.
+        converted() -> An image converted to the display's pixel format.
+        acquire() -> Get an asset and pin it in the cache.
+        release() -> Unpin an asset.
+        preload() -> Load assets on worker threads.
+        discard() -> Drop an asset.
+        clear() -> Drop all unpinned assets.
+        stats() -> A dict of cache statistics.
+    """
+
+    def __init__(self, max_bytes=64*1024*1024):
+        self.max_bytes = max_bytes
+        self.loaders = {
+            'image' : image_loader,
+            'sound' : sound_loader,
+        }
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}      # {key : [asset, nbytes, tick, refs]}
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def _key(self, name, kind):
+        if kind not in self.loaders:
+            raise pygame.error, 'unknown asset kind: ' + repr(kind)
+        return kind, os.path.abspath(name)
+
+    def _lookup(self, key):
+        """Internal use. Return the asset for key, or None if it is not cached.
+        """
+        with self._lock:
+            self._tick += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.hits += 1
+            entry[2] = self._tick
+            return entry[0]
+
+    def _load(self, key):
+        """Internal use. Load and cache the asset for key. If another thread
+        cached it first, that asset is returned instead.
+        """
+        kind,path = key
+        try:
+            asset,nbytes = self.loaders[kind](path)
+        except pygame.error, message:
+            print 'Cannot load %s: %s' % (kind, path)
+            raise pygame.error, message
+        return self._store(key, asset, nbytes)
+
+    def _store(self, key, asset, nbytes):
+        with self._lock:
+            self._tick += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = self._tick
+                return entry[0]
+            self.misses += 1
+            self._entries[key] = [asset, nbytes, self._tick, 0]
+            self.nbytes += nbytes
+            if self.max_bytes and self.nbytes > self.max_bytes:
+                self._evict(self.max_bytes * 3 // 4, key)
+        return asset
+
+    def _evict(self, target, keep):
+        entries = self._entries
+        for key,entry in sorted(entries.iteritems(), key=lambda kv: kv[1][2]):
+            if self.nbytes <= target:
+                break
+            if entry[3] or key == keep:
+                continue
+            del entries[key]
+            self.nbytes -= entry[1]
+            self.evictions += 1
+
+    def get(self, name, kind='image'):
+        """Return the asset of kind loaded from file name, loading it if it is
+        not cached. Images are returned as decoded; see converted().
+
+        The asset is shared. Do not draw on a cached image; copy it first.
+        """
+        key = self._key(name, kind)
+        asset = self._lookup(key)
+        if asset is None:
+            asset = self._load(key)
+        return asset
+
+    def converted(self, name, alpha=False, colorkey=None):
+        """Return the image loaded from file name, converted to the display's
+        pixel format with convert_alpha() if alpha is True, else with convert().
+        If colorkey is not None it is set on the image; -1 means the color of
+        the top-left pixel.
+
+        Each combination of alpha and colorkey is converted once and cached
+        like any other asset. This must be called from the main thread.
+        """
+        key = self._key(name, 'image')
+        if colorkey is not None and colorkey != -1:
+            colorkey = tuple(colorkey)
+        ckey = ('converted',bool(alpha),colorkey),key[1]
+        image = self._lookup(ckey)
+        if image is not None:
+            return image
+        image = self.get(name)
+        if alpha:
+            image = image.convert_alpha()
+        else:
+            image = image.convert()
+        if colorkey is not None:
+            if colorkey == -1:
+                colorkey = image.get_at((0,0))
+            image.set_colorkey(colorkey, RLEACCEL)
+        w,h = image.get_size()
+        return self._store(ckey, image, w * h * image.get_bytesize())
+
+    def acquire(self, name, kind='image'):
+        """Return the asset of kind loaded from file name, as with get(), and
+        pin it so it is not dropped from the cache. Each acquire() must be
+        matched by a release().
+        """
+        key = self._key(name, kind)
+        while True:
+            self.get(name, kind)
+            with self._lock:
+                entry = self._entries.get(key)
+                # Another thread may drop it between get() and here.
+                if entry is not None:
+                    entry[3] += 1
+                    return entry[0]
+
+    def release(self, name, kind='image'):
+        """Unpin an asset pinned by acquire(). When it is no longer pinned it
+        may be dropped like any other asset.
+        """
+        key = self._key(name, kind)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[3] <= 0:
+                raise pygame.error, 'asset not acquired: ' + repr(name)
+            entry[3] -= 1
+            if self.max_bytes and self.nbytes > self.max_bytes:
+                self._evict(self.max_bytes * 3 // 4, None)
+
+    def preload(self, names, kind='image', threads=2):
+        """Load the files in names on threads worker threads, skipping those
+        already cached. A PreloadJob is returned at once to track progress.
+
+        Files that fail to load are recorded in the job's errors; get() will
+        try them again. If the preloaded assets do not fit in max_bytes, the
+        least recently used ones are dropped as usual, so acquire() what must
+        stay once the job is done.
+        """
+        keys = [self._key(name, kind) for name in names]
+        job = PreloadJob(len(keys))
+        queue = Queue.Queue()
+        for key in keys:
+            queue.put(key)
+        def work():
+            while True:
+                try:
+                    key = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    if self._lookup(key) is None:
+                        self._load(key)
+                except Exception, e:
+                    job._finished((key[1], str(e)))
+                else:
+                    job._finished()
+        for i in xrange(max(1, min(threads, len(keys)))):
+            t = threading.Thread(target=work, name='gummworld2-preload')
+            t.daemon = True
+            job.threads.append(t)
+            t.start()
+        return job
+
+    def discard(self, name, kind='image'):
+        """Drop an asset, pinned or not. For images, the converted copies made
+        by converted() are dropped too.
+        """
+        key = self._key(name, kind)
+        with self._lock:
+            entries = self._entries
+            if kind == 'image':
+                keys = [k for k in entries if k[1] == key[1] and
+                    (k[0] == 'image' or k[0][0] == 'converted')]
+            else:
+                keys = [key]
+            for k in keys:
+                entry = entries.pop(k, None)
+                if entry is not None:
+                    self.nbytes -= entry[1]
+
+    def clear(self):
+        """Drop all assets that are not pinned. The statistics are kept.
+        """
+        with self._lock:
+            entries = self._entries
+            for key in [k for k,e in entries.iteritems() if not e[3]]:
+                self.nbytes -= entries.pop(key)[1]
+
+    def stats(self):
+        """Return a dict of cache statistics: hits, misses, evictions,
+        entries, pinned, nbytes, and max_bytes.
+        """
+        with self._lock:
+            pinned = len([e for e in self._entries.itervalues() if e[3]])
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self._entries),
+            pinned=pinned,
+            nbytes=self.nbytes,
+            max_bytes=self.max_bytes,
+        )
+
+
+# The manager used by pygame_utils.load_image() and toolkit.load_tilesheet().
+asset_manager = AssetManager()
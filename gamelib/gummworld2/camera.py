@@ -27,7 +27,53 @@ camera.py - Camera module for Gummworld2.
 
 import pygame
 
-from gummworld2 import State, MapLayer, Vec2d, geometry
+from gummworld2 import State, Vec2d, geometry
+
+
+class VisibleLayer(object):
+    """A cheap, read-only view of the visible tiles in a MapLayer.
+    
+    Iterating or indexing the view yields the tiles in tile_range that are not
+    None. The tiles are fetched from the layer once, on first access. An
+    invisible layer yields no tiles.
+    """
+    
+    __slots__ = ['layer', 'tile_range', '_tiles']
+    
+    def __init__(self, layer, tile_range):
+        self.layer = layer
+        self.tile_range = tile_range
+        self._tiles = None
+    
+    @property
+    def tile_size(self):
+        return self.layer.tile_size
+    
+    @property
+    def map_size(self):
+        return self.layer.map_size
+    
+    @property
+    def visible(self):
+        return self.layer.visible
+    
+    @property
+    def tiles(self):
+        """The list of visible tiles."""
+        if not self.layer.visible:
+            return []
+        if self._tiles is None:
+            self._tiles = [t for t in self.layer.get_tiles(*self.tile_range) if t]
+        return self._tiles
+    
+    def __iter__(self):
+        return iter(self.tiles)
+    
+    def __len__(self):
+        return len(self.tiles)
+    
+    def __getitem__(self, i):
+        return self.tiles[i]
 
 
 class Camera(object):
@@ -68,7 +114,8 @@ class Camera(object):
     Property visible_tile_range returns a list of map tile positions [(0,0),
     (0,1), ...] that are visible on the screen.
     
-    Property visible_tiles returns a list of MapLayer objects that are visible.
+    Property visible_tiles returns a list of VisibleLayer views of the tiles that
+    are visible.
     
     If creating multiple cameras to save and restore in State contexts, by
     default the state_restored() method updates the new camera from the old.
@@ -93,6 +140,8 @@ class Camera(object):
         self._target = target
         self._prev_target = target
         self._visible_tile_range = []
+        self._tile_range_key = None
+        self._visible_tiles = None
         self._move_to = Vec2d(self.target.position)
         self._move_from = Vec2d(self.target.position)
         self._position = Vec2d(self.target.position)
@@ -149,10 +198,11 @@ class Camera(object):
 #        self._move_from = Vec2d(self._move_to)
 #        self._position = Vec2d(self._move_to)
         self.map = None
+        self.invalidate_tile_range()
         if State.map:
             self._get_visible_tile_range()
         else:
-            self._visible_tile_range = []
+            del self._visible_tile_range[:]
         self.update()
     
     def update(self, *args):
@@ -160,8 +210,11 @@ class Camera(object):
         
         Call in the game's update routine after changing Camera.position.
         """
-        self._position[:] = self._move_from[:] = self._move_to
-        self._move_to[:] = self.target.position
+        move_to = self._move_to
+        x,y = move_to.x,move_to.y
+        self._position.set_ip(x, y)
+        self._move_from.set_ip(x, y)
+        move_to.set_ip(self.target.position)
     
     def interpolate(self, *args):
         """Interpolate camera position towards target for smoother scrolling
@@ -172,8 +225,9 @@ class Camera(object):
         speed.
         """
         interp = State.clock.interpolate
-        x,y = self._position[:] = geometry.interpolant_of_line(
+        x,y = geometry.interpolant_of_line(
             interp, self._move_from, self._move_to)
+        self._position.set_ip(x, y)
         self.rect.center = round(x),round(y)
         self._interp = interp
         self._get_visible_tile_range()
@@ -266,14 +320,18 @@ class Camera(object):
     def world_to_screen(self, xy):
         """Convert coordinates from world space to screen space.
         """
-        world = Vec2d(self.rect.center) - xy
-        return self.abs_screen_center - world
+        cx,cy = self.rect.center
+        ax,ay = self._abs_screen_center
+        x,y = xy
+        return Vec2d(ax - cx + x, ay - cy + y)
         
     def screen_to_world(self, xy):
         """Convert coordinates from screen space to world space.
         """
-        camera = self.target.position
-        return xy + camera - self.abs_screen_center
+        tx,ty = self.target.position
+        ax,ay = self._abs_screen_center
+        x,y = xy
+        return Vec2d(x + tx - ax, y + ty - ay)
         
     @property
     def visible_tile_range(self):
@@ -285,38 +343,72 @@ class Camera(object):
         return self._visible_tile_range
     
     def _get_visible_tile_range(self):
-        range_per_layer = self._visible_tile_range
-        del range_per_layer[:]
-        for layeri,layer in enumerate(State.map.layers):
+        """Internal use. Update visible_tile_range.
+        
+        The ranges are memoized. They are only recomputed when the integer
+        camera rect or the map changes, and then only once per distinct layer
+        tile size. The visible_tile_range list is only modified, and the
+        visible_tiles views discarded, when a range actually changes, i.e. when
+        the camera crosses a tile boundary. The views are also discarded when
+        the map or its number of layers changes.
+        """
+        map = State.map
+        layers = map.layers
+        l,t,w,h = self.rect
+        key = (map, len(layers), l, t, w, h)
+        old_key = self._tile_range_key
+        if key == old_key:
+            return
+        self._tile_range_key = key
+        if old_key is None or key[0:2] != old_key[0:2]:
+            # A different map can give the same ranges, but the views must
+            # see its layers.
+            self._visible_tiles = None
+        r = l+w-1
+        b = t+h-1
+        l = float(l)
+        t = float(t)
+        ranges_by_size = {}
+        ranges = []
+        for layer in layers:
             tile_x,tile_y = layer.tile_size
-            l,t,w,h = self.rect
-            r = l+w-1
-            b = t+h-1
-            left = int(round(float(l) / tile_x)) - 1
-            right = int(round(float(r) / tile_x)) + 1 #2
-            top = int(round(float(t) / tile_y)) - 1
-            bottom = int(round(float(b) / tile_y)) + 1 #2
-            range_per_layer.append((left,top,right,bottom))
+            tile_range = ranges_by_size.get((tile_x,tile_y))
+            if tile_range is None:
+                left = int(round(l / tile_x)) - 1
+                right = int(round(float(r) / tile_x)) + 1 #2
+                top = int(round(t / tile_y)) - 1
+                bottom = int(round(float(b) / tile_y)) + 1 #2
+                tile_range = (left,top,right,bottom)
+                ranges_by_size[tile_x,tile_y] = tile_range
+            ranges.append(tile_range)
+        if ranges != self._visible_tile_range:
+            self._visible_tile_range[:] = ranges
+            self._visible_tiles = None
+    
+    def invalidate_tile_range(self):
+        """Force visible_tile_range to be recomputed on the next update.
         
+        This is only needed if a layer in State.map is replaced or resized in
+        place, or if tiles are edited and visible_tiles must see the change.
+        """
+        self._tile_range_key = None
+        self._visible_tiles = None
+    
     @property
     def visible_tiles(self):
-        """A list of MapLayer objects that would be visible on the display
-        surface.
+        """A list of VisibleLayer views, one per map layer, of the tiles that
+        would be visible on the display surface.
+        
+        The list is cached until visible_tile_range changes. Each view gets its
+        tiles from the layer the first time they are needed.
         """
-        tile_per_layer = []
-        tile_range = self.visible_tile_range
-        map = State.map
-        get_tiles = map.get_tiles
-        for layeri,layer in enumerate(State.map.layers):
-            tile_size,map_size,visible = layer.tile_size, layer.map_size, layer.visible
-            new_layer = MapLayer(tile_size,map_size,visible)
-            if visible:
-                tiles = get_tiles(*tile_range[layeri], layer=layeri)
-                new_layer.update([(tile.name,tile)
-                    for tile in get_tiles(*tile_range[layeri], layer=layeri)
-                ])
-            tile_per_layer.append(new_layer)
-        return tile_per_layer
+        if self._visible_tiles is None:
+            self._visible_tiles = [
+                VisibleLayer(layer, tile_range)
+                for layer,tile_range in zip(
+                    State.map.layers, self._visible_tile_range)
+            ]
+        return self._visible_tiles
     
     def state_restored(self, prev):
         """Sync a stale camera after swapping it in.
@@ -333,6 +425,5 @@ class Camera(object):
             self._move_from = prev._move_from
             self._move_to = prev._move_to
             self._position = prev._position
-            self._get_visible_tile_range()
-        else:
-            self._get_visible_tile_range()
+        self.invalidate_tile_range()
+        self._get_visible_tile_range()
@@ -30,10 +30,25 @@ This is an unfinished concept.
 import pygame
 from pygame.locals import Color, Rect, SRCALPHA
 
+from gummworld2 import State
+
 
 class Canvas(object):
+    """Draw on the canvas's surface, then rotate() it onto the screen.
+    
+    Rotating a full-screen SRCALPHA surface every frame is expensive, so
+    rotate() avoids as much work as it can:
+    
+    1.  If neither the angle nor the canvas contents changed since the last
+        rotate(), the previous result is blitted again.
+    2.  If view_only is True, only the square around the viewer circle is
+        rotated, since that is all draw() leaves visible.
+    3.  If resolution is less than 1.0, the region is scaled down by that
+        factor, rotated, and smoothscaled back up. This trades sharpness
+        for speed; 0.5 rotates a quarter of the pixels.
+    """
     
-    def __init__(self):
+    def __init__(self, view_only=True, resolution=1.0):
         rect = pygame.display.get_surface().get_rect()
         # SRCALPHA prevents unwanted fill colors in the padded area of the
         # rotated surface.
@@ -41,34 +56,70 @@ class Canvas(object):
         self.eraser = pygame.surface.Surface(rect.size)
         self.eraser.fill(Color('black'))
         self.viewer = self.eraser.copy()
+        self.radius = rect.width/2-2
         pygame.draw.circle(
-            self.viewer, Color('white'), rect.center, rect.width/2-2
+            self.viewer, Color('white'), rect.center, self.radius
         )
         self.viewer.set_colorkey(Color('white'))
         
         self.draw_viewer = False
+        self.view_only = view_only
+        self.resolution = resolution
+        
+        # The last rotation: angle, settings, and result.
+        self._dirty = True
+        self._key = None
+        self._rotated = None
     
     def clear(self):
         """Clear the canvas's surface.
         """
         self.surface.blit(self.eraser, (0,0))
+        self._dirty = True
     
     def blit(self, sprite):
         """Blit a sprite to the canvas's surface.
         """
         self.surface.blit(sprite.image, sprite.rect)
+        self._dirty = True
     
     def rotate(self, angle):
-        """Rotate the canvas by angle.
+        """Rotate the canvas by angle and blit it centered on the screen.
         """
-        rotated_surface = pygame.transform.rotate(
-            self.surface, angle)
         screen = State.screen.surface
+        key = angle % 360, self.view_only, self.resolution
+        if self._dirty or key != self._key:
+            self._rotated = self._rotate(key[0])
+            self._key = key
+            self._dirty = False
+        rotated_surface = self._rotated
         rect = rotated_surface.get_rect()
         rect.center = screen.get_rect().center
         screen.blit(rotated_surface, rect)
+    
+    def _rotate(self, angle):
+        """Internal use. Return the rotated surface or region.
+        """
+        surface = self.surface
+        if self.view_only:
+            srect = surface.get_rect()
+            rect = Rect(0, 0, self.radius*2+2, self.radius*2+2)
+            rect.center = srect.center
+            surface = surface.subsurface(rect.clip(srect))
+        if angle == 0:
+            return surface
+        resolution = self.resolution
+        if resolution >= 1.0:
+            return pygame.transform.rotate(surface, angle)
+        w,h = surface.get_size()
+        small = pygame.transform.scale(
+            surface, (max(1,int(w*resolution)), max(1,int(h*resolution))))
+        small = pygame.transform.rotate(small, angle)
+        w,h = small.get_size()
+        return pygame.transform.smoothscale(
+            small, (int(round(w/resolution)), int(round(h/resolution))))
         
     def draw(self):
         """Draw the canvas on the display.
         """
-        screen.blit(self.viewer, (0,0))
+        State.screen.surface.blit(self.viewer, (0,0))
@@ -69,6 +69,7 @@ NO_WORLD = 0
 SIMPLE_WORLD = 1
 QUADTREE_WORLD = 2
 PYMUNK_WORLD = 3
+ARRAY_WORLD = 4
 
 
 class Engine(Context):
@@ -77,6 +78,7 @@ class Engine(Context):
     SIMPLE_WORLD = SIMPLE_WORLD
     QUADTREE_WORLD = QUADTREE_WORLD
     PYMUNK_WORLD = PYMUNK_WORLD
+    ARRAY_WORLD = ARRAY_WORLD
     
     def __init__(self,
         screen_surface=None, resolution=None, display_flags=0, caption=None,
@@ -150,7 +152,7 @@ class Engine(Context):
             
             The world_type argument specifies which of the world classes to
             create. It must be one of engine.NO_WORLD, engine.SIMPLE_WORLD,
-            engine.QUADTREE_WORLD, engine.PYMUNK_WORLD.
+            engine.QUADTREE_WORLD, engine.PYMUNK_WORLD, engine.ARRAY_WORLD.
             
             The world_args argument is a dict that can be passed verbatim to
             the world constructor (see the World* classes in the model module)
@@ -259,6 +261,12 @@ class Engine(Context):
             if camera_target is None:
                 if __debug__: print 'Engine: making camera target QuadTreeObject()'
                 self.camera_target = model.QuadTreeObject(pygame.Rect(0,0,20,20))
+        elif world_type == ARRAY_WORLD:
+            if __debug__: print 'Engine: WorldArray(self.map.rect, **world_args)'
+            self.world = model.WorldArray(self.map.rect, **world_args)
+            if camera_target is None:
+                if __debug__: print 'Engine: making camera target Object()'
+                self.camera_target = model.Object()
         
         ## Create the camera.
         if any((self.camera_target, camera_view, camera_view_rect)):
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """entitystore.py - Region-paged world entities for Gummworld2.
+
+For worlds too big to hold every entity at once, a region store keeps the
+entities on disk, grouped by the world cell their center is in. RegionStore
+memory-maps the file and keeps only the cells near the camera resident in the
+world quadtree:
+
+    A cell is paged in when it overlaps the camera rect grown by load_margin.
+    A cell is paged out when it no longer overlaps the camera rect grown by
+    evict_margin.
+
+evict_margin is larger than load_margin, so a camera that wanders back and
+forth over a cell boundary does not load and evict the same cell over and over.
+
+A store file is written by write_region_store() from entity records (see
+toolkit.entity_record), or by build_region_store() from an entity file in the
+text or binary format. Records are encoded as in toolkit's binary entity
+format. The layout, all little-endian:
+
+    header      '<4sHHIIII' magic 'GW2R', version, 0, cell width, cell height,
+                    num cells, num strings
+    strings     num strings * ('<I' length, user_data)
+    index       num cells * ('<iiII' cell x, cell y, offset, num records)
+    cells       the records of each cell, at the offset given in the index, in
+                    the binary entity format's record layout (see
+                    toolkit.pack_entity_record)
+
+Entities that are paged out are dropped, and fresh ones are made when their
+cell is paged in again. The store is meant for static scenery; changes made to
+resident entities are not kept.
+
+Usage:
+
+    build_region_store(
+        data.filepath('map', 'big.entities'), 'big.regions', (1024,1024))
+    store = RegionStore('big.regions')
+    ...
+    def update(self, dt):
+        store.update()
+"""
+
+
+import mmap
+import struct
+
+import pygame
+
+from gummworld2 import State, toolkit
+from gummworld2.toolkit import entity_record_center as record_center
+from gummworld2.toolkit import make_entity, pack_entity_record, \
+    unpack_entity_record
+from gummworld2.geometry import RectGeometry, PolyGeometry, CircleGeometry
+
+
+REGION_FILE_MAGIC = 'GW2R'
+REGION_FILE_VERSION = 1
+
+_HEADER = struct.Struct('<4sHHIIII')
+_LENGTH = struct.Struct('<I')
+_INDEX = struct.Struct('<iiII')
+
+
+def write_region_store(fh, records, cell_size=(1024,1024)):
+    """Write entity records to file fh as a region store with cells of
+    cell_size pixels. fh must be opened in binary mode. Return the number of
+    cells.
+    """
+    cw,ch = int(cell_size[0]),int(cell_size[1])
+    strings = []
+    string_index = {}
+    cells = {}
+    for record in records:
+        kind,values,user_data = record
+        i = string_index.get(user_data)
+        if i is None:
+            i = string_index[user_data] = len(strings)
+            strings.append(user_data)
+        x,y = record_center(record)
+        key = int(x // cw), int(y // ch)
+        blob = pack_entity_record(kind, values, i)
+        cells.setdefault(key, []).append(blob)
+    
+    write = fh.write
+    write(_HEADER.pack(REGION_FILE_MAGIC, REGION_FILE_VERSION, 0,
+        cw, ch, len(cells), len(strings)))
+    for string in strings:
+        write(_LENGTH.pack(len(string)))
+        write(string)
+    # The cell data follows the index.
+    keys = sorted(cells)
+    offset = fh.tell() + _INDEX.size * len(keys)
+    for key in keys:
+        blobs = cells[key]
+        write(_INDEX.pack(key[0], key[1], offset, len(blobs)))
+        offset += sum([len(b) for b in blobs])
+    for key in keys:
+        write(''.join(cells[key]))
+    return len(keys)
+
+# write_region_store
+
+
+def build_region_store(entity_path, store_path, cell_size=(1024,1024)):
+    """Build a region store at store_path from the entity file at entity_path,
+    which may be in the text or the binary format. Return the number of cells.
+    """
+    fh = open(entity_path, 'rb')
+    try:
+        if toolkit.is_entity_file_binary(fh):
+            records = list(toolkit.EntityFileReader(fh))
+        else:
+            records = list(toolkit.read_entity_records(fh))
+    finally:
+        fh.close()
+    fh = open(store_path, 'wb')
+    try:
+        return write_region_store(fh, records, cell_size)
+    finally:
+        fh.close()
+
+# build_region_store
+
+
+class RegionStore(object):
+    """Page the entities of a region store in and out of a world.
+    
+    Parameters:
+        path -> String. The region store file.
+        world -> The QuadTree to page entities into. If None, State.world is
+            used at each update.
+        load_margin -> (int,int). Cells within this many pixels of the camera
+            rect are paged in. If None, one cell.
+        evict_margin -> (int,int). Cells farther than this from the camera rect
+            are paged out. If None, two cells. It must not be smaller than
+            load_margin.
+        cls_dict -> A dict of shape classes, as for toolkit.load_entities().
+        load_tiles -> Boolean. If True, the tilesheets named in the entities'
+            user_data are loaded into the tilesheets attribute, as
+            toolkit.import_world_quadtree() does.
+    Attributes:
+        cell_size -> (int,int). The size of a cell in pixels.
+        resident -> Dict of the resident cells' entities, keyed by cell (x,y).
+        tilesheets -> Dict of toolkit.Tilesheet, keyed by relative path.
+    Methods:
+        update() -> Page cells in and out around the camera.
+        load_cell() -> Page a cell in.
+        evict_cell() -> Page a cell out.
+        evict_all() -> Page all cells out.
+        stats() -> A dict of paging statistics.
+        close() -> Page all cells out and close the file.
+    """
+    
+    def __init__(self, path, world=None, load_margin=None, evict_margin=None,
+        cls_dict={}, load_tiles=False):
+        self.world = world
+        self.rect_cls = cls_dict.get('rect_cls', RectGeometry)
+        self.poly_cls = cls_dict.get('poly_cls', PolyGeometry)
+        self.circle_cls = cls_dict.get('circle_cls', CircleGeometry)
+        self.load_tiles = load_tiles
+        self.tilesheets = {}
+        self.resident = {}
+        
+        self.fh = open(path, 'rb')
+        self.buffer = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self.buffer
+        magic,version,junk,cw,ch,num_cells,num_strings = \
+            _HEADER.unpack_from(buf, 0)
+        if magic != REGION_FILE_MAGIC:
+            self.close()
+            raise pygame.error, 'not a region store: ' + path
+        if version > REGION_FILE_VERSION:
+            self.close()
+            raise pygame.error, 'region store version %d is not supported' % version
+        self.cell_size = cw,ch
+        pos = _HEADER.size
+        strings = []
+        for i in xrange(num_strings):
+            n, = _LENGTH.unpack_from(buf, pos)
+            pos += _LENGTH.size
+            strings.append(buf[pos:pos+n])
+            pos += n
+        self.strings = strings
+        self._user_data = {}    # {string index : user_data}
+        index = {}
+        for i in xrange(num_cells):
+            cx,cy,offset,count = _INDEX.unpack_from(buf, pos)
+            index[cx,cy] = offset,count
+            pos += _INDEX.size
+        self.index = index
+        
+        if load_margin is None:
+            load_margin = cw,ch
+        if evict_margin is None:
+            evict_margin = cw*2,ch*2
+        self.load_margin = load_margin
+        self.evict_margin = (max(evict_margin[0], load_margin[0]),
+            max(evict_margin[1], load_margin[1]))
+        
+        self._last_range = None
+        self.loads = 0
+        self.evictions = 0
+        self.entities_loaded = 0
+    
+    def _cell_range(self, rect):
+        """Internal use. Return the range of cells (x1,y1,x2,y2) overlapping
+        rect. x2 and y2 are exclusive.
+        """
+        cw,ch = self.cell_size
+        return (rect.left // cw, rect.top // ch,
+            (rect.right - 1) // cw + 1, (rect.bottom - 1) // ch + 1)
+    
+    def update(self, camera=None):
+        """Page in the cells near the camera and page out the distant ones.
+        Return True if any cells were paged. If camera is None, State.camera
+        is used.
+        """
+        if camera is None:
+            camera = State.camera
+        rect = camera.rect
+        lx,ly = self.load_margin
+        load_range = self._cell_range(rect.inflate(lx*2, ly*2))
+        ex,ey = self.evict_margin
+        evict_range = self._cell_range(rect.inflate(ex*2, ey*2))
+        ranges = load_range,evict_range
+        if ranges == self._last_range:
+            return False
+        self._last_range = ranges
+        
+        x1,y1,x2,y2 = evict_range
+        doomed = [key for key in self.resident
+            if not (x1 <= key[0] < x2 and y1 <= key[1] < y2)]
+        for key in doomed:
+            self.evict_cell(key)
+        
+        x1,y1,x2,y2 = load_range
+        index = self.index
+        resident = self.resident
+        loaded = 0
+        for cy in xrange(y1, y2):
+            for cx in xrange(x1, x2):
+                key = cx,cy
+                if key in index and key not in resident:
+                    self.load_cell(key)
+                    loaded += 1
+        return bool(doomed or loaded)
+    
+    def _make_entities(self, offset, count):
+        """Internal use. Make the entities of count records at offset.
+        """
+        buf = self.buffer
+        strings = self.strings
+        user_datas = self._user_data
+        rect_cls = self.rect_cls
+        circle_cls = self.circle_cls
+        poly_cls = self.poly_cls
+        entities = []
+        append = entities.append
+        pos = offset
+        for i in xrange(count):
+            kind,values,string_i,pos = unpack_entity_record(buf, pos)
+            entity = make_entity(kind, values, rect_cls, poly_cls, circle_cls)
+            user_data = user_datas.get(string_i)
+            if user_data is None:
+                user_data = strings[string_i]
+                if self.load_tiles:
+                    user_data = toolkit.load_user_data_tiles(
+                        user_data, self.tilesheets)
+                user_datas[string_i] = user_data
+            entity.user_data = user_data
+            append(entity)
+        return entities
+    
+    def _get_world(self):
+        world = self.world
+        if world is None:
+            world = State.world
+        return world
+    
+    def load_cell(self, key):
+        """Page in cell key (x,y), if the store has it and it is not resident.
+        """
+        if key in self.resident or key not in self.index:
+            return
+        offset,count = self.index[key]
+        entities = self._make_entities(offset, count)
+        self._get_world().add_bulk(entities)
+        self.resident[key] = entities
+        self.loads += 1
+        self.entities_loaded += count
+    
+    def evict_cell(self, key):
+        """Page out cell key (x,y), if it is resident.
+        """
+        entities = self.resident.pop(key, None)
+        if entities is not None:
+            self._get_world().remove_bulk(entities)
+            self.evictions += 1
+    
+    def evict_all(self):
+        """Page out every resident cell.
+        """
+        for key in self.resident.keys():
+            self.evict_cell(key)
+        self._last_range = None
+    
+    def stats(self):
+        """Return a dict of paging statistics: cells, resident_cells,
+        resident_entities, loads, evictions, and entities_loaded.
+        """
+        return dict(
+            cells=len(self.index),
+            resident_cells=len(self.resident),
+            resident_entities=sum([len(e) for e in self.resident.itervalues()]),
+            loads=self.loads,
+            evictions=self.evictions,
+            entities_loaded=self.entities_loaded,
+        )
+    
+    def close(self):
+        """Page out every resident cell and close the file.
+        """
+        if self.resident:
+            self.evict_all()
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
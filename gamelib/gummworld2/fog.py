@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """fog.py - Fog of war for Gummworld2.
+
+Fog tracks the visibility of every map tile in a bytearray, one byte per tile:
+UNEXPLORED, EXPLORED (seen before), or VISIBLE (seen now). Each update, the
+viewers' positions and sight radii are compared with the last update; if no
+viewer crossed into another tile, nothing is recomputed.
+
+To draw, the tiles under the camera are rendered into a mask with one pixel
+per tile, which is smoothscaled up to world size and multiplied onto the
+camera's surface with a single blit. The scaled mask is kept until the
+visibility or the camera's tile range changes, so a still or slowly scrolling
+scene costs only the blit.
+
+Usage:
+
+    fog = Fog(State.map.tile_size, State.map.map_size)
+    ...
+    def update(self, dt):
+        fog.update([(hero.position, 200)])
+    def draw(self, dt):
+        toolkit.draw_tiles()
+        fog.draw()
+"""
+
+
+import pygame
+from pygame.locals import BLEND_RGB_MULT
+
+from gummworld2 import State
+
+
+UNEXPLORED = 0
+EXPLORED = 1
+VISIBLE = 2
+
+
+class Fog(object):
+    """Per-tile fog of war.
+
+    Parameters:
+        tile_size -> (int,int). The map's tile size.
+        map_size -> (int,int). The map's size in tiles.
+        colors -> A sequence of three RGB colors to multiply the screen by for
+            UNEXPLORED, EXPLORED, and VISIBLE tiles.
+    Attributes:
+        grid -> bytearray. The visibility of tile x,y is grid[y*map_w+x].
+        version -> Integer. Incremented each time the grid changes.
+    Methods:
+        update() -> Update visibility from viewer positions.
+        state_at() -> The visibility of a tile.
+        reset() -> Make every tile UNEXPLORED.
+        draw() -> Draw the fog on the camera's surface.
+    """
+
+    def __init__(self, tile_size, map_size,
+        colors=((0,0,0), (96,96,96), (255,255,255))):
+        self.tile_size = int(tile_size[0]),int(tile_size[1])
+        self.map_size = int(map_size[0]),int(map_size[1])
+        self.colors = list(colors)
+        mw,mh = self.map_size
+        self.grid = bytearray(mw * mh)
+        self.version = 0
+        self._visible = set()
+        self._viewers_key = None
+        self._mask = None
+        self._mask_key = None
+
+    def state_at(self, x, y):
+        """Return the visibility of tile x,y.
+        """
+        return self.grid[y * self.map_size[0] + x]
+
+    def reset(self):
+        """Make every tile UNEXPLORED.
+        """
+        mw,mh = self.map_size
+        self.grid = bytearray(mw * mh)
+        self._visible = set()
+        self._viewers_key = None
+        self.version += 1
+
+    def update(self, viewers):
+        """Update the grid from viewers, a sequence of (position, radius) in
+        world coordinates. Tiles that were VISIBLE and are not seen now become
+        EXPLORED. Return True if the grid changed.
+        """
+        tw,th = self.tile_size
+        key = tuple([(int(p[0]//tw), int(p[1]//th), r) for p,r in viewers])
+        if key == self._viewers_key:
+            return False
+        self._viewers_key = key
+        mw,mh = self.map_size
+        visible = set()
+        add = visible.add
+        for vx,vy,r in key:
+            # Measured from tile center to tile center.
+            rx = int(r // tw)
+            ry = int(r // th)
+            r2 = r * r
+            for y in xrange(max(0, vy-ry), min(mh, vy+ry+1)):
+                dy = (y - vy) * th
+                dy2 = dy * dy
+                yoff = y * mw
+                for x in xrange(max(0, vx-rx), min(mw, vx+rx+1)):
+                    dx = (x - vx) * tw
+                    if dx*dx + dy2 <= r2:
+                        add(yoff + x)
+        if visible == self._visible:
+            return False
+        grid = self.grid
+        for i in self._visible - visible:
+            grid[i] = EXPLORED
+        for i in visible - self._visible:
+            grid[i] = VISIBLE
+        self._visible = visible
+        self.version += 1
+        return True
+
+    def _tile_range(self, rect):
+        tw,th = self.tile_size
+        mw,mh = self.map_size
+        x,y,w,h = rect
+        return (
+            max(0, x // tw), max(0, y // th),
+            min(mw, (x + w) // tw + 1), min(mh, (y + h) // th + 1),
+        )
+
+    def _render_mask(self, x1, y1, x2, y2):
+        """Internal use. Return the mask for the tile range, scaled to world
+        size.
+        """
+        mw = self.map_size[0]
+        grid = self.grid
+        w,h = x2-x1, y2-y1
+        data = ''.join([
+            str(grid[y*mw+x1:y*mw+x2]) for y in xrange(y1, y2)
+        ])
+        small = pygame.image.fromstring(data, (w,h), 'P')
+        small.set_palette(self.colors)
+        rgb = pygame.Surface((w,h), 0, 32)
+        rgb.blit(small, (0,0))
+        tw,th = self.tile_size
+        return pygame.transform.smoothscale(rgb, (w*tw, h*th))
+
+    def draw(self, camera=None):
+        """Draw the fog on the camera's surface. If camera is None,
+        State.camera is used.
+        """
+        if camera is None:
+            camera = State.camera
+        rect = camera.rect
+        x1,y1,x2,y2 = tile_range = self._tile_range(rect)
+        if x1 >= x2 or y1 >= y2:
+            return
+        key = tile_range,self.version
+        if key != self._mask_key:
+            self._mask = self._render_mask(*tile_range)
+            self._mask_key = key
+        tw,th = self.tile_size
+        camera.surface.blit(self._mask, (x1*tw-rect.x, y1*th-rect.y),
+            special_flags=BLEND_RGB_MULT)
+
@@ -103,6 +103,13 @@ Time dilation (affects DT and interval timers):
     clock.dilation = slow_mo
     clock.dilation = normal
 
+Background jobs (see the jobs module; callbacks are delivered on update_ready):
+
+    def path_found(job):
+        "..."
+    jobs = JobManager(clock, num_threads=2, max_per_tick=4, pri=-0.5)
+    jobs.submit(find_path, start, goal, callback=path_found)
+
 CREDITS
 
 The inspiration for this module came from Koen Witters's superb article
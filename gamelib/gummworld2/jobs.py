@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """jobs.py - Background jobs for Gummworld2.
+
+JobManager runs expensive work (pathfinding, collapse_map_layer, pre-rendering,
+loading entity files, etc.) on worker threads so it does not stall the frame.
+When a job finishes, its callback is run on the main thread by the clock, at
+the point in the update schedule chosen by the pri argument. Only max_per_tick
+completions are delivered each update, so a burst of finished jobs cannot blow
+the update budget.
+
+Usage:
+
+    def done(job):
+        State.map = job.result
+    jobs = JobManager(State.clock, num_threads=2)
+    jobs.submit(toolkit.collapse_map, State.map, (2,2), callback=done)
+    ...
+    jobs.shutdown()
+
+Jobs are started in order of priority, low to high, then in order of
+submission. Threads are a good fit for work that spends its time in pygame or
+file I/O, which release the GIL. For pure-Python CPU work pass num_processes>0
+and submit with process=True; the job's function and arguments must then be
+picklable (module-level functions, no surfaces), and its result is pickled back
+to the main process.
+
+Callbacks are called with the Job as the only argument. If a job raises and
+has no errback, the exception is re-raised on the main thread when the job is
+delivered, just as it would have been if the work was done inline.
+"""
+
+
+import sys
+import threading
+import Queue
+
+
+class Job(object):
+    """A unit of work submitted to a JobManager.
+
+    Attributes:
+        func, args, kwargs -> The work to do: func(*args, **kwargs).
+        pri -> Priority. Lower values are started first.
+        result -> The return value of func, after the job is done.
+        exc_info -> sys.exc_info() if func raised, else None.
+        done -> True after the job has run.
+        cancelled -> True if cancel() was called before the job started.
+    """
+    __slots__ = [
+        'func', 'args', 'kwargs', 'pri', 'process', 'callback', 'errback',
+        'result', 'exc_info', 'done', 'cancelled',
+    ]
+
+    def __init__(self, func, args, kwargs, pri, process, callback, errback):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.pri = pri
+        self.process = process
+        self.callback = callback
+        self.errback = errback
+        self.result = None
+        self.exc_info = None
+        self.done = False
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the job. A job that has already started will still run, but
+        its callbacks will not be called.
+        """
+        self.cancelled = True
+
+    @property
+    def failed(self):
+        """True if the job raised an exception."""
+        return self.exc_info is not None
+
+
+class JobManager(object):
+    """Run jobs on a pool of worker threads, and deliver the results on the
+    main thread via the clock's update schedule.
+
+    Parameters:
+        clock -> GameClock. If not None, deliver() is scheduled on it with
+            schedule_update_priority(deliver, pri). If None, call deliver()
+            yourself.
+        num_threads -> Positive integer. The number of worker threads.
+        num_processes -> Integer. If greater than zero, a multiprocessing pool
+            of this size is created on first use for jobs submitted with
+            process=True.
+        max_per_tick -> Integer. The maximum number of completions delivered
+            per call to deliver(). Zero means no limit.
+        pri -> Float. The update schedule priority for deliver().
+    Properties:
+        pending -> Read-only. Jobs submitted and not yet delivered.
+    Methods:
+        submit() -> Queue a job.
+        deliver() -> Run callbacks of completed jobs.
+        shutdown() -> Stop the workers.
+    """
+
+    def __init__(self, clock=None, num_threads=2, num_processes=0,
+        max_per_tick=0, pri=0.0):
+        self.max_per_tick = max_per_tick
+        self.num_processes = num_processes
+        self._pool = None
+        self._seq = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._todo = Queue.PriorityQueue()
+        self._completed = Queue.Queue()
+        self._threads = []
+        for i in range(max(1, num_threads)):
+            t = threading.Thread(target=self._work, name='gummworld2-job-%d'%i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+        self.clock = None
+        if clock is not None:
+            self.attach(clock, pri)
+
+    def attach(self, clock, pri=0.0):
+        """Schedule deliver() on clock at update priority pri. This can be used
+        to move delivery to a different point in the update schedule.
+        """
+        self.detach()
+        self.clock = clock
+        clock.schedule_update_priority(self.deliver, pri)
+
+    def detach(self):
+        """Unschedule deliver() from the clock.
+        """
+        if self.clock is not None:
+            self.clock.unschedule(self.deliver)
+            self.clock = None
+
+    @property
+    def pending(self):
+        """The number of jobs submitted and not yet delivered."""
+        return self._pending
+
+    def submit(self, func, *args, **kwargs):
+        """submit(func, *args, pri=0.0, process=False, callback=None,
+        errback=None, **kwargs)
+
+        Queue func(*args, **kwargs) to be run by a worker. Return the Job.
+
+        The pri argument is the job priority; lower values are started first.
+
+        If the process argument is True and the manager has num_processes>0,
+        func is run in the process pool instead of on the worker thread.
+
+        The callback argument is called as callback(job) on the main thread when
+        the job completes. The errback argument is called likewise if the job
+        raised.
+        """
+        pri = kwargs.pop('pri', 0.0)
+        process = kwargs.pop('process', False)
+        callback = kwargs.pop('callback', None)
+        errback = kwargs.pop('errback', None)
+        job = Job(func, args, kwargs, pri, process, callback, errback)
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._pending += 1
+        self._todo.put((pri, seq, job))
+        return job
+
+    def deliver(self, dt=0.0):
+        """Run the callbacks of completed jobs. Return the number delivered.
+
+        This is normally called by the clock. At most max_per_tick jobs are
+        delivered; the rest wait for the next call.
+        """
+        n = 0
+        limit = self.max_per_tick
+        get = self._completed.get_nowait
+        while not limit or n < limit:
+            try:
+                job = get()
+            except Queue.Empty:
+                break
+            n += 1
+            with self._lock:
+                self._pending -= 1
+            if job.cancelled:
+                continue
+            if job.exc_info is not None:
+                if job.errback is not None:
+                    job.errback(job)
+                else:
+                    exc_type,exc_value,tb = job.exc_info
+                    raise exc_type, exc_value, tb
+            elif job.callback is not None:
+                job.callback(job)
+        return n
+
+    def shutdown(self, wait=False):
+        """Stop the worker threads and the process pool. Jobs that have not
+        started are discarded. If wait is True, block until running jobs
+        finish.
+        """
+        self.detach()
+        try:
+            while True:
+                pri,seq,job = self._todo.get_nowait()
+                job.cancel()
+                with self._lock:
+                    self._pending -= 1
+        except Queue.Empty:
+            pass
+        for t in self._threads:
+            # None sorts before any job, so the workers see it next.
+            self._todo.put((None, 0, None))
+        if wait:
+            for t in self._threads:
+                t.join()
+        del self._threads[:]
+        if self._pool is not None:
+            self._pool.close()
+            if wait:
+                self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        """Internal use. Create the process pool on first use.
+        """
+        with self._lock:
+            if self._pool is None:
+                import multiprocessing
+                self._pool = multiprocessing.Pool(self.num_processes)
+            return self._pool
+
+    def _work(self):
+        """Internal use. Worker thread loop.
+        """
+        get = self._todo.get
+        put = self._completed.put
+        while True:
+            pri,seq,job = get()
+            if job is None:
+                return
+            if not job.cancelled:
+                try:
+                    if job.process and self.num_processes > 0:
+                        job.result = self._get_pool().apply(
+                            job.func, job.args, job.kwargs)
+                    else:
+                        job.result = job.func(*job.args, **job.kwargs)
+                except Exception:
+                    job.exc_info = sys.exc_info()
+            job.done = True
+            put(job)
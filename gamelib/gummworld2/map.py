@@ -98,6 +98,9 @@ class Map(object):
         self.map_size = Vec2d(map_size)
         self.layers = []
         self.subpixel_cache = {}
+        # The ChunkCache shared by all cameras that draw this map; see
+        # tilecache.shared_cache().
+        self.render_cache = None
         
         tw,th = tile_size
         mw,mh = map_size
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """minimap.py - A cached minimap for Gummworld2.
+
+The minimap keeps three things apart so that each is only redone when it must
+be:
+
+1.  The backdrop, the map layers shrunk to the minimap's size. Each tile is
+    reduced to its average color, one pixel per tile, and the result is
+    smoothscaled once. It is rebuilt only after invalidate() or
+    invalidate_tile(), e.g. when tiles are edited.
+2.  The markers, one dot per entity, drawn on a copy of the backdrop. They
+    are refreshed by refresh(), at the interval given to the constructor,
+    independent of the frame rate. If numpy is available the dots are written
+    in bulk with pygame.surfarray; otherwise a PixelArray is used.
+3.  The camera rectangle, which is cheap and drawn every frame by draw().
+
+Usage:
+
+    minimap = Minimap(Rect(475,25,100,100), entities=sprite_group, interval=0.1)
+    ...
+    def draw(self, dt):
+        ...
+        minimap.draw()
+"""
+
+
+if __name__ == '__main__':
+    import paths
+
+import pygame
+from pygame.locals import Color
+
+try:
+    import numpy
+except:
+    numpy = None
+
+from gummworld2 import State
+
+
+class Minimap(object):
+    """A minimap of the whole map with entity markers.
+
+    Parameters:
+        rect -> Rect. The minimap's position and size on the screen.
+        map -> Map. The map to show. If None, State.map is used.
+        entities -> The entities to mark, or None. Either an iterable of
+            objects with a rect, an (n,2) numpy array of world positions (such
+            as WorldArray.positions), or a callable returning one of these.
+        interval -> Float, seconds. If not None, refresh() is scheduled on
+            State.clock at this interval. If None, call refresh() yourself.
+        marker_color -> Color of the entity markers.
+        marker_size -> Integer. Marker width and height in pixels.
+        camera_color -> Color of the camera rect outline, or None.
+        border_color -> Color of the border around the minimap, or None.
+    Methods:
+        refresh() -> Redraw the markers.
+        invalidate() -> Rebuild the backdrop on the next refresh().
+        invalidate_tile() -> Rebuild one tile of the backdrop.
+        draw() -> Draw the minimap on the screen.
+    """
+
+    def __init__(self, rect, map=None, entities=None, interval=0.1,
+        marker_color=Color('white'), marker_size=1,
+        camera_color=Color(200,0,255), border_color=Color(99,99,99)):
+        self.rect = pygame.Rect(rect)
+        self.map = map if map is not None else State.map
+        self.entities = entities
+        self.marker_color = Color(*marker_color)
+        self.marker_size = marker_size
+        self.camera_color = camera_color
+        self.border_color = border_color
+
+        mw,mh = self.rect.size
+        map_w,map_h = self.map.rect.size
+        self.scale = float(mw) / map_w, float(mh) / map_h
+
+        self._tiles = None          # one pixel per tile
+        self._backdrop = None       # _tiles scaled to minimap size
+        self._colors = {}           # {tile image : average color}
+        self.image = None           # backdrop plus markers
+
+        self.clock = None
+        if interval is not None:
+            self.clock = State.clock
+            self.clock.schedule_interval(self.refresh, interval)
+
+    def close(self):
+        """Unschedule refresh() from the clock.
+        """
+        if self.clock is not None:
+            self.clock.unschedule(self.refresh)
+            self.clock = None
+
+    def invalidate(self):
+        """Rebuild the whole backdrop on the next refresh(). Call this after
+        replacing layers or many tiles.
+        """
+        self._tiles = None
+        self._backdrop = None
+        self._colors.clear()
+
+    def invalidate_tile(self, x, y):
+        """Rebuild the backdrop pixel for tile x,y on the next refresh(). Call
+        this after changing a tile's image.
+        """
+        if self._tiles is not None:
+            self._tiles.set_at((x,y), self._tile_color(x, y))
+            self._backdrop = None
+
+    def _tile_color(self, x, y):
+        """Internal use. Return the average color of the top-most tile at x,y.
+        """
+        colors = self._colors
+        tw,th = self.map.tile_size
+        for layer in reversed(self.map.layers):
+            if not layer.visible:
+                continue
+            # Collapsed layers have bigger tiles than the map.
+            lw,lh = layer.tile_size
+            s = layer.get_tile_at(x*tw//lw, y*th//lh)
+            if s:
+                image = s.image
+                color = colors.get(image)
+                if color is None:
+                    color = colors[image] = pygame.transform.average_color(image)
+                return color
+        return (0,0,0)
+
+    def _make_backdrop(self):
+        """Internal use. Return the backdrop surface.
+        """
+        if self._tiles is None:
+            map_w,map_h = self.map.map_size
+            tiles = pygame.Surface((map_w,map_h), 0, 32)
+            set_at = tiles.set_at
+            color = self._tile_color
+            for y in xrange(map_h):
+                for x in xrange(map_w):
+                    set_at((x,y), color(x, y))
+            self._tiles = tiles
+        return pygame.transform.smoothscale(self._tiles, self.rect.size)
+
+    def _marker_positions(self):
+        """Internal use. Return the entities' minimap positions as a pair of
+        sequences (xs, ys).
+        """
+        entities = self.entities
+        if callable(entities):
+            entities = entities()
+        if entities is None:
+            if numpy is not None:
+                return numpy.empty(0, int),numpy.empty(0, int)
+            return (),()
+        sx,sy = self.scale
+        if numpy is not None and isinstance(entities, numpy.ndarray):
+            points = entities
+        else:
+            points = [s.rect.center for s in entities]
+            if numpy is not None:
+                points = numpy.array(points, dtype=float).reshape(-1,2)
+        if numpy is not None:
+            w,h = self.rect.size
+            size = self.marker_size
+            xs = (points[:,0] * sx).astype(int)
+            ys = (points[:,1] * sy).astype(int)
+            numpy.clip(xs, 0, w - size, xs)
+            numpy.clip(ys, 0, h - size, ys)
+            return xs,ys
+        return (
+            [int(x * sx) for x,y in points],
+            [int(y * sy) for x,y in points],
+        )
+
+    def refresh(self, dt=0.0):
+        """Redraw the markers on a fresh copy of the backdrop.
+        """
+        if self._backdrop is None:
+            self._backdrop = self._make_backdrop()
+        image = self._backdrop.copy()
+        xs,ys = self._marker_positions()
+        size = self.marker_size
+        if numpy is not None:
+            pixels = pygame.surfarray.pixels3d(image)
+            rgb = tuple(self.marker_color)[:3]
+            for dx in xrange(size):
+                for dy in xrange(size):
+                    pixels[xs+dx, ys+dy] = rgb
+            del pixels
+        else:
+            w,h = self.rect.size
+            pixels = pygame.PixelArray(image)
+            color = image.map_rgb(self.marker_color)
+            for x,y in zip(xs, ys):
+                x = min(max(x, 0), w - size)
+                y = min(max(y, 0), h - size)
+                for dx in xrange(size):
+                    for dy in xrange(size):
+                        pixels[x+dx][y+dy] = color
+            del pixels
+        self.image = image
+
+    def draw(self, surface=None):
+        """Draw the minimap on surface. If surface is None, the screen is used.
+        """
+        if surface is None:
+            surface = State.screen.surface
+        if self.image is None:
+            self.refresh()
+        rect = self.rect
+        surface.blit(self.image, rect)
+        if self.camera_color is not None:
+            sx,sy = self.scale
+            cx,cy,cw,ch = State.camera.rect
+            camera_rect = pygame.Rect(
+                rect.x + int(cx*sx), rect.y + int(cy*sy),
+                max(1, int(cw*sx)), max(1, int(ch*sy)))
+            pygame.draw.rect(surface, self.camera_color,
+                camera_rect.clip(rect), 1)
+        if self.border_color is not None:
+            pygame.draw.rect(surface, self.border_color, rect.inflate(2,2), 1)
+
+
+if __name__ == '__main__':
+    import unittest
+    from gummworld2 import Map, MapLayer
+
+    class MinimapTest(unittest.TestCase):
+
+        def setUp(self):
+            self.map = Map((8,8), (20,10))
+            self.map.layers.append(MapLayer((8,8), (20,10)))
+
+        def refresh(self, entities):
+            minimap = Minimap((0,0,40,20), self.map, entities, interval=None)
+            minimap.refresh()
+            self.assertEqual(minimap.image.get_size(), (40,20))
+            return minimap
+
+        def testNoEntities(self):
+            self.refresh(None)
+            self.refresh(lambda: None)
+            self.refresh([])
+
+        def testNoEntitiesWithoutNumpy(self):
+            global numpy
+            saved = numpy
+            numpy = None
+            try:
+                self.refresh(None)
+            finally:
+                numpy = saved
+
+        def testMarkers(self):
+            class Thing(object):
+                rect = pygame.Rect(0,0,4,4)
+            Thing.rect.center = 80,40
+            minimap = self.refresh([Thing()])
+            self.assertEqual(tuple(minimap.image.get_at((20,10)))[:3],
+                (255,255,255))
+
+    unittest.main()
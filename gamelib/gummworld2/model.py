@@ -25,6 +25,11 @@ __doc__ = """model.py - Physics model for Gummworld2.
 If pymunk is installed and can be imported, then the pymunk subclasses
 WorldPymunk and various bodies will be created. Otherwise, only the classes
 World and Object will be available.
+
+If numpy is installed and can be imported, then WorldArray and ArrayObject
+will be created. WorldArray keeps the positions, velocities and rects of its
+objects in numpy arrays and moves them all in one batched step, which is
+suitable for worlds with many thousands of simple movers.
 """
 
 import pygame
@@ -32,6 +37,10 @@ try:
     import pymunk
 except:
     pymunk = None
+try:
+    import numpy
+except:
+    numpy = None
 
 try:
     from gummworld2 import quad_tree
@@ -39,7 +48,7 @@ try:
 except:
     quad_tree = None
 
-from gummworld2 import State, Vec2d, data
+from gummworld2 import State, Vec2d, data, toolkit
 
 
 class NoWorld(object):
@@ -123,6 +132,14 @@ class World(object):
         for o in self.objects():
             o.update()
     
+    def draw(self, camera=None, blit_flags=0):
+        """Draw the objects that have image and rect attributes in one batch
+        via toolkit.draw_sprites(). Objects outside the camera are culled.
+        """
+        toolkit.draw_sprites(
+            [o for o in self._object_dict if hasattr(o, 'image')],
+            camera, blit_flags)
+    
     def __iter__(self):
         return iter(self.objects())
     
@@ -168,6 +185,256 @@ if quad_tree is not None:
         
         def step(self, dt):
             pass
+        
+        def draw(self, camera=None, blit_flags=0):
+            """Draw the entities in the camera's view that have an image
+            attribute, in one batch via toolkit.draw_sprites().
+            """
+            if camera is None:
+                camera = State.camera
+            toolkit.draw_sprites(
+                [e for e in self.entities_in(camera.rect) if hasattr(e, 'image')],
+                camera, blit_flags)
+
+
+if numpy is not None:
+    
+    class ArrayObject(object):
+        """An object model whose position, velocity and rect live in a
+        WorldArray.
+        
+        Until the object is added to a WorldArray it keeps its own values. Once
+        added, the properties read and write the world's arrays.
+        
+        GOTCHA: position, velocity and rect return copies when the object is in
+        a world. Something like "obj.position.x += 1" will not do what you
+        expect. Instead use "obj.position += (1,0)".
+        """
+        
+        def __init__(self, size=(1,1), position=(0,0), velocity=(0,0)):
+            self._world = None
+            self._index = -1
+            self._size = tuple(size)
+            self._position = Vec2d(position)
+            self._velocity = Vec2d(velocity)
+        
+        @property
+        def position(self):
+            """Position of the rect's center in float world coordinates."""
+            world = self._world
+            if world is None:
+                return self._position
+            x,y = world.positions[self._index]
+            return Vec2d(float(x), float(y))
+        @position.setter
+        def position(self, val):
+            world = self._world
+            if world is None:
+                p = self._position
+                p.x,p.y = val
+            else:
+                world.set_position(self._index, val)
+        
+        @property
+        def velocity(self):
+            """Velocity in world units per second."""
+            world = self._world
+            if world is None:
+                return self._velocity
+            x,y = world.velocities[self._index]
+            return Vec2d(float(x), float(y))
+        @velocity.setter
+        def velocity(self, val):
+            world = self._world
+            if world is None:
+                v = self._velocity
+                v.x,v.y = val
+            else:
+                world.velocities[self._index] = val
+        
+        @property
+        def rect(self):
+            """A pygame.Rect centered on position, rounded to pixels."""
+            world = self._world
+            if world is None:
+                r = pygame.Rect((0,0), self._size)
+                p = self._position
+                r.center = round(p.x),round(p.y)
+                return r
+            x,y,w,h = world.rects[self._index]
+            return pygame.Rect(int(x), int(y), int(w), int(h))
+        
+        def update(self, *args):
+            pass
+        
+        def kill(self):
+            if self._world is not None:
+                self._world.remove(self)
+    
+    
+    class WorldArray(object):
+        """A container for model.ArrayObjects, stored as a structure of arrays.
+        
+        Arrays, indexed by each object's slot (ArrayObject._index):
+            positions -> float (n,2); rect centers.
+            velocities -> float (n,2); world units per second.
+            rects -> int (n,4); x, y, w, h, kept in sync by step().
+            alive -> bool (n,); True for occupied slots.
+        
+        Only the first high_water slots are processed. Freed slots are reused
+        by later adds. The arrays grow by doubling as needed; references to
+        them are invalidated when that happens, so fetch them from the world
+        each tick rather than keeping them.
+        
+        If bounce is True, objects whose centers leave the world rect are
+        clamped to the edge and the offending velocity component is reversed.
+        
+        World.step() calls update() on every object. WorldArray.step() does
+        not; it only integrates. Game logic that needs per-object work can
+        operate on the arrays directly.
+        """
+        
+        def __init__(self, rect, capacity=1024, bounce=False):
+            self.rect = pygame.Rect(rect)
+            self.bounce = bounce
+            self.high_water = 0
+            self._objects = []
+            self._free = []
+            self._alloc(max(1, capacity))
+        
+        def _alloc(self, capacity):
+            """Internal use. Allocate or grow the arrays to capacity.
+            """
+            n = self.high_water
+            positions = numpy.zeros((capacity,2), numpy.float64)
+            velocities = numpy.zeros((capacity,2), numpy.float64)
+            rects = numpy.zeros((capacity,4), numpy.int32)
+            alive = numpy.zeros(capacity, numpy.bool_)
+            if n:
+                positions[:n] = self.positions[:n]
+                velocities[:n] = self.velocities[:n]
+                rects[:n] = self.rects[:n]
+                alive[:n] = self.alive[:n]
+            self.positions = positions
+            self.velocities = velocities
+            self.rects = rects
+            self.alive = alive
+            self._objects.extend([None] * (capacity - len(self._objects)))
+        
+        @property
+        def capacity(self):
+            return len(self.alive)
+        
+        def add(self, *objs):
+            """Add ArrayObjects to the world."""
+            for o in objs:
+                if o._world is self:
+                    continue
+                if o._world is not None:
+                    o._world.remove(o)
+                if self._free:
+                    i = self._free.pop()
+                else:
+                    i = self.high_water
+                    if i == self.capacity:
+                        self._alloc(self.capacity * 2)
+                    self.high_water += 1
+                pos = o._position
+                w,h = o._size
+                self._objects[i] = o
+                self.alive[i] = True
+                self.velocities[i] = o._velocity
+                self.rects[i,2:] = w,h
+                o._world = self
+                o._index = i
+                self.set_position(i, pos)
+        
+        def remove(self, *objs):
+            """Remove ArrayObjects from the world. Their current values are
+            copied back into the objects."""
+            for o in objs:
+                if o._world is not self:
+                    continue
+                i = o._index
+                o._position = o.position
+                o._velocity = o.velocity
+                self._objects[i] = None
+                self.alive[i] = False
+                self.velocities[i] = 0.0
+                o._world = None
+                o._index = -1
+                if i == self.high_water - 1:
+                    self.high_water -= 1
+                else:
+                    self._free.append(i)
+        
+        def set_position(self, i, val):
+            """Set the position of slot i and sync its rect."""
+            x,y = val
+            self.positions[i] = x,y
+            r = self.rects[i]
+            r[0] = int(round(x)) - r[2] // 2
+            r[1] = int(round(y)) - r[3] // 2
+        
+        def step(self, dt):
+            """Move every object by velocity * dt in one batched operation."""
+            n = self.high_water
+            if not n:
+                return
+            pos = self.positions[:n]
+            vel = self.velocities[:n]
+            pos += vel * dt
+            if self.bounce:
+                r = self.rect
+                for axis,lo,hi in ((0,r.left,r.right), (1,r.top,r.bottom)):
+                    p = pos[:,axis]
+                    v = vel[:,axis]
+                    out = (p < lo) | (p >= hi)
+                    if out.any():
+                        v[out] = -v[out]
+                        numpy.clip(p, lo, hi - 1, p)
+            rects = self.rects[:n]
+            # Same as rect.center = round(x),round(y) for each rect. round()
+            # rounds half away from zero; numpy.rint() would round half to
+            # even.
+            center = numpy.floor(numpy.abs(pos) + 0.5)
+            center *= numpy.sign(pos)
+            rects[:,0:2] = center - rects[:,2:4] // 2
+        
+        def objects(self):
+            return [o for o in self._objects[:self.high_water] if o is not None]
+        
+        def indices_in(self, rect):
+            """Return a numpy array of the slots whose rects collide with rect.
+            """
+            n = self.high_water
+            l,t,w,h = rect
+            rects = self.rects[:n]
+            x = rects[:,0]
+            y = rects[:,1]
+            mask = self.alive[:n] & (x < l + w) & (x + rects[:,2] > l) & \
+                (y < t + h) & (y + rects[:,3] > t)
+            return numpy.flatnonzero(mask)
+        
+        def objects_in(self, rect):
+            """Return a list of the objects whose rects collide with rect."""
+            objects = self._objects
+            return [objects[i] for i in self.indices_in(rect)]
+        
+        def __iter__(self):
+            return iter(self.objects())
+        
+        def __contains__(self, obj):
+            return getattr(obj, '_world', None) is self
+        
+        def __nonzero__(self):
+            return len(self) != 0
+        
+        def __len__(self):
+            return self.high_water - len(self._free)
+        
+        def __repr__(self):
+            return "<%s(%d objects)>" % (self.__class__.__name__, len(self))
 
 
 if pymunk is not None:
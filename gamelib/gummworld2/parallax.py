@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """parallax.py - Parallax scrolling for Gummworld2.
+
+ParallaxRenderer draws map layers that scroll at different speeds. Each layer
+may have a parallax attribute, a pair of factors for x and y; 1.0 scrolls with
+the camera, 0.5 at half speed, and so on. Layers without one scroll at 1.0.
+
+For each layer the scrolled view rect is computed once per frame:
+
+    view.topleft = origin + (camera.rect.topleft - origin) * parallax
+
+and only the chunks of the layer under it are drawn. Chunks come from a
+tilecache.ChunkCache per map, so tiles are rendered into chunks once and then
+drawn a chunk at a time. Far layers can keep their chunks at reduced resolution
+via set_resolution().
+
+Several maps can be drawn as one, as in examples/21_seamless_levels.py. All
+maps share the same origin, so maps that adjoin in world coordinates also
+adjoin in every parallax layer. Layer i of every map is drawn before layer i+1
+of any map.
+
+Usage:
+
+    renderer = ParallaxRenderer([map0, map1])
+    renderer.set_resolution(0, 0.5)     # the sky
+    ...
+    def draw(self, dt):
+        State.screen.clear()
+        renderer.draw()
+        State.screen.flip()
+"""
+
+
+from gummworld2 import State
+from gummworld2.tilecache import ChunkCache
+
+
+class ParallaxRenderer(object):
+    """Draw the layers of one or more maps with parallax.
+
+    Parameters:
+        maps -> A list of Map. If None, [State.map] is used.
+        chunk_tiles -> (int,int). The size of a cached chunk in tiles.
+        origin -> (int,int). The world point at which all layers line up.
+        max_chunks -> Integer. The chunk limit of each map's cache. Zero means
+            no limit.
+    Attributes:
+        caches -> A list of ChunkCache, one per map. They belong to the
+            renderer, not to the maps (see tilecache.shared_cache), so
+            set_resolution() does not change how other views draw the maps.
+    Methods:
+        set_resolution() -> Keep a layer's chunks at reduced resolution.
+        invalidate() -> Re-render chunks after tiles changed.
+        draw() -> Draw all layers.
+        draw_layer() -> Draw one layer.
+    """
+
+    def __init__(self, maps=None, chunk_tiles=(4,4), origin=(0,0), max_chunks=0):
+        if maps is None:
+            maps = [State.map]
+        self.maps = list(maps)
+        self.origin = origin
+        self.caches = [ChunkCache(m, chunk_tiles, max_chunks) for m in self.maps]
+
+    def set_resolution(self, layeri, resolution):
+        """Keep the chunks of layer layeri of every map at resolution (0.0 to
+        1.0) of full size.
+        """
+        for cache in self.caches:
+            cache.set_resolution(layeri, resolution)
+
+    def invalidate(self, map=None, layeri=None, tile=None):
+        """Drop cached chunks so they are re-rendered. If map is None, the
+        chunks of every map are dropped; see ChunkCache.invalidate() for
+        layeri and tile.
+        """
+        for cache in self.caches:
+            if map is None or cache.map is map:
+                cache.invalidate(layeri, tile)
+
+    def layer_offset(self, layer, camera):
+        """Return the world position (x,y) of the topleft of camera's view of
+        layer, scrolled by layer's parallax.
+        """
+        px,py = getattr(layer, 'parallax', (1.0,1.0))
+        ox,oy = self.origin
+        cx,cy = camera.rect.topleft
+        return ox + (cx - ox) * px, oy + (cy - oy) * py
+
+    def draw_layer(self, layeri, camera=None):
+        """Draw layer layeri of every map on the camera's surface. If camera
+        is None, State.camera is used.
+        """
+        if camera is None:
+            camera = State.camera
+        surface = camera.surface
+        view_rect = camera.rect.copy()
+        offset = None
+        for cache in self.caches:
+            layers = cache.map.layers
+            if layeri >= len(layers):
+                continue
+            layer = layers[layeri]
+            if not layer.visible:
+                continue
+            # All maps at the same layer index share a parallax factor, so the
+            # offset is only computed once per layer.
+            if offset is None:
+                offset = self.layer_offset(layer, camera)
+                view_rect.topleft = (
+                    int(round(offset[0])), int(round(offset[1])))
+            cache.draw_layer(layeri, surface, view_rect, offset)
+
+    def draw(self, camera=None):
+        """Draw all layers of every map on the camera's surface. If camera is
+        None, State.camera is used.
+        """
+        if camera is None:
+            camera = State.camera
+        num_layers = max([len(m.layers) for m in self.maps] or [0])
+        for layeri in xrange(num_layers):
+            self.draw_layer(layeri, camera)
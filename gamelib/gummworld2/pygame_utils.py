@@ -29,10 +29,14 @@ from math import sqrt, pow, pi, atan2, sin, cos, degrees, radians
 import os
 import re
 import sys
+import threading
 
 import pygame
 from pygame.locals import Color, MOUSEBUTTONDOWN, RLEACCEL
 
+from gummworld2.assets import asset_manager
+from gummworld2.textcache import text_cache
+
 
 def get_main_dir():
     """Intelligently find the directory the executable is in - needed for py2exe
@@ -258,6 +262,10 @@ def draw_text(image, text, pos=(0,0), font='default', fg=(254,254,254),
     Text is rendered at pos in foreground color fg. Width and height of
     the rendered text is returned. rect_attr are the position attributes
     of the resulting rect to set equal to pos.
+    
+    Rendered text is kept in textcache.text_cache, so drawing the same text
+    again costs only the blit. For numbers that change often, see
+    textcache.GlyphAtlas.
     """
     font = get_font(font)
     if type(fg) is tuple:
@@ -270,9 +278,9 @@ def draw_text(image, text, pos=(0,0), font='default', fg=(254,254,254),
     elif type(bg) is not Color:
         bg = Color(bg)
     if bg == (-1,-1,-1):
-        font_image = font.render(text, True, fg)
+        font_image = text_cache.render(font, text, True, fg)
     else:
-        font_image = font.render(text, True, fg, bg)
+        font_image = text_cache.render(font, text, True, fg, bg)
     font_rect = font_image.get_rect()
     for i in range(2):
         setattr(font_rect, rect_attr[i], pos[i])
@@ -354,8 +362,14 @@ def calculate_bezier(p, steps=30):
     return points
 
 
-def rot_center(image, angle):
-    """rotate an image while keeping its center and size"""
+def rot_center(image, angle, cache=None):
+    """rotate an image while keeping its center and size
+    
+    If cache is a RotationCache, the angle is quantized to the cache's step and
+    the rotated image is fetched from the cache, or made and cached.
+    """
+    if cache is not None:
+        return cache.get(image, angle, crop=True)[0]
     orig_rect = image.get_rect()
     rot_image = pygame.transform.rotate(image, angle)
     rot_rect = pygame.Rect(orig_rect)
@@ -364,6 +378,172 @@ def rot_center(image, angle):
     return rot_image
 
 
+class RotationCache(object):
+    """cache of rotated and scaled images
+    
+    Angles are quantized to step degrees, and scales to scale_step (0 means
+    scales are not quantized). Each transformed image is stored with a rect of
+    the same size centered on (0,0); move a copy of it to the sprite's center
+    to blit the image so it turns about its center.
+    
+    When the cached images use more than max_bytes, the least recently used
+    ones are evicted until usage falls to three quarters of max_bytes. Zero
+    means no limit. The cache holds a reference to each source image that has
+    live entries; call discard() when an image is no longer used.
+    
+    The hits, misses, evictions, and nbytes attributes report cache activity.
+    
+    Usage:
+        
+        cache = RotationCache(step=2.0)
+        cache.prewarm(ship_image)
+        ...
+        image,rect = cache.get(ship_image, ship.angle, center=ship.rect.center)
+    """
+    
+    def __init__(self, step=1.0, scale_step=0.0, max_bytes=16*1024*1024):
+        self.step = float(step)
+        self.scale_step = float(scale_step)
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+    
+    def quantize(self, angle, scale=1.0):
+        """return the cache key parts (angle_index, scale) for angle and scale
+        """
+        step = self.step
+        nsteps = int(round(360.0 / step))
+        i = int(round(angle / step)) % nsteps
+        if self.scale_step:
+            scale = round(scale / self.scale_step) * self.scale_step
+        return i,scale
+    
+    def get(self, image, angle, scale=1.0, crop=False, center=None):
+        """return (surface, rect) for image rotated by angle and scaled by scale
+        
+        If crop is True the result is cropped to the size of image, as with
+        rot_center(). If center is not None the returned rect is a copy
+        centered there, else it is the cached rect centered on (0,0) and must
+        not be modified.
+        """
+        i,scale = self.quantize(angle, scale)
+        key = image,i,scale,crop
+        with self._lock:
+            self._tick += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry[2] = self._tick
+        if entry is None:
+            entry = self._make(key, image)
+        surf,rect = entry[0],entry[1]
+        if center is not None:
+            rect = rect.copy()
+            rect.center = center
+        return surf,rect
+    
+    def _make(self, key, source):
+        """transform source, which is key's image or a private copy of it, and
+        cache the result under key
+        """
+        junk,i,scale,crop = key
+        angle = i * self.step
+        if scale == 1.0:
+            surf = pygame.transform.rotate(source, angle)
+        else:
+            surf = pygame.transform.rotozoom(source, angle, scale)
+        if crop:
+            rect = source.get_rect()
+            rect.center = surf.get_rect().center
+            surf = surf.subsurface(rect.clip(surf.get_rect())).copy()
+        rect = surf.get_rect(center=(0,0))
+        w,h = rect.size
+        nbytes = w * h * surf.get_bytesize()
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                return old
+            self.misses += 1
+            entry = [surf, rect, self._tick, nbytes]
+            self._entries[key] = entry
+            self.nbytes += nbytes
+            if self.max_bytes and self.nbytes > self.max_bytes:
+                self._evict(self.max_bytes * 3 // 4, key)
+        return entry
+    
+    def _evict(self, target, keep):
+        entries = self._entries
+        for key,entry in sorted(entries.iteritems(), key=lambda kv: kv[1][2]):
+            if self.nbytes <= target:
+                break
+            if key == keep:
+                continue
+            del entries[key]
+            self.nbytes -= entry[3]
+            self.evictions += 1
+    
+    def prewarm(self, image, scales=(1.0,), crop=False, background=True):
+        """make the transformed images of image for every angle step and each
+        scale in scales
+        
+        If background is True the work is done in a daemon thread, which is
+        returned; else it is done before returning None. Images that do not fit
+        in max_bytes are evicted as usual.
+        
+        The thread transforms a private copy of image, taken before this
+        returns, so image may be drawn meanwhile. Changes made to image after
+        the call are not seen by the prewarmed entries.
+        """
+        source = image.copy() if background else image
+        def warm():
+            entries = self._entries
+            nsteps = int(round(360.0 / self.step))
+            for scale in scales:
+                for i in xrange(nsteps):
+                    key = (image,) + self.quantize(i * self.step, scale) + (crop,)
+                    with self._lock:
+                        if key in entries:
+                            continue
+                    self._make(key, source)
+        if not background:
+            warm()
+            return None
+        t = threading.Thread(target=warm, name='gummworld2-prewarm')
+        t.daemon = True
+        t.start()
+        return t
+    
+    def discard(self, image):
+        """drop all entries made from image"""
+        with self._lock:
+            entries = self._entries
+            for key in [k for k in entries if k[0] is image]:
+                self.nbytes -= entries.pop(key)[3]
+    
+    def clear(self):
+        """drop all entries; the statistics are kept"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+    
+    def stats(self):
+        """return a dict of cache statistics"""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._entries),
+                nbytes=self.nbytes,
+                max_bytes=self.max_bytes,
+            )
+
+
 def plot_curve(p):
     """plot a curved path along one or more sets of control points
     
@@ -391,27 +571,14 @@ def plot_curve(p):
 
 
 def load_image(name, colorkey=None, alpha=False):
-    """load an image into memory"""
-    if name in _IMAGE_CACHE:
-        image = _IMAGE_CACHE[name].copy()
-        image.set_alpha(_IMAGE_CACHE[name].get_alpha())
-    else:
-        try:
-            image = pygame.image.load(name)
-            _IMAGE_CACHE[name] = image
-        except pygame.error, message:
-            print 'Cannot load image:', name
-            raise pygame.error, message
-    if alpha:
-        image = image.convert_alpha()
-    else:
-        image = image.convert()
-    if colorkey is not None:
-        if colorkey is -1:
-            colorkey = image.get_at((0,0))
-        image.set_colorkey(colorkey, RLEACCEL)
+    """load an image into memory
+    
+    The decoded and converted images are kept in assets.asset_manager, so
+    loading the same file with the same colorkey and alpha again returns the
+    same surface. Do not draw on it; copy() it first.
+    """
+    image = asset_manager.converted(name, alpha, colorkey)
     return image, image.get_rect()
-_IMAGE_CACHE = {}
 
 
 def wait_event(type=MOUSEBUTTONDOWN):
@@ -255,6 +255,17 @@ class QuadTreeNode(object):
         return len(self.branches) == 0
 
 
+class _Probe(object):
+    """Internal use. A rect-only query shape for QuadTree.entities_at().
+    Having no collided attribute, entities test it as a plain rect.
+    """
+    
+    __slots__ = ['rect']
+    
+    def __init__(self, rect):
+        self.rect = rect
+
+
 class QuadTree(QuadTreeNode):
     
     def __init__(self, rect, *entities, **kwargs):
@@ -379,6 +390,28 @@ class QuadTree(QuadTreeNode):
                         del self.collisions[c]
             self._add_internal(entity)
     
+    def add_bulk(self, entities):
+        """Add many entities at once, e.g. when loading a world.
+        
+        The result is the same as add_list(). But where add_list() scans the
+        whole collisions dict once for each entity that is already in the
+        quadtree, add_bulk() makes one pass for all of them, and none if the
+        entities are new. Each entity must appear in entities only once.
+        """
+        entities = list(entities)
+        entity_branch = self.entity_branch
+        readded = set([e for e in entities if e in entity_branch])
+        if readded:
+            for entity in readded:
+                del entity_branch[entity].entities[entity]
+            collisions = self.collisions
+            for c in [c for c in collisions
+                if c[0] in readded or c[1] in readded]:
+                del collisions[c]
+        add_internal = self._add_internal
+        for entity in entities:
+            add_internal(entity)
+    
     def remove(self, *entities):
         """Remove individual entities.
         """
@@ -399,6 +432,28 @@ class QuadTree(QuadTreeNode):
                 if entity in c:
                     del self.collisions[c]
     
+    def remove_bulk(self, entities):
+        """Remove many entities at once. The result is the same as
+        remove_list(), but the collisions dict is scanned once for all of the
+        entities instead of once for each.
+        """
+        entity_branch = self.root.entity_branch
+        removed = set()
+        for entity in entities:
+            branch = entity_branch.pop(entity, None)
+            if branch:
+                del branch.entities[entity]
+                removed.add(entity)
+        if removed:
+            collisions = self.collisions
+            if not entity_branch:
+                # Emptied, as when a world is cleared before a load.
+                collisions.clear()
+                return
+            for c in [c for c in collisions
+                if c[0] in removed or c[1] in removed]:
+                del collisions[c]
+    
     def collisions_dict(self):
         """Return a collision dict. The key is an entity, the value is a list of
         entities that the key collided with.
@@ -425,6 +480,38 @@ class QuadTree(QuadTreeNode):
         self._get_entities_recursive(rect, results)
         return results
     
+    def entities_colliding(self, shape):
+        """Return list of entities that collide with shape, using the same
+        collision tests as add(). shape is only a probe: it is not added to the
+        quadtree, and no collisions are recorded. If shape is in the quadtree it
+        is not included in the results.
+        
+        shape needs a rect attribute, and a collided attribute if
+        collide_entities is True.
+        """
+        collided = self.collided
+        return [e for e in self.entities_in(shape.rect) if collided(e, shape)]
+    
+    def entities_at(self, point):
+        """Return list of entities that contain point. See
+        entities_colliding().
+        """
+        x,y = point
+        return self.entities_colliding(_Probe(Rect(int(x), int(y), 1, 1)))
+    
+    def branch_at(self, rect):
+        """Return the branch an entity with rect would be kept in if it were
+        added.
+        """
+        node = self
+        while True:
+            for b in node.branches:
+                if b.rect.contains(rect):
+                    node = b
+                    break
+            else:
+                return node
+    
     def branch_of(self, entity):
         """Return the branch that contains entity. None is returned if entity is
         not in the quadtree.
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """renderqueue.py - Depth-sorted sprite render queue for Gummworld2.
+
+RenderQueue keeps sprites in buckets by map layer and tile row, so they can be
+drawn between the tile rows of a layer without sorting every sprite every
+frame. A sprite belongs to the row that contains its rect.bottom (its "feet").
+When it is drawn, tiles of its own row and the rows above it are already on
+the surface, and tiles of the rows below it will be drawn over it.
+
+Within a row sprites are ordered by a sort key, rect.bottom by default. Only
+rows that changed since the last draw are re-sorted, and the sort is done on
+nearly-sorted data, which Python's sort handles in about linear time.
+
+Usage:
+
+    queue = RenderQueue(State.map.tile_size)
+    queue.add(hero, layer=1)
+    ...
+    hero.position = new_position
+    queue.move(hero)
+    ...
+    toolkit.draw_tiles(queue)
+"""
+
+
+def _bottom(s):
+    return s.rect.bottom
+
+
+class RenderQueue(object):
+    """Sprites bucketed by map layer and tile row, sorted within each row.
+
+    Parameters:
+        tile_size -> (int,int). The map's tile size.
+        key -> Function. The sort key for sprites in the same row. The default
+            is rect.bottom. Add a z term to it to stack sprites that stand on
+            the same spot.
+    Attributes:
+        overhang -> Integer. The number of rows below the visible range that
+            are also drawn, for sprites that are taller than a tile and whose
+            feet are just below the camera. Default 1.
+    Methods:
+        add() -> Add a sprite to a layer.
+        remove() -> Remove a sprite.
+        move() -> Re-bucket a sprite after it moved.
+        update() -> Re-bucket all sprites.
+        sprites_in_row() -> The sorted sprites of one row.
+        draw_row() -> Draw the sprites of one row.
+    """
+
+    def __init__(self, tile_size, key=None):
+        self.tile_height = int(tile_size[1])
+        self.key = key or _bottom
+        self.overhang = 1
+        self._rows = {}         # {(layer,row) : [sprite,...]}
+        self._where = {}        # {sprite : (layer,row)}
+        self._dirty = set()     # set([(layer,row),...])
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, sprite):
+        return sprite in self._where
+
+    def __iter__(self):
+        return iter(self._where)
+
+    def row_of(self, sprite):
+        """Return the tile row that contains the sprite's rect.bottom.
+        """
+        return (sprite.rect.bottom - 1) // self.tile_height
+
+    def add(self, sprite, layer=0):
+        """Add a sprite to the map layer with index layer. If the sprite is
+        already in the queue, it is moved to layer.
+        """
+        if sprite in self._where:
+            self.remove(sprite)
+        cell = layer,self.row_of(sprite)
+        self._rows.setdefault(cell, []).append(sprite)
+        self._where[sprite] = cell
+        self._dirty.add(cell)
+
+    def remove(self, sprite):
+        """Remove a sprite from the queue.
+        """
+        cell = self._where.pop(sprite, None)
+        if cell is None:
+            return
+        row = self._rows[cell]
+        row.remove(sprite)
+        if not row:
+            del self._rows[cell]
+            self._dirty.discard(cell)
+
+    def move(self, sprite):
+        """Call after a sprite's rect changes. The sprite hops to its new row
+        if it left the old one, and its row is marked for re-sorting.
+        """
+        layer,row = cell = self._where[sprite]
+        new_row = (sprite.rect.bottom - 1) // self.tile_height
+        if new_row != row:
+            rows = self._rows
+            old = rows[cell]
+            old.remove(sprite)
+            if not old:
+                del rows[cell]
+                self._dirty.discard(cell)
+            cell = layer,new_row
+            rows.setdefault(cell, []).append(sprite)
+            self._where[sprite] = cell
+        self._dirty.add(cell)
+
+    def update(self):
+        """Re-bucket every sprite. This is an alternative to calling move() for
+        each sprite that moved. It costs one pass over the sprites, but no
+        global sort.
+        """
+        move = self.move
+        for s in self._where.keys():
+            move(s)
+
+    def clear(self):
+        """Remove all sprites.
+        """
+        self._rows.clear()
+        self._where.clear()
+        self._dirty.clear()
+
+    def sprites_in_row(self, layer, row):
+        """Return the sprites of a layer and tile row in drawing order. Do not
+        modify the returned list.
+        """
+        cell = layer,row
+        sprites = self._rows.get(cell)
+        if sprites is None:
+            return ()
+        if cell in self._dirty:
+            sprites.sort(key=self.key)
+            self._dirty.discard(cell)
+        return sprites
+
+    def draw_row(self, layer, row, blit, cx, cy):
+        """Draw the sprites of a layer and tile row with the blit function,
+        offsetting world positions by the camera position (cx,cy).
+        """
+        for s in self.sprites_in_row(layer, row):
+            rect = s.rect
+            blit(s.image, (rect.x-cx, rect.y-cy))
@@ -105,6 +105,11 @@ class BucketSprite(pygame.sprite.Sprite):
     in and hops to another bucket if it should. This is required so the
     BucketGroup's sprites_in_range() and buckets_in_range() methods work
     properly and retrieve sprites efficiently.
+    
+    The sprite caches the bounds of its bucket in each BucketGroup it belongs
+    to, so a move that stays inside the bucket costs a few comparisons. Only
+    when the center leaves the bucket does the group compute the new bucket.
+    A sprite may belong to any number of BucketGroups.
     """
 
     def __init__(self, position=(0,0)):
@@ -121,6 +126,7 @@ class BucketSprite(pygame.sprite.Sprite):
         """
         super(BucketSprite, self).__init__()
         self._position = Vec2d(0.0,0.0)
+        self._bucket_bounds = {}
     
     @property
     def position(self):
@@ -136,19 +142,15 @@ class BucketSprite(pygame.sprite.Sprite):
     def position(self, val):
         p = self._position
         p.x,p.y = float(val[0]),float(val[1])
-        self.rect.center = int(round(p.x)), int(round(p.y))
-        if hasattr(self, 'bucket'):
-            self._move_bucket()
+        self.rect.center = x,y = int(round(p.x)), int(round(p.y))
+        if self._bucket_bounds:
+            self._move_bucket(x, y)
 
-    def _move_bucket(self):
-        mapx,mapy = self.position / State.map.tile_size
-        mapx,mapy = int(round(mapx)), int(round(mapy))
-        if self.bucket != (mapx,mapy):
-            bucket = self.bucket_group.buckets[self.bucket]
-            del bucket[self]
-            bucket = self.bucket_group.buckets[mapx,mapy]
-            bucket[self] = 1
-            self.bucket = (mapx,mapy)
+    def _move_bucket(self, x, y):
+        # A copy: move_sprite() replaces this sprite's entry for the group.
+        for group,(x1,y1,x2,y2) in self._bucket_bounds.items():
+            if not (x1 <= x < x2 and y1 <= y < y2):
+                group.move_sprite(self)
     
     
     def draw(s, blit_flags=0):
@@ -163,59 +165,139 @@ class BucketSprite(pygame.sprite.Sprite):
 class BucketGroup(pygame.sprite.Group):
     """A sprite group that provides buckets.
     
-    The buckets correlate to the map tile grid. Tile 0,0 is bucket 0,0, tile 8,9
-    is bucket 8,9, and so on.
+    The buckets form a grid over the world. By default a bucket is the size of
+    a map tile: tile 0,0 is bucket 0,0, tile 8,9 is bucket 8,9, and so on. Pass
+    cell_size to use buckets of a different size; larger cells mean fewer
+    buckets to visit per range query, smaller cells mean fewer sprites per
+    bucket.
+    
+    Buckets are sparse. A bucket is created when the first sprite enters it and
+    dropped when the last sprite leaves it, so memory follows the number of
+    sprites and not the size of the map.
     
     Instances of this class get, update, and draw sprites in 2D ranges of
     buckets. The sprites are responsible for hopping from bucket to bucket as
     needed, whenever they move. (If you use the BucketSprite this behavior is
-    built in.)
+    built in. Other sprites must call move_sprite() after they move.)
+    
+    Sprites are bucketed by rect.center, floor divided by cell_size. The group
+    keeps its own record of each sprite's bucket, so a sprite can be in more
+    than one BucketGroup.
+    
+    Set the batch_draw attribute to False to draw sprites one at a time instead
+    of in a batch.
     """
     
-    def __init__(self, tile_size, map_size, *sprites):
+    batch_draw = True
+    
+    def __init__(self, tile_size, map_size, *sprites, **kwargs):
         """Construct an instance of BucketGroup.
+        
+        BucketGroup(tile_size, map_size, *sprites, cell_size=None)
+        
+        The cell_size argument is the bucket size in pixels. If it is None,
+        tile_size is used.
         """
         super(BucketGroup, self).__init__()
+        cell_size = kwargs.pop('cell_size', None)
+        if kwargs:
+            raise TypeError, 'unexpected keyword arguments: %s' % (
+                ', '.join(kwargs),)
         self.tile_size = Vec2d(tile_size)
         self.map_size = Vec2d(map_size)
-        x1,y1 = 0,0
-        x2,y2 = map_size
+        if cell_size is None:
+            cell_size = tile_size
+        self.cell_size = Vec2d(cell_size)
         self.buckets = dict()
-        self.buckets.update([ ((x,y), {})
-            for x in range(x1,x2+1)
-                for y in range(y1,y2+1)
-        ])
+        self.sprite_buckets = dict()
         self.add(*sprites)
     
     def copy(self):
-        ## This certainly won't work. The BucketSprite only tracks one bucket
-        ## group, and copying them would clobber it. BucketSprite.bucket_group
-        ## needs to be implemented as a container before multiple group
-        ## membership would work.
-#        """Return a copy of the bucket group.
-#        """
-#        new_group = self.__class__(self.tile_size, self.map_size, *self.sprites())
-#        return new_group
-        return None
+        """Return a copy of the bucket group.
+        """
+        return self.__class__(self.tile_size, self.map_size, *self.sprites(),
+            **dict(cell_size=self.cell_size))
+    
+    def set_cell_size(self, cell_size):
+        """Change the bucket size and move all sprites to their new buckets.
+        """
+        self.cell_size = Vec2d(cell_size)
+        self.buckets.clear()
+        self.sprite_buckets.clear()
+        for s in self.sprites():
+            self._insert(s)
+    
+    def cell_of(self, pos):
+        """Return the bucket key (col,row) for world position pos.
+        """
+        cw,ch = self.cell_size
+        return int(pos[0] // cw), int(pos[1] // ch)
+    
+    def cell_range(self, rect):
+        """Return the bucket range (x1,y1,x2,y2) that covers the world rect,
+        suitable for the dim argument of the range methods.
+        """
+        cw,ch = self.cell_size
+        x,y,w,h = rect
+        return (
+            int(x // cw), int(y // ch),
+            int((x + w) // cw) + 1, int((y + h) // ch) + 1,
+        )
+    
+    def _insert(self, s, key=None):
+        """Internal use. Put sprite s in bucket key, or the bucket for its
+        rect.center if key is None.
+        """
+        if key is None:
+            key = self.cell_of(s.rect.center)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = {}
+        bucket[s] = 1
+        self.sprite_buckets[s] = key
+        bounds = getattr(s, '_bucket_bounds', None)
+        if bounds is not None:
+            cw,ch = self.cell_size
+            x,y = key
+            bounds[self] = x*cw, y*ch, (x+1)*cw, (y+1)*ch
+    
+    def _discard(self, s):
+        """Internal use. Take sprite s out of its bucket, and drop the bucket
+        if it is empty.
+        """
+        key = self.sprite_buckets.pop(s, None)
+        buckets = self.buckets
+        bucket = buckets.get(key)
+        if bucket is not None:
+            bucket.pop(s, None)
+            if not bucket:
+                del buckets[key]
+        bounds = getattr(s, '_bucket_bounds', None)
+        if bounds is not None:
+            bounds.pop(self, None)
+    
+    def move_sprite(self, s):
+        """Move sprite s to the bucket for its rect.center, if it changed.
+        
+        Call this after moving a sprite that does not move itself (BucketSprite
+        does this in its position setter).
+        """
+        key = self.cell_of(s.rect.center)
+        if self.sprite_buckets.get(s) != key:
+            self._discard(s)
+            self._insert(s, key)
     
     def add(self, *sprites):
         if len(sprites):
             super(BucketGroup, self).add(*sprites)
-            tw,th = self.tile_size
             for s in sprites:
-                tx,ty = s.rect.center
-                mx,my = tx//tw, ty//th
-                bucket = self.buckets[mx,my]
-                bucket[s] = 1
-                s.bucket_group = self
-                s.bucket = (mx,my)
+                if s in self.sprite_buckets:
+                    self.move_sprite(s)
+                else:
+                    self._insert(s)
     
     def remove_internal(self, sprite):
-        try:
-            bucket = self.buckets[sprite.bucket]
-            del bucket[sprite]
-        except:
-            pass
+        self._discard(sprite)
         super(BucketGroup, self).remove_internal(sprite)
     
     def update(self, dim=None, *args):
@@ -228,16 +310,24 @@ class BucketGroup(pygame.sprite.Group):
         for s in sprites:
             s.update(*args)
     
-    def draw(self, dim=None):
-        blit = toolkit.draw_sprite
+    def draw(self, dim=None, blit_flags=0):
+        """Draw the sprites in the buckets in range dim, or all sprites if dim
+        is None.
+        
+        If the batch_draw attribute is True, the sprites are culled and drawn in
+        one batch via toolkit.draw_sprites(). Otherwise each sprite is drawn
+        with toolkit.draw_sprite().
+        """
         if dim is None:
-            for bucket in self.sprites():
-                for s in bucket:
-                    blit(s)
+            sprites = self.sprites()
         else:
-            for bucket in self.buckets_in_range(dim):
-                for s in bucket:
-                    blit(s)
+            sprites = [s for bucket in self.buckets_in_range(dim) for s in bucket]
+        if self.batch_draw:
+            toolkit.draw_sprites(sprites, blit_flags=blit_flags)
+        else:
+            blit = toolkit.draw_sprite
+            for s in sprites:
+                blit(s, blit_flags)
         del self.lostsprites[:]
     
     def sprites_in_range(self, dim=None):
@@ -247,7 +337,7 @@ class BucketGroup(pygame.sprite.Group):
         coordinates. If dim is None, all sprites are returned.
         """
         if dim is None:
-            dim = 0,0,self.map_size.x+1,self.map_size.y+1
+            return self.sprites()
         sprites = []
         for bucket in self.buckets_in_range(dim):
             sprites.extend(bucket.keys())
@@ -258,20 +348,27 @@ class BucketGroup(pygame.sprite.Group):
         
         The optional dim argument is a tuple(x1,y1,x2,y2) range of grid
         coordinates. If dim is None, all buckets are returned.
+        
+        The smaller of the range and the set of occupied buckets is walked, so
+        a wide range over a sparse group costs no more than the sprites in it.
         """
-        if dim is None:
-            dim = 0,0,self.map_size.x+1,self.map_size.y+1
         buckets = self.buckets
+        if dim is None:
+            return buckets.values()
         x1,y1,x2,y2 = dim
+        if (x2 - x1) * (y2 - y1) > len(buckets):
+            return [
+                d for (x,y),d in buckets.iteritems()
+                    if x1 <= x < x2 and y1 <= y < y2
+            ]
         get = buckets.get
         return [
-            d for d in (get((x,y), {})
-                for x in range(x1,x2)
-                    for y in range(y1,y2)
+            d for d in (get((x,y))
+                for x in xrange(x1,x2)
+                    for y in xrange(y1,y2)
             ) if d
         ]
     
     def empty(self):
         super(BucketGroup, self).empty()
-        for bucket in self.buckets:
-            bucket.clear()
+        self.buckets.clear()
@@ -69,8 +69,8 @@ class State(object):
             pygame surface.
         world: A model.World* object used to store game model entities.
         world_type: One of engine.NO_WORLD, engine.SIMPLE_WORLD,
-            engine.QUADTREE_WORLD, or engine.PYMUNK_WORLD if State was
-            initialized via the Engine class. Else it is None.
+            engine.QUADTREE_WORLD, engine.PYMUNK_WORLD, or engine.ARRAY_WORLD
+            if State was initialized via the Engine class. Else it is None.
         camera: A camera.Camera object.
         map: A map.Map object.
     
@@ -2,29 +2,156 @@ import pygame
 from math import floor
 
 
+class SubPixelCache(object):
+
+    """A shared cache of generated sub-pixel surfaces.
+
+    Entries are keyed by source surface, level, and sub-pixel offset, so every
+    SubPixelSurface made from the same source surface shares them. Each
+    variant is generated on the first request for it. When the cached
+    surfaces use more than max_bytes, the least recently used ones are
+    evicted until usage falls to three quarters of max_bytes.
+
+    The cache holds a reference to each source surface that has live entries.
+    Call discard() when a source surface is no longer used.
+
+    """
+
+    def __init__(self, max_bytes=32*1024*1024):
+
+        """Creates a cache.
+
+        max_bytes -- Memory budget in bytes. Zero means no limit.
+
+        """
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}
+        self._tick = 0
+
+
+    def get(self, surface, level, surf_x, surf_y):
+
+        """Gets the sub-pixel surface for a source surface, level, and
+        sub-pixel offset, generating it if it is not cached.
+
+        """
+
+        key = surface, level, surf_x, surf_y
+        self._tick += 1
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[1] = self._tick
+            return entry[0]
+        self.misses += 1
+        surf = SubPixelSurface._generate(
+            surface, float(surf_x) / level, float(surf_y) / level, level)
+        w,h = surf.get_size()
+        nbytes = w * h * surf.get_bytesize()
+        self._entries[key] = [surf, self._tick, nbytes]
+        self.nbytes += nbytes
+        if self.max_bytes and self.nbytes > self.max_bytes:
+            self._evict(self.max_bytes * 3 // 4)
+        return surf
+
+
+    def _evict(self, target):
+
+        entries = self._entries
+        by_age = sorted(entries.iteritems(), key=lambda item: item[1][1])
+        # Never evict the newest entry; it is about to be returned.
+        for key,entry in by_age[:-1]:
+            if self.nbytes <= target:
+                break
+            del entries[key]
+            self.nbytes -= entry[2]
+            self.evictions += 1
+
+
+    def discard(self, surface):
+
+        """Drops all entries generated from a source surface.
+
+        """
+
+        entries = self._entries
+        for key in [k for k in entries if k[0] is surface]:
+            self.nbytes -= entries.pop(key)[2]
+
+
+    def clear(self):
+
+        """Drops all entries. The statistics are kept.
+
+        """
+
+        self._entries.clear()
+        self.nbytes = 0
+
+
+    def stats(self):
+
+        """Returns a dict of cache statistics: hits, misses, evictions,
+        entries, nbytes, and max_bytes.
+
+        """
+
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self._entries),
+            nbytes=self.nbytes,
+            max_bytes=self.max_bytes,
+        )
+
+
+# The cache shared by all SubPixelSurface objects that do not specify one.
+subpixel_cache = SubPixelCache()
+
+
 class SubPixelSurface(object):
 
-    def __init__(self, surface, level=3):
+    def __init__(self, surface, level=3, cache=None):
 
         """Creates a sub pixel surface object.
 
         surface -- A PyGame surface
-        x_level -- Number of sub-pixel levels in x
-        y_level -- Number of sub-pixel levels in y (same as x if omited)
+        level -- Number of sub-pixel levels in x and y
+        cache -- A SubPixelCache, or None to use the shared subpixel_cache
+
+        The sub-pixel surfaces are generated from surface on first use by at(),
+        and shared with every other SubPixelSurface made from the same surface
+        and level. Changes to surface after a variant is generated are not
+        seen until the variants are discarded from the cache.
 
         """
 
         self.level = level
+        self.surface = surface
+        if cache is None:
+            cache = subpixel_cache
+        self.cache = cache
 
-        x_steps = [float(n) / self.level for n in xrange(self.level)]
-        y_steps = [float(n) / self.level for n in xrange(self.level)]
 
-        self.surfaces = []
-        for frac_y in y_steps:
-            row = []
-            self.surfaces.append(row)
-            for frac_x in x_steps:
-                row.append( SubPixelSurface._generate(surface.copy(), frac_x, frac_y, level) )
+    @property
+    def surfaces(self):
+
+        """All the sub-pixel surfaces as a list of rows. This generates every
+        variant that is not already cached.
+
+        """
+
+        level = self.level
+        get = self.cache.get
+        surface = self.surface
+        return [[get(surface, level, x, y) for x in xrange(level)]
+            for y in xrange(level)]
 
 
     @staticmethod
@@ -55,8 +182,8 @@ class SubPixelSurface(object):
         surf = pygame.transform.smoothscale(surf, (orig_w + 0, orig_h + 0))
 
         return surf
-    
-    
+
+
     def at(self, x, y):
 
         """Gets a sub-pixel surface for a given coordinate.
@@ -66,7 +193,8 @@ class SubPixelSurface(object):
 
         """
 
-        surf_x = int( (x - floor(x)) * self.level )
-        surf_y = int( (y - floor(y)) * self.level )
+        level = self.level
+        surf_x = int( (x - floor(x)) * level )
+        surf_y = int( (y - floor(y)) * level )
 
-        return self.surfaces[surf_y][surf_x]
+        return self.cache.get(self.surface, level, surf_x, surf_y)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """textcache.py - Cached text rendering for Gummworld2.
+
+Font.render() rasterizes every glyph of a string on each call. This module
+offers two ways to avoid that:
+
+1.  TextCache keeps whole rendered strings, so text that is drawn again, such
+    as labels and menu items, is rendered once. The surfaces are kept in an LRU
+    with a budget in bytes. text_cache is the cache shared by
+    pygame_utils.draw_text() and the ui stats.
+2.  GlyphAtlas keeps one surface per character for a font and color, and
+    draws strings with them straight onto the target with a single blits()
+    call. This suits text that changes often, such as the numbers in an FPS
+    counter, where caching whole strings would mostly miss. Glyphs are placed
+    by their rendered width, so kerning is lost; that is rarely visible in
+    digits. glyph_atlas() returns the shared atlas of a font and color.
+
+    Composing the glyphs into an intermediate surface is no faster than
+    Font.render(), which keeps its own glyph cache; the saving is in not
+    making a surface per string at all.
+
+Cached surfaces are shared. Do not draw on them.
+
+Usage:
+
+    image = text_cache.render(font, 'Paused', True, Color('white'))
+    ...
+    atlas = glyph_atlas(font, Color('yellow'))
+    atlas.draw(screen, 'FPS %d' % clock.get_fps(), (5,5))
+"""
+
+
+import pygame
+
+# Surface.blits() arrived in pygame 1.9.4.
+haspygameblits = hasattr(pygame.Surface, 'blits')
+
+
+def _color_key(color):
+    if color is None:
+        return None
+    return tuple(color)
+
+
+class TextCache(object):
+    """An LRU of rendered strings.
+
+    Parameters:
+        max_bytes -> Integer. The memory budget in bytes. When the cached
+            surfaces use more, the least recently used ones are evicted until
+            usage falls to three quarters of max_bytes. Zero means no limit.
+    Attributes:
+        hits, misses, evictions, nbytes -> Cache activity and usage.
+    Methods:
+        render() -> The rendered surface of a string.
+        clear() -> Drop all surfaces.
+        stats() -> A dict of cache statistics.
+    """
+
+    def __init__(self, max_bytes=4*1024*1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}      # {key : [surface, tick, nbytes]}
+        self._tick = 0
+
+    def render(self, font, text, antialias, fg, bg=None, alpha=None):
+        """Return text rendered by font.render(text, antialias, fg, bg). If
+        alpha is not None, it is set as the surface's alpha. The surface is
+        shared; do not draw on it.
+        """
+        key = font,text,bool(antialias),_color_key(fg),_color_key(bg),alpha
+        self._tick += 1
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[1] = self._tick
+            return entry[0]
+        self.misses += 1
+        if bg is None:
+            surf = font.render(text, antialias, fg)
+        else:
+            surf = font.render(text, antialias, fg, bg)
+        if alpha is not None:
+            surf.set_alpha(alpha)
+        w,h = surf.get_size()
+        nbytes = w * h * surf.get_bytesize()
+        self._entries[key] = [surf, self._tick, nbytes]
+        self.nbytes += nbytes
+        if self.max_bytes and self.nbytes > self.max_bytes:
+            self._evict(self.max_bytes * 3 // 4, key)
+        return surf
+
+    def _evict(self, target, keep):
+        entries = self._entries
+        for key,entry in sorted(entries.iteritems(), key=lambda kv: kv[1][1]):
+            if self.nbytes <= target:
+                break
+            if key == keep:
+                continue
+            del entries[key]
+            self.nbytes -= entry[2]
+            self.evictions += 1
+
+    def clear(self):
+        """Drop all surfaces. The statistics are kept.
+        """
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Return a dict of cache statistics: hits, misses, evictions,
+        entries, nbytes, and max_bytes.
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self._entries),
+            nbytes=self.nbytes,
+            max_bytes=self.max_bytes,
+        )
+
+
+class GlyphAtlas(object):
+    """Pre-rendered glyphs of a font in one color.
+
+    Parameters:
+        font -> pygame.font.Font.
+        fg -> Color of the glyphs.
+        bg -> Color of the background, or None for a transparent background.
+        antialias -> Boolean.
+        alpha -> Integer, or None. If not None, it is set as each glyph's
+            alpha.
+        chars -> String. The characters to render up front. Others are
+            rendered when first used.
+    Attributes:
+        glyphs -> Dict. {char : (surface, width)}.
+    Methods:
+        size() -> The size of a composed string.
+        draw() -> Draw a string on a surface.
+    """
+
+    def __init__(self, font, fg, bg=None, antialias=True, alpha=None,
+        chars='0123456789.,:-+%/ '):
+        self.font = font
+        self.fg = fg
+        self.bg = bg
+        self.antialias = antialias
+        self.alpha = alpha
+        self.height = font.get_height()
+        self.glyphs = {}
+        for c in chars:
+            self._glyph(c)
+
+    def _glyph(self, c):
+        """Internal use. Return (surface, width) for character c, rendering it
+        if needed.
+        """
+        entry = self.glyphs.get(c)
+        if entry is None:
+            if self.bg is None:
+                glyph = self.font.render(c, self.antialias, self.fg)
+            else:
+                glyph = self.font.render(c, self.antialias, self.fg, self.bg)
+            if self.alpha is not None:
+                glyph.set_alpha(self.alpha)
+            entry = self.glyphs[c] = glyph,glyph.get_width()
+        return entry
+
+    def size(self, text):
+        """Return the size (w,h) of text as drawn by draw().
+        """
+        glyph = self._glyph
+        return sum([glyph(c)[1] for c in text]), self.height
+
+    def draw(self, surface, text, pos):
+        """Draw text on surface with its topleft at pos. Return the width and
+        height drawn.
+
+        Glyphs are placed without kerning. Where size(text) differs from
+        font.size(text), the result differs from Font.render(); ui.Statf checks
+        this and falls back to rendering.
+        """
+        glyphs = self.glyphs
+        x0 = x = int(pos[0])
+        y = int(pos[1])
+        batch = []
+        append = batch.append
+        for c in text:
+            entry = glyphs.get(c)
+            if entry is None:
+                entry = self._glyph(c)
+            g,w = entry
+            append((g, (x,y)))
+            x += w
+        if haspygameblits:
+            surface.blits(batch, False)
+        else:
+            blit = surface.blit
+            for args in batch:
+                blit(*args)
+        return x - x0, self.height
+
+
+def glyph_atlas(font, fg, bg=None, antialias=True, alpha=None):
+    """Return the shared GlyphAtlas for font, fg, bg, antialias, and alpha,
+    creating it on first use.
+    """
+    key = font,_color_key(fg),_color_key(bg),bool(antialias),alpha
+    atlas = _atlases.get(key)
+    if atlas is None:
+        atlas = _atlases[key] = GlyphAtlas(font, fg, bg, antialias, alpha)
+    return atlas
+_atlases = {}
+
+
+# The cache shared by pygame_utils.draw_text() and the ui stats.
+text_cache = TextCache()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+# This file is part of Gummworld2.
+#
+# Gummworld2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Gummworld2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with Gummworld2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__version__ = '$Id$'
+__author__ = 'Gummbum, (c) 2011'
+
+
+__doc__ = """tilecache.py - Pre-rendered tile chunks for Gummworld2.
+
+A ChunkCache renders blocks of chunk_tiles tiles of a map layer into a single
+surface the first time the block is needed, so drawing a screenful of tiles
+costs a handful of large blits instead of one blit per tile.
+
+Chunks of a layer may be stored at reduced resolution to save memory, which
+suits far parallax layers that are blurry anyway. Such chunks are scaled back up
+when drawn; the scaled-up copies are kept in a small LRU so that chunks on
+screen are not rescaled each frame.
+
+If tiles are changed, call invalidate() so the affected chunks are re-rendered.
+
+A map's chunks can be shared by every camera that views it. shared_cache(map)
+returns the map's ChunkCache, creating it on first use, and
+toolkit.draw_tiles_cached() draws a camera's view from it. With split-screen
+views, or a main view plus an overview of the same map, each tile is rendered
+into a chunk once, and each view only pays for blitting the chunks it shows.
+"""
+
+
+import pygame
+from pygame.locals import SRCALPHA
+
+
+def shared_cache(map, chunk_tiles=None, max_chunks=None):
+    """Return the ChunkCache shared by all users of map. It is created on first
+    use, and stored in map.render_cache. If chunk_tiles or max_chunks is None,
+    the ChunkCache default is used on creation, and any value is accepted
+    afterwards.
+
+    pygame.error is raised if chunk_tiles or max_chunks is given and differs
+    from the existing cache's setting.
+    """
+    cache = getattr(map, 'render_cache', None)
+    if cache is None:
+        if chunk_tiles is None:
+            chunk_tiles = (4,4)
+        if max_chunks is None:
+            max_chunks = 0
+        cache = map.render_cache = ChunkCache(map, chunk_tiles, max_chunks)
+        return cache
+    if chunk_tiles is not None and \
+        (int(chunk_tiles[0]),int(chunk_tiles[1])) != cache.chunk_tiles:
+        raise pygame.error, 'shared_cache: map cache has chunk_tiles %s, not %s' % (
+            cache.chunk_tiles, tuple(chunk_tiles))
+    if max_chunks is not None and max_chunks != cache.max_chunks:
+        raise pygame.error, 'shared_cache: map cache has max_chunks %d, not %d' % (
+            cache.max_chunks, max_chunks)
+    return cache
+
+
+class ChunkCache(object):
+    """Pre-rendered chunks of a map's layers.
+
+    Parameters:
+        map -> Map. The map whose layers are rendered.
+        chunk_tiles -> (int,int). The size of a chunk in tiles.
+        max_chunks -> Integer. The maximum number of chunks to keep for all
+            layers. When exceeded, the least recently used chunks are dropped.
+            Zero means no limit.
+        max_scaled -> Integer. The maximum number of scaled-up copies of
+            reduced resolution chunks to keep.
+    Methods:
+        set_resolution() -> Store a layer's chunks at reduced resolution.
+        chunk_range() -> The chunks of a layer that cover a world rect.
+        get() -> The surface of a chunk.
+        draw_layer() -> Draw the chunks of a layer that cover a world rect.
+        invalidate() -> Drop chunks so they are re-rendered.
+    """
+
+    def __init__(self, map, chunk_tiles=(4,4), max_chunks=0, max_scaled=64):
+        self.map = map
+        self.chunk_tiles = int(chunk_tiles[0]),int(chunk_tiles[1])
+        self.max_chunks = max_chunks
+        self.max_scaled = max_scaled
+        self.resolution = {}    # {layeri : float}
+        self._chunks = {}       # {(layeri,cx,cy) : [surface, tick]}
+        self._scaled = {}       # {(layeri,cx,cy) : [surface, tick]}
+        self._tick = 0
+
+    def set_resolution(self, layeri, resolution):
+        """Store the chunks of layer layeri at resolution (0.0 to 1.0) of their
+        full size. The layer's chunks are re-rendered.
+        """
+        if resolution >= 1.0:
+            self.resolution.pop(layeri, None)
+        else:
+            self.resolution[layeri] = float(resolution)
+        self.invalidate(layeri)
+
+    def chunk_size(self, layeri):
+        """Return the size of a chunk of layer layeri in pixels.
+        """
+        tw,th = self.map.layers[layeri].tile_size
+        cw,ch = self.chunk_tiles
+        return cw*tw, ch*th
+
+    def chunk_range(self, layeri, rect):
+        """Return the range of chunks (x1,y1,x2,y2) of layer layeri that
+        overlap rect, which is in world coordinates. The range is clipped to the
+        layer's bounds.
+        """
+        layer = self.map.layers[layeri]
+        cw,ch = self.chunk_size(layeri)
+        mw,mh = layer.map_size
+        tw,th = layer.tile_size
+        ctw,cth = self.chunk_tiles
+        mx,my = self.map.rect.topleft
+        x,y,w,h = rect
+        x -= mx
+        y -= my
+        return (
+            max(0, int(x // cw)),
+            max(0, int(y // ch)),
+            min((mw+ctw-1)//ctw, int((x+w-1) // cw) + 1),
+            min((mh+cth-1)//cth, int((y+h-1) // ch) + 1),
+        )
+
+    def _render(self, layeri, cx, cy):
+        """Internal use. Return a new surface for a chunk, or None if the chunk
+        has no tiles.
+        """
+        layer = self.map.layers[layeri]
+        mw,mh = layer.map_size
+        tw,th = layer.tile_size
+        ctw,cth = self.chunk_tiles
+        x1 = cx * ctw
+        y1 = cy * cth
+        x2 = min(mw, x1 + ctw)
+        y2 = min(mh, y1 + cth)
+        tiles = [s for s in layer.get_tiles(x1, y1, x2, y2) if s]
+        if not tiles:
+            return None
+        # Chunks with holes or see-through tiles need per-pixel alpha.
+        opaque = len(tiles) == (x2-x1) * (y2-y1)
+        if opaque:
+            for s in tiles:
+                image = s.image
+                if (image.get_colorkey() is not None or
+                    image.get_alpha() is not None or
+                    image.get_flags() & SRCALPHA):
+                    opaque = False
+                    break
+        size = (x2-x1) * tw, (y2-y1) * th
+        if opaque:
+            surf = pygame.Surface(size)
+        else:
+            surf = pygame.Surface(size, SRCALPHA)
+            surf.fill((0,0,0,0))
+        mx,my = self.map.rect.topleft
+        ox = mx + x1 * tw
+        oy = my + y1 * th
+        blit = surf.blit
+        for s in tiles:
+            rect = s.rect
+            blit(s.image, (rect.x-ox, rect.y-oy))
+        resolution = self.resolution.get(layeri)
+        if resolution is not None:
+            w,h = size
+            surf = pygame.transform.smoothscale(surf,
+                (max(1, int(w*resolution)), max(1, int(h*resolution))))
+        if pygame.display.get_surface() is not None:
+            surf = surf.convert() if opaque else surf.convert_alpha()
+        return surf
+
+    def get(self, layeri, cx, cy):
+        """Return the surface of chunk cx,cy of layer layeri at full size, or
+        None if the chunk has no tiles.
+        """
+        self._tick += 1
+        key = layeri,cx,cy
+        entry = self._chunks.get(key)
+        if entry is None:
+            entry = self._chunks[key] = [self._render(layeri, cx, cy), 0]
+            if self.max_chunks and len(self._chunks) > self.max_chunks:
+                self._evict(self._chunks, self.max_chunks * 3 // 4, key)
+        entry[1] = self._tick
+        surf = entry[0]
+        if surf is None or layeri not in self.resolution:
+            return surf
+        scaled = self._scaled.get(key)
+        if scaled is None:
+            size = self.chunk_size(layeri)
+            w,h = surf.get_size()
+            r = self.resolution[layeri]
+            size = (min(size[0], int(round(w/r))), min(size[1], int(round(h/r))))
+            scaled = self._scaled[key] = [pygame.transform.scale(surf, size), 0]
+            if len(self._scaled) > self.max_scaled:
+                self._evict(self._scaled, self.max_scaled * 3 // 4, key)
+        scaled[1] = self._tick
+        return scaled[0]
+
+    def _evict(self, entries, target, keep):
+        """Internal use. Drop least recently used entries, except keep.
+        """
+        by_age = sorted(entries.iteritems(), key=lambda item: item[1][1])
+        for key,entry in by_age[:len(entries)-target]:
+            if key != keep:
+                del entries[key]
+
+    def draw_layer(self, layeri, surface, rect, offset=None):
+        """Draw the chunks of layer layeri that overlap rect (world coordinates)
+        on surface. The chunks are blitted at their world position minus
+        offset; if offset is None, rect.topleft is used.
+        """
+        x1,y1,x2,y2 = self.chunk_range(layeri, rect)
+        if offset is None:
+            offset = rect[0],rect[1]
+        cw,ch = self.chunk_size(layeri)
+        mx,my = self.map.rect.topleft
+        ox = mx - int(round(offset[0]))
+        oy = my - int(round(offset[1]))
+        get = self.get
+        blit = surface.blit
+        for cy in xrange(y1, y2):
+            y = oy + cy * ch
+            for cx in xrange(x1, x2):
+                surf = get(layeri, cx, cy)
+                if surf is not None:
+                    blit(surf, (ox + cx * cw, y))
+
+    def invalidate(self, layeri=None, tile=None):
+        """Drop chunks so they are re-rendered when next needed.
+
+        If layeri is None, all chunks are dropped. Else if tile is None, the
+        chunks of layer layeri are dropped. Else only the chunk of layer layeri
+        that contains tile position tile (x,y) is dropped.
+        """
+        if layeri is None:
+            self._chunks.clear()
+            self._scaled.clear()
+            return
+        if tile is None:
+            for entries in self._chunks,self._scaled:
+                for key in [k for k in entries if k[0] == layeri]:
+                    del entries[key]
+            return
+        ctw,cth = self.chunk_tiles
+        key = layeri, tile[0] // ctw, tile[1] // cth
+        self._chunks.pop(key, None)
+        self._scaled.pop(key, None)
@@ -26,6 +26,7 @@ __doc__ = """toolkit.py - Some helper tools for Gummworld2.
 
 import os
 import re
+import struct
 import urllib
 
 
@@ -34,12 +35,16 @@ from pygame.locals import RLEACCEL, SRCALPHA, BLEND_RGBA_ADD
 from pygame.sprite import Sprite
 
 from gummworld2 import data, State, Map, MapLayer, Vec2d
+from gummworld2.assets import asset_manager
 from gummworld2.geometry import RectGeometry, PolyGeometry, CircleGeometry
 from gummworld2.ui import HUD, Stat, Statf, hud_font
+from gummworld2.tilecache import shared_cache
 from tiledtmxloader import TileMapParser, ImageLoaderPygame
 
 # HACK by Cosmo to get pygame 1.8 working
 haspygame19 = pygame.version.vernum >= (1, 9)
+# Surface.blits() arrived in pygame 1.9.4.
+haspygameblits = hasattr(pygame.Surface, 'blits')
 
 # Filename-matching extensions for image formats that pygame can load.
 IMAGE_FILE_EXTENSIONS = (
@@ -69,12 +74,33 @@ class Tilesheet(object):
         self.tile_size = tile_size
         self.spacing = spacing
         self.rects = rects
+        self.converted = False
+        self._tiles = {}
     
     def get_image(self, tile_id):
-        rect = self.rects[tile_id]
-        tile = self.image.subsurface(rect).copy()
+        """Return the image of tile_id. The image is a subsurface of the sheet,
+        made once and shared by all callers. It shares pixels with the sheet,
+        so copy it before drawing on it.
+        """
+        tile = self._tiles.get(tile_id)
+        if tile is None:
+            tile = self._tiles[tile_id] = self.image.subsurface(
+                self.rects[tile_id])
         return tile
     
+    def convert(self):
+        """Convert the sheet to the display's pixel format, once, for faster
+        blits. Tile images made before the call keep the old format.
+        """
+        if not self.converted and pygame.display.get_surface() is not None:
+            image = self.image
+            if image.get_alpha() is not None or image.get_flags() & SRCALPHA:
+                self.image = image.convert_alpha()
+            else:
+                self.image = image.convert()
+            self._tiles.clear()
+            self.converted = True
+    
     def tile_info(self, tile_id):
         """Return a Struct populated with tilesheet info for tile_id. This info
         represents everything needed by the Tile class constructor in
@@ -305,9 +331,8 @@ def collapse_map_layer(map, layeri, num_tiles=(2,2)):
                     s.image.set_colorkey(colorkey, RLEACCEL)
 ##                    s.image.set_alpha(tile.image.get_alpha())
                 s.rect.topleft = Vec2d(x,y) * map.tile_size
-#                if not s.image in map.subpixel_cache:
-#                    map.subpixel_cache[s.image] = SubPixelSurface(s.image, 4)
-#                s.subpixel_image = map.subpixel_cache[s.image]
+#                # Variants are shared and generated lazily by subpixel_cache.
+#                s.subpixel_image = SubPixelSurface(s.image, 4)
                 new_layer.append(s)
             else:
                 new_layer.append(None)
@@ -493,10 +518,13 @@ def load_entities(filepath, cls_dict={}):
     classes will be used by default: geometry.RectGeometry,
     geometry.PolyGeometry, geometry.CircleGeometry. Classes substituted in this
     manner must have constructors that are compatible with the default classes.
+    
+    Files in the binary entity format are read with import_world_binary(). Add
+    the entities to a world in one go with QuadTree.add_bulk().
     """
 #    import_script = data.filepath(
 #        'plugins', os.path.join('map','import_world_quadtree.py'))
-    State.world.remove(*State.world.entity_branch.keys())
+    State.world.remove_bulk(State.world.entity_branch.keys())
     file_handle = open(filepath, 'rb')
 #    locals_dict = {
 #        'fh'         : file_handle,
@@ -505,8 +533,14 @@ def load_entities(filepath, cls_dict={}):
 #    locals_dict['poly_cls'] = cls_dict.get('poly_cls', PolyGeometry)
 #    locals_dict['circle_cls'] = cls_dict.get('circle_cls', CircleGeometry)
 #    execfile(import_script, {}, locals_dict)
-    entities,tilesheets = import_world_quadtree(
-        file_handle, RectGeometry, PolyGeometry, CircleGeometry)
+    if is_entity_file_binary(file_handle):
+        importer = import_world_binary
+    else:
+        importer = import_world_quadtree
+    entities,tilesheets = importer(file_handle,
+        cls_dict.get('rect_cls', RectGeometry),
+        cls_dict.get('poly_cls', PolyGeometry),
+        cls_dict.get('circle_cls', CircleGeometry))
     file_handle.close()
 #    return locals_dict['entities']
     return entities,tilesheets
@@ -525,11 +559,93 @@ def export_world_quadtree(fh, entities):
     
     The values saved are those needed for each shape-class's constructor, plus a
     block of arbitrary user data. The user data is url-encoded.
+    
+    This is entity_record() and write_entity_records() in one step. To save
+    without holding up the caller, take the records and pass them to a thread
+    that writes them.
     """
     
     if not isinstance(entities, (list,tuple)) and not hasattr(entities, '__iter__'):
         raise pygame.error, 'entities must be iterable'
     
+    write_entity_records(fh, [entity_record(entity) for entity in entities])
+    
+# export_world_quadtree
+
+
+def entity_record(entity):
+    """Return a snapshot of the values export_world_quadtree() saves for entity:
+    a tuple (kind, values, user_data). kind is 'rect', 'circle', or 'poly';
+    values is a tuple of numbers; user_data is the raw string.
+    
+    A record holds only immutable values, so it is safe to hand to another
+    thread while the entity continues to be edited.
+    """
+    user_data = getattr(entity, 'user_data', '')
+    if isinstance(entity, RectGeometry):
+        # rect x y w h
+        x,y = entity.rect.topleft
+        w,h = entity.rect.size
+        return 'rect', (x, y, w, h), user_data
+    elif isinstance(entity, CircleGeometry):
+        # circle centerx centery radius
+        x,y = entity.position
+        return 'circle', (x, y, entity.radius), user_data
+    elif isinstance(entity, PolyGeometry):
+        # poly centerx centery rel_x1 rel_y1 rel_x2 rel_y2 rel_x3 rel_y3...
+        #
+        # Note: x and y are relative to the containing rect's topleft.
+        x,y = entity.rect.topleft
+        values = list(entity.rect.center)
+        for x1,y1 in entity.points:
+            values.extend((x1-x, y1-y))
+        return 'poly', tuple(values), user_data
+    else:
+        raise pygame.error, 'unsupported type: ' + entity.__class__.__name__
+
+# entity_record
+
+
+def entity_record_center(record):
+    """Return the world position (x,y) of the center of a record made by
+    entity_record().
+    """
+    kind,values,user_data = record
+    if kind == 'rect':
+        x,y,w,h = values
+        return x + w // 2, y + h // 2
+    else:
+        # circle and poly records start with the center.
+        return values[0],values[1]
+
+# entity_record_center
+
+
+def make_entity(kind, values, rect_cls, poly_cls, circle_cls):
+    """Return a new entity for the kind and values of a record made by
+    entity_record(). user_data is not set.
+    """
+    if kind == 'rect':
+        return rect_cls(*values)
+    elif kind == 'circle':
+        x,y,radius = values
+        return circle_cls((x,y), radius)
+    elif kind == 'poly':
+        center = values[0:2]
+        points = zip(values[2::2], values[3::2])
+        return poly_cls(points, center)
+    else:
+        raise pygame.error, 'unsupported entity kind: ' + repr(kind)
+
+# make_entity
+
+
+def write_entity_records(fh, records):
+    """Write records made by entity_record() to file fh in the format read by
+    import_world_quadtree(). Each record is two lines: the shape, then its
+    url-encoded user data.
+    """
+    
     def quote(user_data):
         translated_data = []
         for line in user_data.split('\n'):
@@ -540,51 +656,12 @@ def export_world_quadtree(fh, entities):
         quoted_data = urllib.quote(quoted_data)
         return quoted_data
     
-    for entity in entities:
-        if isinstance(entity, RectGeometry):
-            # format:
-            # rect x y w h
-            # user_data ...
-            x,y = entity.rect.topleft
-            w,h = entity.rect.size
-            user_data = ''
-            if hasattr(entity, 'user_data'):
-                user_data = quote(entity.user_data)
-            fh.write('rect %d %d %d %d\n' % (x, y, w, h))
-            fh.write('user_data ' + user_data + '\n')
-        elif isinstance(entity, CircleGeometry):
-            # format:
-            # circle centerx centery radius
-            # user_data ...
-            x,y = entity.position
-            radius = entity.radius
-            user_data = ''
-            if hasattr(entity, 'user_data'):
-                user_data = quote(entity.user_data)
-            fh.write('circle %d %d %d\n' % (x,y,radius))
-            fh.write('user_data ' + user_data + '\n')
-        elif isinstance(entity, PolyGeometry):
-            # format:
-            # poly centerx centery rel_x1 rel_y1 rel_x2 rel_y2 rel_x3 rel_y3...
-            # user_data ...
-            #
-            # Note: x and y are relative to the containing rect's topleft.
-            center = entity.rect.center
-            x,y = entity.rect.topleft
-            w,h = entity.rect.size
-            user_data = ''
-            if hasattr(entity, 'user_data'):
-                user_data = quote(entity.user_data)
-            fh.write('poly')
-            fh.write(' %d %d' % center)
-            for x1,y1 in entity.points:
-                fh.write(' %d %d' % (x1-x,y1-y))
-            fh.write('\n')
-            fh.write('user_data ' + user_data + '\n')
-        else:
-            raise pygame.error, 'unsupported type: ' + entity.__class__.__name__
-    
-# export_world_quadtree
+    write = fh.write
+    for kind,values,user_data in records:
+        write(kind + ' %d'*len(values) % values + '\n')
+        write('user_data ' + quote(user_data) + '\n')
+
+# write_entity_records
 
 
 def import_world_quadtree(fh, rect_cls, poly_cls, circle_cls):
@@ -628,28 +705,8 @@ def import_world_quadtree(fh, rect_cls, poly_cls, circle_cls):
         if what == 'user_data':
             # User data format:
             # user_data url_encoded_string
-            user_data = []
-            # Unquote the user_data string and split it into lines.
-            lines = urllib.unquote(' '.join(parts[1:])).split('\n')
-            # Scan each line for tile info, load the tilesheets, and populate the
-            # entity's user_data attribute.
-            for line in lines:
-                # Split into space-delimited tokens.
-                parts = line.split(' ')
-                if parts[0] == 'tile':
-                    # Process the tile info entry. Format is:
-                    # 0: tile
-                    # 1: tile_id
-                    # 2..end: relpath_of_image
-                    file_path = ' '.join(parts[2:])
-                    file_path = os.path.join(*file_path.split('/'))
-                    if file_path not in tilesheets:
-                        tilesheet = load_tilesheet(file_path)
-                        tilesheets[file_path] = tilesheet
-                    # Join the parts and append to user_data.
-                    line = ' '.join(parts[0:2] + [file_path])
-                user_data.append(line)
-            entity.user_data = '\n'.join(user_data)
+            entity.user_data = load_user_data_tiles(
+                urllib.unquote(' '.join(parts[1:])), tilesheets)
         elif what == 'rect':
             # Rect format:
             # rect x y w h
@@ -681,9 +738,295 @@ def import_world_quadtree(fh, rect_cls, poly_cls, circle_cls):
     return entities, tilesheets
     
 # import_world_quadtree
+
+
+def load_user_data_tiles(user_data, tilesheets):
+    """Scan user_data for tile info, and load the tilesheets it names into the
+    tilesheets dict. Return user_data with the tile paths converted to native
+    form.
+    """
+    lines = []
+    for line in user_data.split('\n'):
+        # Split into space-delimited tokens.
+        parts = line.split(' ')
+        if parts[0] == 'tile':
+            # Process the tile info entry. Format is:
+            # 0: tile
+            # 1: tile_id
+            # 2..end: relpath_of_image
+            file_path = ' '.join(parts[2:])
+            file_path = os.path.join(*file_path.split('/'))
+            if file_path not in tilesheets:
+                tilesheet = load_tilesheet(file_path)
+                tilesheets[file_path] = tilesheet
+            # Join the parts and append to user_data.
+            line = ' '.join(parts[0:2] + [file_path])
+        lines.append(line)
+    return '\n'.join(lines)
+
+# load_user_data_tiles
+
+
+def read_entity_records(fh):
+    """Read the text format written by export_world_quadtree() and yield a
+    record per entity, as made by entity_record(). No shapes are constructed
+    and no tilesheets are loaded.
+    """
+    record = None
+    line_num = 0
+    for line in fh:
+        line_num += 1
+        parts = line.rstrip('\r\n').split(' ')
+        what = parts[0]
+        if what == 'user_data':
+            if record is None:
+                raise pygame.error, 'line %d: user_data without a shape' % line_num
+            record = record[0], record[1], urllib.unquote(' '.join(parts[1:]))
+        elif what in ('rect', 'circle', 'poly'):
+            if record is not None:
+                yield record
+            record = what, tuple([int(float(v)) for v in parts[1:]]), ''
+        else:
+            raise pygame.error, 'line %d: keyword "%s" unexpected' % (line_num,what)
+    if record is not None:
+        yield record
+
+# read_entity_records
+
+
+## Binary entity files.
+##
+## All values are little-endian.
+##
+##  header      '<4sHHIII' magic, version, 0, num records, num tilesheets,
+##                  num strings
+##  tilesheets  num tilesheets * ('<I' length, path); paths use '/'
+##  strings     num strings * ('<I' length, user_data); a user_data string is
+##                  stored once, however many entities share it
+##  records     num records * ('<BBHI' kind, 0, num values, string index,
+##                  then '<i' * num values)
+##
+## The values of a record are those of entity_record(): rect x y w h; circle
+## x y radius; poly centerx centery rel_x1 rel_y1 ...
+
+ENTITY_FILE_MAGIC = 'GW2E'
+ENTITY_FILE_VERSION = 1
+
+_ENTITY_HEADER = struct.Struct('<4sHHIII')
+_ENTITY_RECORD = struct.Struct('<BBHI')
+_ENTITY_LENGTH = struct.Struct('<I')
+_ENTITY_KINDS = ('rect', 'circle', 'poly')
+_ENTITY_KIND_CODES = dict([(k,i+1) for i,k in enumerate(_ENTITY_KINDS)])
+# {number of values : Struct}
+_entity_value_structs = {}
+
+
+def pack_entity_record(kind, values, string_i):
+    """Return the binary form of an entity record's kind and values, with
+    string_i the index of its user_data in the file's string table. This
+    layout is shared by the binary entity format and entitystore's region
+    files.
+    """
+    n = len(values)
+    return _ENTITY_RECORD.pack(_ENTITY_KIND_CODES[kind], 0, n, string_i) + \
+        entity_value_struct(n).pack(*[int(v) for v in values])
+
+# pack_entity_record
+
+
+def unpack_entity_record(buf, pos=0):
+    """Return (kind, values, string_i, end) for the binary record at offset
+    pos in buf, as written by pack_entity_record(). end is the offset just past
+    the record. pygame.error is raised if buf is too short.
+    """
+    try:
+        code,junk,n,string_i = _ENTITY_RECORD.unpack_from(buf, pos)
+        pos += _ENTITY_RECORD.size
+        fmt = entity_value_struct(n)
+        values = fmt.unpack_from(buf, pos)
+    except struct.error:
+        raise pygame.error, 'entity record is truncated'
+    return _ENTITY_KINDS[code-1], values, string_i, pos + fmt.size
+
+# unpack_entity_record
+
+
+def entity_value_struct(n):
+    """Return the Struct of a binary entity record's n values.
+    """
+    fmt = _entity_value_structs.get(n)
+    if fmt is None:
+        fmt = _entity_value_structs[n] = struct.Struct('<%di' % n)
+    return fmt
+
+# entity_value_struct
+
+
+def write_entity_records_binary(fh, records):
+    """Write records made by entity_record() to file fh in the binary entity
+    format. fh must be opened in binary mode.
+    """
+    records = list(records)
+    strings = []
+    string_index = {}
+    tilesheet_paths = []
+    indexes = []
+    for kind,values,user_data in records:
+        # Same translation as the text format: no CRs, forward slashes.
+        user_data = '\n'.join([line.rstrip('\r').replace('\\', '/')
+            for line in user_data.split('\n')])
+        i = string_index.get(user_data)
+        if i is None:
+            i = string_index[user_data] = len(strings)
+            strings.append(user_data)
+            for line in user_data.split('\n'):
+                parts = line.split(' ')
+                if parts[0] == 'tile':
+                    path = ' '.join(parts[2:])
+                    if path not in tilesheet_paths:
+                        tilesheet_paths.append(path)
+        indexes.append(i)
     
+    write = fh.write
+    write(_ENTITY_HEADER.pack(ENTITY_FILE_MAGIC, ENTITY_FILE_VERSION, 0,
+        len(records), len(tilesheet_paths), len(strings)))
+    pack_length = _ENTITY_LENGTH.pack
+    for string in tilesheet_paths + strings:
+        write(pack_length(len(string)))
+        write(string)
+    for (kind,values,user_data),i in zip(records, indexes):
+        write(pack_entity_record(kind, values, i))
+
+# write_entity_records_binary
+
+
+def export_world_binary(fh, entities):
+    """Export quadtree entities to file fh in the binary entity format. See
+    export_world_quadtree().
+    """
+    if not isinstance(entities, (list,tuple)) and not hasattr(entities, '__iter__'):
+        raise pygame.error, 'entities must be iterable'
+    write_entity_records_binary(fh, [entity_record(e) for e in entities])
+
+# export_world_binary
 
-def load_tilesheet(file_path):
+
+def is_entity_file_binary(fh):
+    """Return True if file fh, open at its start, is in the binary entity
+    format. The file position is restored.
+    """
+    pos = fh.tell()
+    magic = fh.read(len(ENTITY_FILE_MAGIC))
+    fh.seek(pos)
+    return magic == ENTITY_FILE_MAGIC
+
+# is_entity_file_binary
+
+
+class EntityFileReader(object):
+    """Streaming reader for the binary entity format.
+    
+    The header and the tables are read on construction. Iterating over the
+    reader then reads and yields one record at a time, as made by
+    entity_record(), so the records of a large file need not be in memory at
+    once.
+    
+    Attributes:
+        version -> Integer. The format version of the file.
+        num_records -> Integer. The number of records.
+        tilesheet_paths -> List of the relative tilesheet paths named in the
+            file's user data, with '/' separators.
+        strings -> List of the user_data strings.
+    """
+    
+    def __init__(self, fh):
+        self.fh = fh
+        data = fh.read(_ENTITY_HEADER.size)
+        if len(data) < _ENTITY_HEADER.size:
+            raise pygame.error, 'entity file header is truncated'
+        magic,version,junk,num_records,num_tilesheets,num_strings = \
+            _ENTITY_HEADER.unpack(data)
+        if magic != ENTITY_FILE_MAGIC:
+            raise pygame.error, 'not a binary entity file'
+        if version > ENTITY_FILE_VERSION:
+            raise pygame.error, 'entity file version %d is not supported' % version
+        self.version = version
+        self.num_records = num_records
+        read_string = self._read_string
+        self.tilesheet_paths = [read_string() for i in xrange(num_tilesheets)]
+        self.strings = [read_string() for i in xrange(num_strings)]
+    
+    def _read_string(self):
+        n, = _ENTITY_LENGTH.unpack(self.fh.read(_ENTITY_LENGTH.size))
+        return self.fh.read(n)
+    
+    def __iter__(self):
+        read = self.fh.read
+        unpack_record = _ENTITY_RECORD.unpack
+        record_size = _ENTITY_RECORD.size
+        value_struct = entity_value_struct
+        kinds = _ENTITY_KINDS
+        strings = self.strings
+        for i in xrange(self.num_records):
+            data = read(record_size)
+            if len(data) < record_size:
+                raise pygame.error, 'entity file is truncated at record %d' % i
+            code,junk,n,string_i = unpack_record(data)
+            fmt = value_struct(n)
+            yield kinds[code-1], fmt.unpack(read(fmt.size)), strings[string_i]
+    
+    def __len__(self):
+        return self.num_records
+
+
+def import_world_binary(fh, rect_cls, poly_cls, circle_cls):
+    """A binary world entity importer. It is the counterpart of
+    import_world_quadtree() for files written by export_world_binary(), and
+    returns the same (entities, tilesheets).
+    """
+    if not issubclass(rect_cls, RectGeometry):
+        raise pygame.error, 'argument "rect_cls" must be a subclass of geometry.RectGeometry'
+    if not issubclass(poly_cls, PolyGeometry):
+        raise pygame.error, 'argument "poly_cls" must be a subclass of geometry.PolyGeometry'
+    if not issubclass(circle_cls, CircleGeometry):
+        raise pygame.error, 'argument "circle_cls" must be a subclass of geometry.CircleGeometry'
+    
+    reader = EntityFileReader(fh)
+    tilesheets = {}
+    # Each distinct user_data string is processed once.
+    strings = {}
+    entities = []
+    append = entities.append
+    for kind,values,user_data in reader:
+        entity = make_entity(kind, values, rect_cls, poly_cls, circle_cls)
+        native = strings.get(user_data)
+        if native is None:
+            native = strings[user_data] = load_user_data_tiles(
+                user_data, tilesheets)
+        entity.user_data = native
+        append(entity)
+    return entities, tilesheets
+
+# import_world_binary
+
+
+def convert_world_text_to_binary(text_fh, binary_fh):
+    """Convert an entity file from the text format to the binary format.
+    Return the number of entities converted.
+    """
+    records = list(read_entity_records(text_fh))
+    write_entity_records_binary(binary_fh, records)
+    return len(records)
+
+# convert_world_text_to_binary
+    
+
+# Tilesheets loaded by load_tilesheet(), shared process-wide.
+# {absolute path : (image mtime, tilesheet values, Tilesheet)}
+tilesheet_registry = {}
+
+
+def load_tilesheet(file_path, convert=False):
     """Load a tilesheet. A toolkit.Tilesheet containing tilesheet info is
     returned.
     
@@ -691,6 +1034,14 @@ def load_tilesheet(file_path):
     relative path, it must exist relative to data.data_dir (see the
     gummworld2.data module). If file_path.tilesheet exists it will be used to
     size the tiles; otherwise the defaults (0,0,32,32,0,0) will be used.
+    
+    Tilesheets are kept in tilesheet_registry, so loading the same file again
+    returns the same Tilesheet, and its tile images, until the image file or
+    its tilesheet info changes. If convert is True, the sheet is converted to
+    the display's pixel format once; see Tilesheet.convert().
+    
+    The sheet's image is loaded through assets.asset_manager, so tilesheets
+    can be decoded ahead of time with asset_manager.preload().
     """
     # Make sure we have an image file type (check file extension).
     if not os.path.isabs(file_path):
@@ -700,9 +1051,20 @@ def load_tilesheet(file_path):
     if ext.lower() not in IMAGE_FILE_EXTENSIONS:
         self.gui_alert('Unsupported image file type: '+ext)
         return
-    # Load the image and tilesheet dimensions.
-    image = pygame.image.load(file_path)
+    key = os.path.abspath(file_path)
+    mtime = os.path.getmtime(key)
     values = [int(s) for s in get_tilesheet_info(file_path)]
+    entry = tilesheet_registry.get(key)
+    if entry is not None and entry[0] == mtime and entry[1] == values:
+        tilesheet = entry[2]
+        if convert:
+            tilesheet.convert()
+        return tilesheet
+    if entry is not None:
+        # The file changed since it was cached.
+        asset_manager.discard(key)
+    # Load the image and tilesheet dimensions.
+    image = asset_manager.get(key)
     margin = Vec2d(values[0:2])
     tile_size = Vec2d(values[2:4])
     spacing = Vec2d(values[4:6])
@@ -720,9 +1082,24 @@ def load_tilesheet(file_path):
             rects.append(pygame.Rect(rx,ry,tx,ty))
     # Make a tilesheet.
     tilesheet = Tilesheet(file_path, image, margin, tile_size, spacing, rects)
+    if convert:
+        tilesheet.convert()
+    tilesheet_registry[key] = mtime, values, tilesheet
     return tilesheet
 
 
+def forget_tilesheet(file_path=None):
+    """Drop file_path from tilesheet_registry, or every tilesheet if file_path
+    is None. Tilesheets already handed out are not affected.
+    """
+    if file_path is None:
+        tilesheet_registry.clear()
+        return
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(data.data_dir,file_path)
+    tilesheet_registry.pop(os.path.abspath(file_path), None)
+
+
 def get_tilesheet_info(tilesheet_path):
     """Get the tilesheet meta data from file if it exists.
     """
@@ -798,10 +1175,56 @@ def draw_sprite(s, blit_flags=0):
 # draw_sprite
 
 
-def draw_tiles():
+def draw_sprites(sprites, camera=None, blit_flags=0):
+    """Draw many sprites on the camera's surface in one batch.
+    
+    The sprites argument is an iterable of sprites with image and rect
+    attributes in world coordinates.
+    
+    The camera argument is the camera to draw through. If camera is None,
+    State.camera is used.
+    
+    Screen positions are computed in one pass, sprites that are outside the
+    camera's view are culled, and the rest are submitted with a single call to
+    Surface.blits(). Returns the number of sprites drawn.
+    """
+    if camera is None:
+        camera = State.camera
+    cx,cy,vw,vh = camera.rect
+    right = cx + vw
+    bottom = cy + vh
+    if blit_flags and haspygame19:
+        batch = [
+            (s.image, (r.x-cx, r.y-cy), None, blit_flags)
+            for s,r in ((s,s.rect) for s in sprites)
+            if r.x < right and r.y < bottom and r.right > cx and r.bottom > cy
+        ]
+    else:
+        batch = [
+            (s.image, (r.x-cx, r.y-cy))
+            for s,r in ((s,s.rect) for s in sprites)
+            if r.x < right and r.y < bottom and r.right > cx and r.bottom > cy
+        ]
+    surface = camera.surface
+    if haspygameblits:
+        surface.blits(batch, False)
+    else:
+        blit = surface.blit
+        for args in batch:
+            blit(*args)
+    return len(batch)
+
+# draw_sprites
+
+
+def draw_tiles(render_queue=None):
     """Draw visible tiles.
     
     This function assumes that the tiles stored in the map are sprites.
+    
+    If render_queue is a RenderQueue, its sprites are drawn after the tiles of
+    their layer and row, so they are interleaved with the tiles without a
+    per-frame sort.
     """
     map = State.map
     layers = map.layers
@@ -815,23 +1238,60 @@ def draw_tiles():
         if not layer.visible:
             continue
         left,top,right,bottom = visible_tile_range[layeri]
+        # Queued sprites can be outside the map, so the queue's rows are
+        # walked unclamped; only the tile lookup is clamped.
+        queue_top,queue_bottom = top,bottom
         mapw,maph = layer.map_size
         if left < 0: left = 0
         if top < 0: top = 0
         if right >= mapw: right = mapw #- 1
         if bottom >= maph: bottom = maph #- 1
-        for y in range(top,bottom):
-            yoff = y * mapw
-            start = yoff + left
-            end = yoff + right
-            for s in layer[start:end]:
-                if s:
-                    rect = s.rect
-                    blit(s.image, (rect.x-cx, rect.y-cy))
+        if render_queue is not None:
+            rows = range(queue_top, queue_bottom+render_queue.overhang)
+        else:
+            rows = range(top,bottom)
+        for y in rows:
+            if top <= y < bottom:
+                yoff = y * mapw
+                start = yoff + left
+                end = yoff + right
+                for s in layer[start:end]:
+                    if s:
+                        rect = s.rect
+                        blit(s.image, (rect.x-cx, rect.y-cy))
+            if render_queue is not None:
+                render_queue.draw_row(layeri, y, blit, cx, cy)
 
 # draw_tiles
 
 
+def draw_tiles_cached(camera=None, map=None):
+    """Draw the visible tiles of all visible layers from the map's shared chunk
+    cache.
+    
+    The camera argument defaults to State.camera, and map to State.map. All
+    cameras that draw the same map share its chunks (see
+    tilecache.shared_cache), so each additional view of a map costs only the
+    blits of the chunks it shows. If tiles are changed, call
+    map.render_cache.invalidate().
+    """
+    if camera is None:
+        camera = State.camera
+    if map is None:
+        map = State.map
+    cache = shared_cache(map)
+    surface = camera.surface
+    rect = camera.rect
+    for layeri,layer in enumerate(map.layers):
+        if layer.visible:
+            cache.draw_layer(layeri, surface, rect)
+
+# draw_tiles_cached
+
+
+## The parallax functions below are superseded by parallax.ParallaxRenderer.
+
+
 ## EXPERIMENTAL: not working quite right
 #def get_parallax_tile_range(cam, map, layer, parallax, orig='bottomleft'):
 def get_parallax_tile_range(cam, map, layer, parallax, orig='center'):
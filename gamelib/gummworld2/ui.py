@@ -24,15 +24,26 @@ __doc__ = """ui.py - User Interface module for Gummworld2.
 
 Currently there is only HUD. And some dynamic stats classes with timers for
 callback.
+
+Stat images come from textcache.text_cache, so a stat that cycles through the
+same strings renders each one once. Statf stats whose values are numbers rarely
+repeat. The HUD draws their label from text_cache and the formatted value from
+the glyphs of a textcache.GlyphAtlas, and their image is only rendered if
+something asks for it. The atlas has no kerning, so it is only used when the
+pieces add up to the width Font.render() gives the whole text; otherwise the
+whole text is rendered.
 """
 
 
+import re
+
 import pygame
 from pygame.locals import Color, RLEACCEL
 
 if __name__ == '__main__':
     import paths
 from gummworld2 import data, State
+from gummworld2.textcache import text_cache, glyph_atlas
 
 
 pygame.init()
@@ -41,6 +52,27 @@ hud_alpha = 208
 text_color = Color('yellow')
 
 
+_conversion_spec = re.compile(r'%%|%[-#0 +]*\d*(?:\.\d+)?[a-zA-Z]')
+
+
+def _split_fmt(fmt):
+    """split fmt into (prefix, spec, suffix) around its only conversion spec;
+    None if it has more than one
+    """
+    specs = [m for m in _conversion_spec.finditer(fmt) if m.group() != '%%']
+    if len(specs) != 1:
+        return None
+    m = specs[0]
+    return fmt[:m.start()] % (), m.group(), fmt[m.end():] % ()
+
+
+def _is_numeric(value):
+    """a number, or a tuple or list of numbers, such as a position"""
+    if isinstance(value, (tuple,list)):
+        return all([_is_numeric(v) for v in value])
+    return isinstance(value, (int,long,float))
+
+
 class HUD(pygame.sprite.OrderedUpdates):
     
     def __init__(self):
@@ -91,9 +123,13 @@ class HUD(pygame.sprite.OrderedUpdates):
         if not State.show_hud:
             return
         if surface is None:
-            super(HUD, self).draw(State.camera.surface)
-        else:
-            super(HUD, self).draw(surface)
+            surface = State.camera.surface
+        for sprite in self.sprites():
+            draw = getattr(sprite, 'draw', None)
+            if draw is None:
+                surface.blit(sprite.image, sprite.rect)
+            else:
+                draw(surface)
 
 
 class Stat(pygame.sprite.Sprite):
@@ -125,8 +161,11 @@ class Stat(pygame.sprite.Sprite):
     def set_value(self, text):
         if isinstance(text, str) and text != self.text:
             self.text = text
-            self.image = self.font.render(text, True, text_color)
-            self.image.set_alpha(hud_alpha)
+            self.image = text_cache.render(
+                self.font, text, True, text_color, alpha=hud_alpha)
+
+    def draw(self, surface):
+        surface.blit(self.image, self.rect)
 
 
 class Statf(pygame.sprite.Sprite):
@@ -137,6 +176,10 @@ class Statf(pygame.sprite.Sprite):
         self.font = font
         self.fmt = fmt
         self.value = None
+        self.text = None
+        self._fmt_parts = _split_fmt(fmt)
+        self._pieces = None     # (prefix, value text, suffix) for the atlas
+        self._image = None
         self.callback = callback
         self.interval = interval
         self.time_left = 0
@@ -159,8 +202,63 @@ class Statf(pygame.sprite.Sprite):
     def set_value(self, value):
         if value is not None and value != self.value:
             self.value = value
-            self.image = self.font.render(self.fmt%(value,), True, text_color)
-            self.image.set_alpha(hud_alpha)
+            self.text = self.fmt%(value,)
+            self._pieces = self._split_text(value)
+            self._image = None
+            if hasattr(self, 'rect'):
+                self.rect.size = self.font.size(self.text)
+
+    def _split_text(self, value):
+        """return (prefix, value text, suffix) if the text can be drawn with
+        the glyph atlas exactly as Font.render() draws it, else None
+        """
+        if self._fmt_parts is None or not _is_numeric(value):
+            return None
+        prefix,spec,suffix = self._fmt_parts
+        value_text = spec%(value,)
+        font = self.font
+        atlas = glyph_atlas(font, text_color, alpha=hud_alpha)
+        width = atlas.size(value_text)[0]
+        for label in prefix,suffix:
+            if label:
+                width += text_cache.render(
+                    font, label, True, text_color, alpha=hud_alpha).get_width()
+        # Kerning inside the value, or where it meets the label, changes the
+        # width.
+        if width != font.size(self.text)[0]:
+            return None
+        return prefix,value_text,suffix
+
+    @property
+    def image(self):
+        if self._image is None:
+            if self._pieces is not None:
+                # Not shared: the text seldom repeats.
+                self._image = self.font.render(self.text, True, text_color)
+                self._image.set_alpha(hud_alpha)
+            else:
+                self._image = text_cache.render(
+                    self.font, self.text, True, text_color, alpha=hud_alpha)
+        return self._image
+
+    def draw(self, surface):
+        if self._pieces is None:
+            surface.blit(self.image, self.rect)
+            return
+        prefix,value_text,suffix = self._pieces
+        font = self.font
+        x,y = self.rect.topleft
+        if prefix:
+            label = text_cache.render(
+                font, prefix, True, text_color, alpha=hud_alpha)
+            surface.blit(label, (x,y))
+            x += label.get_width()
+        atlas = glyph_atlas(font, text_color, alpha=hud_alpha)
+        x += atlas.draw(surface, value_text, (x,y))[0]
+        if suffix:
+            label = text_cache.render(
+                font, suffix, True, text_color, alpha=hud_alpha)
+            surface.blit(label, (x,y))
 
 if __name__ == '__main__':
     from gummworld2 import Screen, GameClock
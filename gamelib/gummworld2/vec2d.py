@@ -6,6 +6,9 @@ Source: http://www.pygame.org/wiki/2DVectorClass
 ########################################################################
 import operator
 import math
+
+# Types that take the scalar fast path in the arithmetic operators.
+_SCALARS = (int, long, float)
  
 class Vec2d(object):
     """2d vector class, supports vector and scalar operators,
@@ -14,7 +17,7 @@ class Vec2d(object):
     __slots__ = ['x', 'y']
  
     def __init__(self, x_or_pair, y = None):
-        if y == None:
+        if y is None:
             self.x = x_or_pair[0]
             self.y = x_or_pair[1]
         else:
@@ -24,6 +27,9 @@ class Vec2d(object):
     def __len__(self):
         return 2
  
+    def __iter__(self):
+        return iter((self.x, self.y))
+ 
     def __getitem__(self, key):
         if key == 0:
             return self.x
@@ -102,8 +108,10 @@ class Vec2d(object):
  
     # Addition
     def __add__(self, other):
-        if isinstance(other, Vec2d):
+        if type(other) is Vec2d:
             return Vec2d(self.x + other.x, self.y + other.y)
+        elif type(other) in _SCALARS:
+            return Vec2d(self.x + other, self.y + other)
         elif hasattr(other, "__getitem__"):
             return Vec2d(self.x + other[0], self.y + other[1])
         else:
@@ -111,9 +119,12 @@ class Vec2d(object):
     __radd__ = __add__
     
     def __iadd__(self, other):
-        if isinstance(other, Vec2d):
+        if type(other) is Vec2d:
             self.x += other.x
             self.y += other.y
+        elif type(other) in _SCALARS:
+            self.x += other
+            self.y += other
         elif hasattr(other, "__getitem__"):
             self.x += other[0]
             self.y += other[1]
@@ -124,23 +135,28 @@ class Vec2d(object):
  
     # Subtraction
     def __sub__(self, other):
-        if isinstance(other, Vec2d):
+        if type(other) is Vec2d:
             return Vec2d(self.x - other.x, self.y - other.y)
+        elif type(other) in _SCALARS:
+            return Vec2d(self.x - other, self.y - other)
         elif (hasattr(other, "__getitem__")):
             return Vec2d(self.x - other[0], self.y - other[1])
         else:
             return Vec2d(self.x - other, self.y - other)
     def __rsub__(self, other):
-        if isinstance(other, Vec2d):
-            return Vec2d(other.x - self.x, other.y - self.y)
+        if type(other) in _SCALARS:
+            return Vec2d(other - self.x, other - self.y)
         if (hasattr(other, "__getitem__")):
             return Vec2d(other[0] - self.x, other[1] - self.y)
         else:
             return Vec2d(other - self.x, other - self.y)
     def __isub__(self, other):
-        if isinstance(other, Vec2d):
+        if type(other) is Vec2d:
             self.x -= other.x
             self.y -= other.y
+        elif type(other) in _SCALARS:
+            self.x -= other
+            self.y -= other
         elif (hasattr(other, "__getitem__")):
             self.x -= other[0]
             self.y -= other[1]
@@ -151,18 +167,23 @@ class Vec2d(object):
  
     # Multiplication
     def __mul__(self, other):
-        if isinstance(other, Vec2d):
+        if type(other) is Vec2d:
             return Vec2d(self.x*other.x, self.y*other.y)
-        if (hasattr(other, "__getitem__")):
+        elif type(other) in _SCALARS:
+            return Vec2d(self.x*other, self.y*other)
+        elif (hasattr(other, "__getitem__")):
             return Vec2d(self.x*other[0], self.y*other[1])
         else:
             return Vec2d(self.x*other, self.y*other)
     __rmul__ = __mul__
     
     def __imul__(self, other):
-        if isinstance(other, Vec2d):
+        if type(other) is Vec2d:
             self.x *= other.x
             self.y *= other.y
+        elif type(other) in _SCALARS:
+            self.x *= other
+            self.y *= other
         elif (hasattr(other, "__getitem__")):
             self.x *= other[0]
             self.y *= other[1]
@@ -173,13 +194,29 @@ class Vec2d(object):
  
     # Division
     def __div__(self, other):
+        if type(other) is Vec2d:
+            return Vec2d(self.x / other.x, self.y / other.y)
+        elif type(other) in _SCALARS:
+            return Vec2d(self.x / other, self.y / other)
         return self._o2(other, operator.div)
     def __rdiv__(self, other):
         return self._r_o2(other, operator.div)
     def __idiv__(self, other):
+        if type(other) is Vec2d:
+            self.x /= other.x
+            self.y /= other.y
+            return self
+        elif type(other) in _SCALARS:
+            self.x /= other
+            self.y /= other
+            return self
         return self._io(other, operator.div)
  
     def __floordiv__(self, other):
+        if type(other) is Vec2d:
+            return Vec2d(self.x // other.x, self.y // other.y)
+        elif type(other) in _SCALARS:
+            return Vec2d(self.x // other, self.y // other)
         return self._o2(other, operator.floordiv)
     def __rfloordiv__(self, other):
         return self._r_o2(other, operator.floordiv)
@@ -187,11 +224,14 @@ class Vec2d(object):
         return self._io(other, operator.floordiv)
  
     def __truediv__(self, other):
+        if type(other) is Vec2d:
+            return Vec2d(operator.truediv(self.x, other.x),
+                         operator.truediv(self.y, other.y))
         return self._o2(other, operator.truediv)
     def __rtruediv__(self, other):
         return self._r_o2(other, operator.truediv)
     def __itruediv__(self, other):
-        return self._io(other, operator.floordiv)
+        return self._io(other, operator.truediv)
  
     # Modulo
     def __mod__(self, other):
@@ -245,7 +285,73 @@ class Vec2d(object):
  
     def __invert__(self):
         return Vec2d(-self.x, -self.y)
- 
+
+    # In-place methods. These modify the vector and return None, a la
+    # pygame.Rect.move_ip(). They accept two scalars, which avoids building a
+    # tuple in per-tick code; or a single Vec2d, sequence, or scalar.
+    def set_ip(self, x, y=None):
+        if y is None:
+            if type(x) is Vec2d:
+                x,y = x.x,x.y
+            else:
+                x,y = x[0],x[1]
+        self.x = x
+        self.y = y
+
+    def add_ip(self, x, y=None):
+        if y is None:
+            if type(x) is Vec2d:
+                x,y = x.x,x.y
+            elif type(x) in _SCALARS:
+                y = x
+            else:
+                x,y = x[0],x[1]
+        self.x += x
+        self.y += y
+
+    def sub_ip(self, x, y=None):
+        if y is None:
+            if type(x) is Vec2d:
+                x,y = x.x,x.y
+            elif type(x) in _SCALARS:
+                y = x
+            else:
+                x,y = x[0],x[1]
+        self.x -= x
+        self.y -= y
+
+    def mul_ip(self, x, y=None):
+        if y is None:
+            if type(x) is Vec2d:
+                x,y = x.x,x.y
+            elif type(x) in _SCALARS:
+                y = x
+            else:
+                x,y = x[0],x[1]
+        self.x *= x
+        self.y *= y
+
+    def div_ip(self, x, y=None):
+        if y is None:
+            if type(x) is Vec2d:
+                x,y = x.x,x.y
+            elif type(x) in _SCALARS:
+                y = x
+            else:
+                x,y = x[0],x[1]
+        self.x /= x
+        self.y /= y
+
+    def neg_ip(self):
+        self.x = -self.x
+        self.y = -self.y
+
+    def normalize_ip(self):
+        length = math.sqrt(self.x**2 + self.y**2)
+        if length != 0:
+            self.x /= length
+            self.y /= length
+
     # vectory functions
     def get_length_sqrd(self): 
         return self.x**2 + self.y**2
@@ -456,6 +562,34 @@ if __name__ == "__main__":
             self.assertEquals(inplace_vec, inplace_ref)
             self.assertEquals(inplace_vec, alternate)
         
+        def testInplaceMethods(self):
+            v = Vec2d(5, 13)
+            ref = v
+            self.assert_(v.add_ip(1, 2) is None)
+            self.assertEqual(v, (6, 15))
+            v.sub_ip(Vec2d(1, 1))
+            self.assertEqual(v, (5, 14))
+            v.mul_ip(2)
+            self.assertEqual(v, (10, 28))
+            v.div_ip((2, 4))
+            self.assertEqual(v, (5, 7))
+            v.set_ip(3, 4)
+            v.normalize_ip()
+            self.assertEqual(v, (.6, .8))
+            v.neg_ip()
+            self.assertEqual(v, (-.6, -.8))
+            self.assert_(v is ref)
+        
+        def testTrueDiv(self):
+            v = Vec2d(3, 6)
+            self.assertEqual(v.__truediv__(2), (1.5, 3.0))
+            v.__itruediv__(Vec2d(2, 4))
+            self.assertEqual(v, (1.5, 1.5))
+        
+        def testUnpack(self):
+            x,y = Vec2d(1, 2)
+            self.assertEqual((x,y), (1, 2))
+        
         def testPickle(self):
             testvec = Vec2d(5, .3)
             testvec_str = pickle.dumps(testvec)
@@ -463,6 +597,22 @@ if __name__ == "__main__":
             self.assertEquals(testvec, loaded_vec)
     
     ####################################################################
-    unittest.main()
+    def benchmark(number=200000):
+        """Micro-benchmark the operators used in per-entity per-tick code."""
+        import timeit
+        setup = 'from __main__ import Vec2d; a = Vec2d(1.5, 2.5); b = Vec2d(3.0, 4.0)'
+        for stmt in (
+            'a + b', 'a - b', 'a * 2.0', 'a / 2.0', 'a // b', 'a + (1, 2)',
+            'a += b', 'a.add_ip(b)', 'a.add_ip(1.0, 2.0)', 'x,y = a',
+            'Vec2d(1.0, 2.0)',
+        ):
+            secs = min(timeit.repeat(stmt, setup, number=number, repeat=3))
+            print '%-20s %6.3f usec' % (stmt, secs * 1e6 / number)
+
+    import sys
+    if 'bench' in sys.argv[1:]:
+        benchmark()
+    else:
+        unittest.main()
  
     ######################################################################## 
@@ -56,6 +56,7 @@ Controls
         * Left,Right,Up,Down: Move an entire shape if the center control point is selected; else, move the selected vertex.
         * Minus,Equals: Scale a shape.
         * Ctrl-C, Ctrl-X, Ctrl-V: Cut-copy-paste the selected shape.
+        * Ctrl-Z, Ctrl-Y (or Ctrl-Shift-Z): Undo, redo shape edits.
         * Tab: Cycle shape color scheme for visibility.
 
 What are the double lines?
@@ -107,6 +108,7 @@ Basic to do (complete for 1.0 release):
     [X] Menu toggle for QuadTree grid lines.
     [X] HUD item to alert about shapes in top level.
     [X] Dialog to remove tilesheets from the palette.
+    [X] Background autosave with a change journal.
 
 Advanced to do:
     [_] Tilesheets.
@@ -118,7 +120,7 @@ Advanced to do:
             Do not load images if the dialog is canceled.
         [_] Tool: Strip tile info from user_data if no tilesheet is loaded.
         [_] Tool: Attach or replace tiles for a shape.
-    [_] Undo, redo.
+    [X] Undo, redo.
     [_] Put more thought into working with shapes. e.g. PITA to size a shape
         after every insert. Maybe: a list for history; a customizable imported
         list. Note: copy-paste and key-grab helps with this a lot.
@@ -137,13 +139,18 @@ Advanced to do:
 
 
 ## Python
+from collections import deque
 import cProfile
+from cStringIO import StringIO
 import pstats
 import os
 from os.path import join as joinpath, normpath
+import Queue
 import sys
+import threading
 import time
 import traceback
+import zlib
 
 ## pygame
 import pygame
@@ -256,9 +263,6 @@ class Tile(gui.Image):
             self.tile_selected.fill(Color(140,250,250))
             pygame.draw.rect(self.tile_selected, Color('blue'), self.tile_selected.get_rect(), 1)
             self.tile_selected.set_alpha(99)
-        # Translucent mouse image.
-        self.mouse_image = self.tile_image.copy()
-        self.mouse_image.set_alpha(75)
         # State indicators.
         self.tile_is_selected = False
         self.tile_is_hovering = False
@@ -324,6 +328,420 @@ class TimeThing(object):
         return self.strftime(self.fmt) + ('%.3f' % ms).lstrip('0')
 
 
+class Autosave(object):
+    """Autosave the world's entities in the background.
+    
+    Entities that change are marked with touch(). Each save() snapshots the
+    marked entities' values on the main thread with toolkit.entity_record(),
+    which is cheap, and a worker thread formats and writes them.
+    
+    The autosave is two files. The base file, path, is a full save in the
+    format read by toolkit.import_world_quadtree(); entity N is the Nth record
+    in it. It is written to a temporary file and renamed over path, so a crash
+    never leaves a partial base file. The journal, path.journal, is appended
+    with the records of the entities changed since, so the cost of a save
+    follows the size of the edit, not the size of the world:
+    
+        put N       followed by the entity's two record lines
+        del N
+    
+    The journal's first line stamps it with the base file it applies to:
+    
+        base CRC LENGTH
+    
+    where CRC is the zlib.crc32 of the base file's contents and LENGTH its size.
+    recover() ignores a journal whose stamp does not match the base file, so a
+    journal is never replayed onto a newer base.
+    
+    When the journal grows past half the number of entities, the next save
+    writes a new base file and starts a new journal. The new base is renamed
+    into place first, then the new journal is written to a temporary file and
+    renamed over the old one. A crash between the two leaves the old journal,
+    whose stamp no longer matches, so nothing is lost or replayed twice. If
+    writing the base fails, journal writes are skipped until a base is written
+    again. recover() applies the journal to the base file.
+    
+    Explicit saves can use write() to run on the same worker. Their outcome is
+    reported to a callback, which dispatch() calls on the main thread.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.ids = {}           # {entity : record number}
+        self.next_id = 0
+        self.dirty = set()
+        self.pending = False
+        self.rebase = True      # the next save writes the base file
+        self.journal_ops = 0
+        self.base_ok = False    # the journal matches a written base file
+        # Lists of traceback lines from failed writes, for the main thread.
+        self.errors = []
+        # (callback, success) of finished write() calls, for dispatch().
+        self.results = []
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def touch(self, entity):
+        """Mark entity as added, removed, or changed.
+        """
+        self.dirty.add(entity)
+        self.pending = True
+    
+    def reset(self):
+        """Write a new base file on the next save. Call this when the world's
+        entities are replaced wholesale.
+        """
+        self.dirty.clear()
+        self.pending = True
+        self.rebase = True
+    
+    def save(self, dt=0.0):
+        """Snapshot the changes since the last save and queue them for writing.
+        This is scheduled on State.clock by the editor.
+        """
+        if not self.pending:
+            return
+        entity_record = toolkit.entity_record
+        entities = State.world.entity_branch
+        if self.rebase or self.journal_ops > max(64, len(self.ids) // 2):
+            keys = entities.keys()
+            self.ids = dict(zip(keys, xrange(len(keys))))
+            self.next_id = len(keys)
+            self.journal_ops = 0
+            self.rebase = False
+            records = [entity_record(e) for e in keys]
+            self.queue.put((None, self._write_base, records))
+        else:
+            ids = self.ids
+            ops = []
+            for entity in self.dirty:
+                if entity in entities:
+                    i = ids.get(entity)
+                    if i is None:
+                        i = ids[entity] = self.next_id
+                        self.next_id += 1
+                    ops.append((i, entity_record(entity)))
+                else:
+                    i = ids.pop(entity, None)
+                    if i is not None:
+                        ops.append((i, None))
+            self.journal_ops += len(ops)
+            self.queue.put((None, self._append_journal, ops))
+        self.dirty.clear()
+        self.pending = False
+    
+    def write(self, path, entities, callback=None):
+        """Snapshot entities and write them to path on the worker thread.
+        When the write is done, dispatch() calls callback(success), if given.
+        """
+        records = [toolkit.entity_record(e) for e in entities]
+        self.queue.put((callback, self._write_records, path, records))
+    
+    def flush(self):
+        """Wait until all queued writes are done.
+        """
+        self.queue.join()
+    
+    def dispatch(self):
+        """Call the callbacks of finished write() calls. This is called by the
+        editor's update() on the main thread.
+        """
+        while self.results:
+            callback,success = self.results.pop(0)
+            callback(success)
+    
+    def _run(self):
+        """Internal use. The worker thread.
+        """
+        queue = self.queue
+        while True:
+            job = queue.get()
+            callback = job[0]
+            try:
+                job[1](*job[2:])
+            except:
+                self.errors.append(traceback.format_exception(*sys.exc_info()))
+                traceback.print_exc()
+                success = False
+            else:
+                success = True
+            if callback is not None:
+                self.results.append((callback, success))
+            queue.task_done()
+    
+    def _write_file(self, path, text):
+        """Internal use. Write text to path via a temporary file.
+        """
+        tmp_path = path + '.tmp'
+        file_handle = open(tmp_path, 'wb')
+        try:
+            file_handle.write(text)
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        finally:
+            file_handle.close()
+        if os.name == 'nt' and os.path.exists(path):
+            # Windows will not rename over an existing file.
+            os.remove(path)
+        os.rename(tmp_path, path)
+    
+    def _write_records(self, path, records):
+        """Internal use. Write records to path via a temporary file. Return
+        the text written.
+        """
+        file_handle = StringIO()
+        toolkit.write_entity_records(file_handle, records)
+        text = file_handle.getvalue()
+        self._write_file(path, text)
+        return text
+    
+    def _write_base(self, records):
+        """Internal use. Write a new base file, then replace the journal with
+        an empty one stamped for it.
+        """
+        self.base_ok = False
+        try:
+            text = self._write_records(self.path, records)
+            self._write_file(self.journal_path, self._stamp(text))
+        except:
+            # Journal ops numbered for this base must not go to the old
+            # journal; write a base again on the next save.
+            self.rebase = True
+            raise
+        self.base_ok = True
+    
+    def _stamp(self, text):
+        """Internal use. Return the journal's first line for base file text.
+        """
+        return 'base %d %d\n' % (zlib.crc32(text) & 0xffffffff, len(text))
+    
+    def _append_journal(self, ops):
+        """Internal use. Append ops to the journal.
+        """
+        if not self.base_ok:
+            # The base file failed to write; a rebase is pending, and it will
+            # include these changes.
+            return
+        file_handle = open(self.journal_path, 'ab')
+        try:
+            write = file_handle.write
+            for i,record in ops:
+                if record is None:
+                    write('del %d\n' % i)
+                else:
+                    write('put %d\n' % i)
+                    toolkit.write_entity_records(file_handle, [record])
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        finally:
+            file_handle.close()
+    
+    def recover(self):
+        """Return a file object that reads the autosaved entities in the format
+        of toolkit.import_world_quadtree(), or None if there is no autosave.
+        """
+        self.flush()
+        if not os.path.exists(self.path):
+            return None
+        records = {}
+        file_handle = open(self.path, 'rb')
+        text = file_handle.read()
+        file_handle.close()
+        lines = StringIO(text).readlines()
+        for i in xrange(0, len(lines)-1, 2):
+            records[i//2] = lines[i] + lines[i+1]
+        if os.path.exists(self.journal_path):
+            file_handle = open(self.journal_path, 'rb')
+            lines = file_handle.readlines()
+            file_handle.close()
+            if not lines or lines[0] != self._stamp(text):
+                # The journal belongs to an older base file, whose changes the
+                # current base already holds.
+                lines = []
+            i = 1
+            while i < len(lines):
+                parts = lines[i].split()
+                if parts[0] == 'put':
+                    if i + 2 >= len(lines) or not lines[i+2].endswith('\n'):
+                        # A write was cut short at the end of the journal.
+                        break
+                    records[int(parts[1])] = lines[i+1] + lines[i+2]
+                    i += 3
+                elif lines[i].endswith('\n'):
+                    records.pop(int(parts[1]), None)
+                    i += 1
+                else:
+                    break
+        return StringIO(''.join([records[n] for n in sorted(records)]))
+
+
+class History(object):
+    """Undo and redo for shape edits.
+    
+    Each edit is recorded as the smallest command that can reverse it:
+    
+        ('add', shape, nbytes)
+        ('remove', shape, nbytes)
+        ('change', shape, before, after, nbytes)
+    
+    where before and after are snapshots from shape.save_state(), and nbytes
+    is the memory the command holds, estimated when it is recorded. Undo and
+    redo apply a command by adding, removing, or re-adding the one shape in
+    State.world, so the quadtree is updated incrementally no matter how large
+    the world is.
+    
+    Successive changes to the same shape, such as the motion events of a drag
+    or the keystrokes of a user_data edit, are merged into one command until
+    close() is called.
+    
+    The memory held by the commands is estimated. An 'add' or 'remove'
+    command keeps its shape alive, with its user_data, its tiles' images, and
+    its composed tile stamp, so these are counted too. When the total exceeds
+    max_bytes, the oldest commands are dropped.
+    """
+    
+    def __init__(self, max_bytes=4*1024*1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.undo_list = deque()
+        self.redo_list = []
+        self.open = None        # the shape whose changes are being merged
+    
+    def _size(self, command):
+        """Internal use. Estimate the memory held by command, which does not
+        have its nbytes yet.
+        """
+        size = 64
+        if command[0] == 'change':
+            for state in command[2:]:
+                size += 64 + len(state[-1])
+                if len(state) > 3:
+                    # Poly points.
+                    size += 32 * len(state[2])
+        else:
+            size += self._shape_size(command[1])
+        return size
+    
+    def _shape_size(self, shape):
+        """Internal use. Estimate the memory a shape keeps alive.
+        """
+        size = 64 + len(shape.user_data)
+        tiles = getattr(shape, 'tiles', ())
+        for tile in tiles:
+            # The tile's own image and its palette image.
+            w,h = tile.tile_rect.size
+            size += 2 * w * h * tile.tile_image.get_bytesize()
+        stamp = getattr(shape, 'stamp', None)
+        if stamp is not None:
+            if stamp.image is not None:
+                w,h = stamp.image.get_size()
+                size += w * h * stamp.image.get_bytesize()
+            elif tiles:
+                # Not composed yet; it will be on the next draw.
+                w,h = tiles_bounding_rect(tiles).size
+                size += w * h * 4
+        return size
+    
+    def _push(self, command):
+        """Internal use. Record command with its nbytes, forget the redo
+        list, and drop the oldest commands if over budget.
+        """
+        for c in self.redo_list:
+            self.nbytes -= c[-1]
+        del self.redo_list[:]
+        size = self._size(command)
+        self.undo_list.append(command + (size,))
+        self.nbytes += size
+        undo_list = self.undo_list
+        while self.nbytes > self.max_bytes and len(undo_list) > 1:
+            self.nbytes -= undo_list.popleft()[-1]
+    
+    def added(self, shape):
+        """Record that shape was added to the world.
+        """
+        self.open = None
+        self._push(('add', shape))
+    
+    def removed(self, shape):
+        """Record that shape was removed from the world.
+        """
+        self.open = None
+        self._push(('remove', shape))
+    
+    def changed(self, shape, before):
+        """Record that shape changed. before is shape.save_state() from before
+        the change.
+        """
+        undo_list = self.undo_list
+        if (self.open is shape and undo_list and
+            undo_list[-1][0] == 'change' and undo_list[-1][1] is shape):
+            command = undo_list[-1]
+            self.nbytes -= command[-1]
+            command = ('change', shape, command[2], shape.save_state())
+            size = self._size(command)
+            undo_list[-1] = command + (size,)
+            self.nbytes += size
+        else:
+            after = shape.save_state()
+            if after != before:
+                self._push(('change', shape, before, after))
+                self.open = shape
+    
+    def close(self):
+        """Stop merging changes into the last command.
+        """
+        self.open = None
+    
+    def clear(self):
+        """Forget all commands.
+        """
+        self.undo_list.clear()
+        del self.redo_list[:]
+        self.nbytes = 0
+        self.open = None
+    
+    def undo(self):
+        """Reverse the last command. Return the shape it affected, or None if
+        there is nothing to undo.
+        """
+        self.open = None
+        if not self.undo_list:
+            return None
+        command = self.undo_list.pop()
+        self.redo_list.append(command)
+        self._apply(command, True)
+        return command[1]
+    
+    def redo(self):
+        """Repeat the last undone command. Return the shape it affected, or
+        None if there is nothing to redo.
+        """
+        self.open = None
+        if not self.redo_list:
+            return None
+        command = self.redo_list.pop()
+        self.undo_list.append(command)
+        self._apply(command, False)
+        return command[1]
+    
+    def _apply(self, command, undo):
+        """Internal use. Apply command to the world, or its reverse if undo is
+        True.
+        """
+        op,shape = command[:2]
+        world = State.world
+        if op == 'change':
+            shape.restore_state(command[2] if undo else command[3])
+            world.add(shape)
+        elif (op == 'add') == undo:
+            world.remove(shape)
+        else:
+            world.add(shape)
+
+
 class ControlPoint(Rect):
     """Control point that can be used to manipulate a geometric object.
     """
@@ -381,6 +799,7 @@ class RectGeom(geometry.RectGeometry):
         self.grabbed = None
         self.user_data = ''
         self.tiles = tiles[:]
+        self.stamp = TileStamp()
         # Add tile info to user_data
         for tile in tiles:
             name = data.relpath(tile.tile_file_path)
@@ -446,13 +865,31 @@ class RectGeom(geometry.RectGeometry):
     
     # RectGeom.copy
     
+    def save_state(self):
+        """Return a snapshot of the shape's geometry and user_data for undo.
+        """
+        return tuple(self.rect), tuple(self._position), self.user_data
+    
+    # RectGeom.save_state
+    
+    def restore_state(self, state):
+        """Restore a snapshot made by save_state().
+        """
+        (x,y,w,h),(px,py),self.user_data = state
+        self.rect.topleft = x,y
+        self.rect.size = w,h
+        p = self._position
+        p.x,p.y = px,py
+    
+    # RectGeom.restore_state
+    
     def draw(self):
         app = State.app
         camera = State.camera
         surface = camera.surface
         world_to_screen = camera.world_to_screen
         # Tile image.
-        draw_tiles(self.position, self.tiles)
+        self.stamp.draw(self.position, self.tiles)
         # Indicate mouse-over, copy, or cut.
         color = GEOM_COLORS.get(self)
         # Draw rect in screen space.
@@ -494,6 +931,7 @@ class PolyGeom(geometry.PolyGeometry):
         self.grabbed = None
         self.user_data = ''
         self.tiles = tiles[:]
+        self.stamp = TileStamp()
         self._angles = [-1] * len(self._points)
         self._ratios = [None] * len(self._points)
         # Add tile info to user_data
@@ -597,13 +1035,35 @@ class PolyGeom(geometry.PolyGeometry):
     
     # PolyGeom.copy
     
+    def save_state(self):
+        """Return a snapshot of the shape's geometry and user_data for undo.
+        """
+        points = tuple([(p[0],p[1]) for p in self._points])
+        return tuple(self.rect), tuple(self._position), points, self.user_data
+    
+    # PolyGeom.save_state
+    
+    def restore_state(self, state):
+        """Restore a snapshot made by save_state().
+        """
+        (x,y,w,h),(px,py),points,self.user_data = state
+        self.rect.topleft = x,y
+        self.rect.size = w,h
+        p = self._position
+        p.x,p.y = px,py
+        self._points[:] = [Vec2d(p) for p in points]
+        self._angles = [-1] * len(points)
+        self._ratios = [None] * len(points)
+    
+    # PolyGeom.restore_state
+    
     def draw(self):
         app = State.app
         camera = State.camera
         surface = camera.surface
         world_to_screen = camera.world_to_screen
         # Tile image.
-        draw_tiles(self.position, self.tiles)
+        self.stamp.draw(self.position, self.tiles)
         # Indicate mouse-over, copy, or cut.
         color = GEOM_COLORS.get(self)
         # Draw rect in screen space.
@@ -685,6 +1145,7 @@ class CircleGeom(geometry.CircleGeometry):
         self.grabbed = None
         self.user_data = ''
         self.tiles = tiles[:]
+        self.stamp = TileStamp()
         # Add tile info to user_data
         for tile in tiles:
             name = data.relpath(tile.tile_file_path)
@@ -742,13 +1203,31 @@ class CircleGeom(geometry.CircleGeometry):
     
     # CircleGeom.copy
     
+    def save_state(self):
+        """Return a snapshot of the shape's geometry and user_data for undo.
+        """
+        return tuple(self.rect), tuple(self._position), self.user_data
+    
+    # CircleGeom.save_state
+    
+    def restore_state(self, state):
+        """Restore a snapshot made by save_state().
+        """
+        (x,y,w,h),(px,py),self.user_data = state
+        self.rect.topleft = x,y
+        self.rect.size = w,h
+        p = self._position
+        p.x,p.y = px,py
+    
+    # CircleGeom.restore_state
+    
     def draw(self):
         app = State.app
         camera = State.camera
         surface = camera.surface
         world_to_screen = camera.world_to_screen
         # Tile image.
-        draw_tiles(self.position, self.tiles)
+        self.stamp.draw(self.position, self.tiles)
         # Indicate mouse-over, copy, or cut.
         color = GEOM_COLORS.get(self)
         # Draw rect in screen space.
@@ -792,7 +1271,6 @@ class MapEditor(object):
             model.QuadTreeObject(Rect(0,0,5,5)),
             View(State.screen.surface, Rect(0,0,screen_size.x*2/3,screen_size.y))
         )
-        self.world_grids = []
         self.make_world()
         pygame.display.set_caption('Gummworld2 World Editor')
         x,y = State.camera.view.rect.topleft
@@ -801,18 +1279,23 @@ class MapEditor(object):
         State.screen.eraser.fill(Color('grey'))
         
         # Mouse details.
-        #   mouse_shape: world entity for mouse interaction.
+        #   mouse_shape: probe for mouse queries; it is not added to the world.
         #   mouse_down: mouse button currently held down.
         #   selected: world entity currently selected.
         #   selected_tiles: selections in tile palette.
+        #   mouse_stamp: selected_tiles composed for drawing at the mouse.
         #   mouseover_shapes: list of shapes over which the mouse is hovering.
         self.mouse_shape = RectGeom(0,0,5,5)
         self.mouse_down = 0
         self.selected = None
         self.selected_tiles = []
+        self.mouse_stamp = TileStamp(alpha=75)
         self.grabbed_by_mouse = False
         self.mouseover_shapes = []
         
+        # Undo and redo.
+        self.history = History()
+        
         # Keyboard details.
         pygame.key.set_repeat(150, 1000/30)
         self.paste = None
@@ -827,6 +1310,7 @@ class MapEditor(object):
         self.tilesheets = []
         self.modal = None
         self.changes_unsaved = False
+        self.change_count = 0   # incremented by each edit
         self.make_gui()
         # Scrollbar position sets camera pos. The following sets it absolutely,
         # without waiting for events or interpolation. It's a cosmetic thing.
@@ -835,6 +1319,8 @@ class MapEditor(object):
         # Files.
         State.file_entities = None
         State.file_map = None
+        self.autosave = Autosave(joinpath(data.paths['map'], 'autosave.entities'))
+        State.clock.schedule_interval(self.autosave.save, 30.0)
         
         # Make some default content and HUD.
         toolkit.make_tiles2()
@@ -867,6 +1353,10 @@ class MapEditor(object):
         """Update all.
         """
         # Update stuff.
+        self.autosave.dispatch()
+        if self.autosave.errors:
+            self.gui_view_text('Save Entities failed',
+                self.autosave.errors.pop(0), width=640, height=480)
         self.update_gui()
         State.camera.update()
         self.update_shapes()
@@ -881,13 +1371,17 @@ class MapEditor(object):
         self.gui.update()
         State.camera.position = self.h_map_slider.value,self.v_map_slider.value
     
+    def shape_changed(self, shape):
+        """Note that shape was added, removed, or changed.
+        """
+        self.changes_unsaved = True
+        self.change_count += 1
+        self.autosave.touch(shape)
+    
     def update_shapes(self):
         """Update the mouseover_shapes list.
         """
-        mouse_shape = self.mouse_shape
-        self.mouseover_shapes = [shape for ent,shape in State.world.collisions
-            if ent is mouse_shape
-        ]
+        self.mouseover_shapes = State.world.entities_colliding(self.mouse_shape)
     
     def draw(self):
         """Draw all.
@@ -908,34 +1402,78 @@ class MapEditor(object):
     def draw_world(self):
         """Draw the on-screen shapes in the world.
         """
-        mouse_shape = self.mouse_shape
         selected = self.selected
         things = State.world.entities_in(State.camera.rect)
-        camera = State.camera
-        blit = camera.view.surface.blit
-        world_to_screen = camera.world_to_screen
         if State.show_world_grid:
-            for grid_line in self.world_grids:
-                blit(grid_line.image, world_to_screen(grid_line.rect.topleft))
+            self.draw_world_grid()
         for thing in things:
-            if thing not in (mouse_shape,selected):
+            if thing is not selected:
                 thing.draw()
         if selected:
             selected.draw()
     
+    def draw_world_grid(self, max_level=2):
+        """Draw the quadtree's grid lines as a visual aid. The lines are the
+        bottom and right edges of the live branches down to max_level. Only
+        branches that overlap the camera are visited, and each edge is clipped
+        to the camera before it is drawn.
+        """
+        camera = State.camera
+        surface = camera.view.surface
+        world_to_screen = camera.world_to_screen
+        draw_line = pygame.draw.line
+        cam_rect = camera.rect.inflate(2,2)
+        cl,ct,cr,cb = cam_rect.left,cam_rect.top,cam_rect.right,cam_rect.bottom
+        def draw_edges(branch):
+            level = branch.level
+            if level == 2:
+                if branch.branch_id > 4:
+                    color = Color('red')
+                else:
+                    color = Color('orange')
+            elif level == 3:
+                color = Color('yellow')
+            else:
+                color = Color('green')
+            rect = branch.rect
+            # Each line is drawn one pixel either side of the edge, so that
+            # lines along the same edge are told apart.
+            y = rect.bottom
+            if ct <= y < cb:
+                x1,y1 = world_to_screen((max(rect.left, cl), y))
+                x2,y2 = world_to_screen((min(rect.right, cr), y))
+                if x1 < x2:
+                    draw_line(surface, color, (x1,y1-1), (x2,y2-1))
+                    draw_line(surface, color, (x1,y1+1), (x2,y2+1))
+            x = rect.right
+            if cl <= x < cr:
+                x1,y1 = world_to_screen((x, max(rect.top, ct)))
+                x2,y2 = world_to_screen((x, min(rect.bottom, cb)))
+                if y1 < y2:
+                    draw_line(surface, color, (x1-1,y1), (x2-1,y2))
+                    draw_line(surface, color, (x1+1,y1), (x2+1,y2))
+        def walk(branch):
+            for b in branch.branches:
+                if b.rect.colliderect(cam_rect):
+                    draw_edges(b)
+                    if b.level < max_level:
+                        walk(b)
+        walk(State.world)
+    
     def draw_mouse(self):
         """Draw tiles that are attached to the mouse.
         """
         selected = self.selected_tiles
         if len(selected):
             if not self.gui_hover():
-                draw_tiles(self.mouse_shape.position, selected, alpha=75)
+                self.mouse_stamp.draw(self.mouse_shape.position, selected)
     
     def select(self, shape):
         """Select a shape and update the form with its info.
         """
         if shape is None:
             return
+        self.history.close()
         self.selected = shape
         selected = shape
         selected.grabbed = selected.control_points[-1]
@@ -948,6 +1486,7 @@ class MapEditor(object):
     def deselect(self):
         """Deselect a shape and release its "grabbed" control point.
         """
+        self.history.close()
         if self.selected:
             self.selected.release()
             self.selected = None
@@ -972,8 +1511,7 @@ class MapEditor(object):
         State.hud.stats['Save File'].set_value(val)
     
     def make_world(self):
-        """Create the world and populate its entities. Make grid lines as
-        visual aid for quadtree.
+        """Create the world and populate its entities.
         """
         if State.world is not None:
             entities = State.world.entity_branch.keys()
@@ -983,51 +1521,6 @@ class MapEditor(object):
             State.map.rect, worst_case=99, collide_entities=True)
         State.world.add(*entities)
         State.camera.position = State.camera.view.center
-        del self.world_grids[:]
-        num_levels = State.world.num_levels
-        top_rect = State.world.rect
-        worst_case = -State.world.worst_case if State.world.worst_case else 0
-        def make_grid(branch):
-            level = branch.level
-            do_me = level == 2      # this displays critical top-level grids
-            if do_me:
-                rect = branch.rect
-                alpha = 305 - float(level-1)/(num_levels-1)*255
-                if level == 2:
-                    if branch.branch_id > 4:
-                        color = Color('red')
-                        alpha = 255
-                    else:
-                        color = Color('orange')
-                elif level == 3:
-                    color = Color('yellow')
-                elif level == 4:
-                    color = Color('green')
-                if rect.x in (0,worst_case):
-                    # Horizontal line.
-                    s = pygame.sprite.Sprite()
-                    s.image = pygame.surface.Surface((top_rect.w,3))
-                    s.rect = s.image.get_rect()
-                    s.rect.centery = rect.bottom
-                    s.image.fill(color)
-                    pygame.draw.line(s.image, Color('black'), (0,1),(s.rect.w,1))
-                    s.image.set_colorkey(Color('black'))
-                    s.image.set_alpha(alpha)
-                    self.world_grids.append(s)
-                if rect.y in (0,worst_case):
-                    # Vertical line.
-                    s = pygame.sprite.Sprite()
-                    s.image = pygame.surface.Surface((3,top_rect.h))
-                    s.rect = s.image.get_rect()
-                    s.rect.centerx = rect.right
-                    s.image.fill(color)
-                    pygame.draw.line(s.image, Color('black'), (1,0),(1,s.rect.h))
-                    s.image.set_colorkey(Color('black'))
-                    s.image.set_alpha(alpha)
-                    self.world_grids.append(s)
-            for b in branch.branches:
-                make_grid(b)
-        make_grid(State.world)
     
     def make_gui(self):
         """Make the entire GUI.
@@ -1437,8 +1930,32 @@ class MapEditor(object):
         """GUI input field changed, set the selected shape's user_data.
         """
         if self.selected is not None:
+            before = self.selected.save_state()
             self.selected.user_data = user_data.value
-            self.changes_unsaved = True
+            self.history.changed(self.selected, before)
+            self.shape_changed(self.selected)
+    
+    def action_undo(self, *args):
+        """Undo action: reverse the last shape edit.
+        """
+        self.history_applied(self.history.undo())
+    
+    def action_redo(self, *args):
+        """Redo action: repeat the last undone shape edit.
+        """
+        self.history_applied(self.history.redo())
+    
+    def history_applied(self, shape):
+        """Update the selection and save state after undo or redo changed
+        shape.
+        """
+        if shape is None:
+            return
+        self.shape_changed(shape)
+        if shape in State.world.entity_branch:
+            self.select(shape)
+        elif shape is self.selected:
+            self.deselect()
     
     def action_shape_delete(self):
         """Delete shape action: delete the selected shape.
@@ -1448,6 +1965,8 @@ class MapEditor(object):
             shape = self.selected 
             self.deselect()
             State.world.remove(shape)
+            self.history.removed(shape)
+            self.shape_changed(shape)
     
     def action_shape_copy(self):
         """Copy shape action: target the selected shape for copy-paste action.
@@ -1472,8 +1991,11 @@ class MapEditor(object):
         if self.paste is not None:
             action,shape = self.paste
             if action == 'cut':
+                before = shape.save_state()
                 shape.position = self.mouse_shape.position
                 State.world.add(shape)
+                self.history.changed(shape, before)
+                self.shape_changed(shape)
                 self.select(shape)
             elif action == 'copy':
                 # new_shape = shape.copy()
@@ -1481,6 +2003,8 @@ class MapEditor(object):
                     shape = shape.copy()
                     shape.position = self.mouse_shape.position
                     State.world.add(shape)
+                    self.history.added(shape)
+                    self.shape_changed(shape)
                     self.select(shape)
     
     # MapEditor.action_shape_paste
@@ -1521,7 +2045,8 @@ class MapEditor(object):
                 return
             self.select(geom)
             State.world.add(geom)
-            self.changes_unsaved = True
+            self.history.added(geom)
+            self.shape_changed(geom)
         elif self.mouse_down == 1:
             # Left-click: Select, deselect, or grab.
             if self.selected not in mouseover_shapes:
@@ -1550,16 +2075,20 @@ class MapEditor(object):
         if selected:
             if self.mouse_down == 3:
                 # Move the selected shape.
+                before = selected.save_state()
                 selected.position = State.camera.screen_to_world(e.pos)
                 State.world.add(selected)
-                self.changes_unsaved = True
+                self.history.changed(selected, before)
+                self.shape_changed(selected)
             elif self.mouse_down == 1:
                 # Resize the selected shape.
                 grabbed = selected.grabbed
                 if grabbed is not None and self.grabbed_by_mouse:
+                    before = selected.save_state()
                     grabbed.position = State.camera.screen_to_world(e.pos)
                     State.world.add(selected)
-                    self.changes_unsaved = True
+                    self.history.changed(selected, before)
+                    self.shape_changed(selected)
             x,y = selected.position
             self.gui_form['shape_pos'].set_text(str((int(round(x)),int(round(y)))))
         
@@ -1569,6 +2098,7 @@ class MapEditor(object):
         """Mouse release action: reset mouse-up state.
         """
         self.grabbed_by_mouse = False
+        self.history.close()
     
     def action_key_grab_shape(self, key, mod):
         """Grab shape action: drag a grabbed control point using the keyboard.
@@ -1583,8 +2113,11 @@ class MapEditor(object):
             if pressed[K_RIGHT]: dirx += 1
             if pressed[K_UP]: diry += -1
             if pressed[K_DOWN]: diry += 1
+            before = selected.save_state()
             grabbed.position += (dirx*speed,diry*speed)
             State.world.add(self.selected)
+            self.history.changed(selected, before)
+            self.shape_changed(self.selected)
             x,y = selected.position
             self.gui_form['shape_pos'].set_text(str((int(round(x)),int(round(y)))))
     
@@ -1598,8 +2131,11 @@ class MapEditor(object):
             x,y = 0,0
             if pressed[K_EQUALS]: x = y = 2
             if pressed[K_MINUS]: x = y = -2
+            before = selected.save_state()
             selected.inflate(x, y)
             State.world.add(self.selected)
+            self.history.changed(selected, before)
+            self.shape_changed(self.selected)
     
     def action_map_new(self, sub_action=None, widget=None):
         """New map action: create a new map with default content.
@@ -1728,10 +2264,12 @@ class MapEditor(object):
         elif sub_action == 'check_discard':
             if widget is None or widget.value is True:
                 # Clear out the world.
-                State.world.remove(*State.world.entity_branch.keys())
+                State.world.remove_bulk(State.world.entity_branch.keys())
                 self.deselect()
                 del self.mouseover_shapes[:]
                 self.changes_unsaved = False
+                self.autosave.reset()
+                self.history.clear()
                 self.set_entities_file(None)
         
     # MapEditor.action_entities_clear
@@ -1758,11 +2296,15 @@ class MapEditor(object):
             if d.value is not None:
                 self.set_entities_file(d.value)
                 # Clear out the world.
-                State.world.remove(*State.world.entity_branch.keys())
+                State.world.remove_bulk(State.world.entity_branch.keys())
                 # Run the importer plugin.
                 try:
                     file_handle = open(State.file_entities, 'rb')
-                    entities,tilesheets = toolkit.import_world_quadtree(
+                    if toolkit.is_entity_file_binary(file_handle):
+                        importer = toolkit.import_world_binary
+                    else:
+                        importer = toolkit.import_world_quadtree
+                    entities,tilesheets = importer(
                         file_handle, RectGeom, PolyGeom, CircleGeom)
                     self.changes_unsaved = False
                 except:
@@ -1775,14 +2317,56 @@ class MapEditor(object):
                 else:
                     file_handle.close()
                     # Add the entities to the world.
-                    State.world.add_list(entities)
+                    State.world.add_bulk(entities)
                     load_tiles(entities, tilesheets)
                     self.deselect()
-                # Put the mouse shape back.
-                State.world.add(self.mouse_shape)
+                    self.autosave.reset()
+                    self.history.clear()
         
     # MapEditor.action_entities_import
     
+    def action_entities_recover(self, sub_action=None, widget=None):
+        """Recover entities action: load the entities from the autosave.
+        
+        This is a reentrant method. The sub_action argument drives the behavior.
+        It is called initially by an event handler, and again by GUI callback.
+        """
+        if sub_action is None:
+            # If changed, confirm discard.
+            if self.changes_unsaved:
+                self.gui_confirm_discard(self.action_entities_recover)
+            else:
+                self.action_entities_recover('check_discard')
+        elif sub_action == 'check_discard':
+            if widget is None or widget.value is True:
+                try:
+                    file_handle = self.autosave.recover()
+                    if file_handle is None:
+                        return
+                    entities,tilesheets = toolkit.import_world_quadtree(
+                        file_handle, RectGeom, PolyGeom, CircleGeom)
+                except:
+                    exc_type,exc_value,exc_traceback = sys.exc_info()
+                    self.gui_view_text('Recover Entities failed',
+                        traceback.format_exception(
+                            exc_type, exc_value, exc_traceback),
+                            width=640, height=480)
+                    traceback.print_exc()
+                else:
+                    # Replace the world's entities. They are not saved to a
+                    # file yet.
+                    State.world.remove_bulk(State.world.entity_branch.keys())
+                    State.world.add_bulk(entities)
+                    load_tiles(entities, tilesheets)
+                    self.deselect()
+                    self.set_entities_file(None)
+                    self.changes_unsaved = True
+                    self.change_count += 1
+                    self.autosave.reset()
+                    self.history.clear()
+        
+    # MapEditor.action_entities_recover
+    
     def action_entities_save(self, *args):
         """Save entities action: save entities to a file.
         """
@@ -1791,25 +2375,24 @@ class MapEditor(object):
             self.action_entities_save_as()
             if State.file_entities is None:
                 return
-        # Specify the exporter plugin to use.
-        # Don't save the mouse shape.
-        State.world.remove(self.mouse_shape)
-        # Run the exporter plugin.
+        # Snapshot the entities and write them in the background. Failures
+        # are reported by update(). The world counts as saved only once the
+        # write succeeds, and only if it was not edited meanwhile.
+        change_count = self.change_count
+        def saved(success):
+            if not success:
+                self.changes_unsaved = True
+            elif self.change_count == change_count:
+                self.changes_unsaved = False
         try:
-            file_handle = open(State.file_entities, 'wb')
             entities = State.world.entity_branch.keys()
-            toolkit.export_world_quadtree(file_handle, entities)
-            self.changes_unsaved = False
+            self.autosave.write(State.file_entities, entities, saved)
         except:
             exc_type,exc_value,exc_traceback = sys.exc_info()
             self.gui_view_text('Save Entities failed',
                 traceback.format_exception(exc_type, exc_value, exc_traceback),
                 width=640, height=480)
             traceback.print_exc()
-        else:
-            file_handle.close()
-        # Put the mouse shape back.
-        State.world.add(self.mouse_shape)
         
     # MapEditor.action_entities_save
     
@@ -1837,6 +2420,9 @@ class MapEditor(object):
         It is called initially by an event handler, and again by GUI callback.
         """
         if sub_action is None:
+            # Let a pending save finish, so it counts.
+            self.autosave.flush()
+            self.autosave.dispatch()
             # If changed, confirm discard.
             if self.changes_unsaved:
                 self.gui_confirm_discard(self.action_quit_app)
@@ -1844,6 +2430,8 @@ class MapEditor(object):
                 self.action_quit_app('check_discard')
         elif sub_action == 'check_discard':
             if widget is None or widget.value is True:
+                # Let background saves finish.
+                self.autosave.flush()
                 quit()
     
     def action_view_map_grid(self, *args):
@@ -1941,6 +2529,13 @@ class MapEditor(object):
                 self.action_shape_cut()
             elif key == K_v and mod & KMOD_CTRL:
                 self.action_shape_paste()
+            elif key == K_z and mod & KMOD_CTRL:
+                if mod & KMOD_SHIFT:
+                    self.action_redo()
+                else:
+                    self.action_undo()
+            elif key == K_y and mod & KMOD_CTRL:
+                self.action_redo()
             elif key == K_TAB:
                 GEOM_COLORS.next()
 #            else:
@@ -1951,6 +2546,11 @@ class MapEditor(object):
         """
         # Maybe some accelerator keys or something.
         self.gui.event(e)
+        # Each shape-moving keystroke is its own undo step; user_data edits are
+        # one step until the input field loses focus.
+        user_data = self.gui_form['user_data']
+        if user_data.container.myfocus is not user_data:
+            self.history.close()
     
     def on_mouse_button_down(self, e, pos, button):
         """Handler for MOUSEBUTTONDOWN events.
@@ -1981,7 +2581,6 @@ class MapEditor(object):
         """Handler for MOUSEMOTION events.
         """
         self.mouse_shape.position = State.camera.screen_to_world(pos)
-        State.world.add(self.mouse_shape)
         if self.mouse_down:
             self.action_mouse_drag(e)
         else:
@@ -2069,29 +2668,61 @@ def load_tiles(entities, tilesheets):
                     info.tilesheet, info.tile_id))
 
 
-def draw_tiles(position, tiles, alpha=255):
-    """Draw a sequence of tiles centered on position.
+class TileStamp(object):
+    """A sequence of tiles composed into one image, so that drawing them is a
+    single blit. The image is composed on the first draw and again only when
+    the sequence of tiles changes.
     """
-    if len(tiles) == 0:
-        return
-    # Get bounding rect for the sequence of tiles.
-    bounding_rect = tiles_bounding_rect(tiles)
-    # Calculate offset to argument position.
-    move_center = State.camera.world_to_screen(position)
-    diff = bounding_rect.center - Vec2d(bounding_rect.topleft)
-    # Place individual tiles...
-    tw,th = tiles[0].tile_rect.size
-    blit = State.screen.blit
-    for tile in tiles:
-        image = tile.tile_image.copy()
-        image.set_alpha(alpha)
-        rect = tile.tile_rect.copy()
-        # Translate to argument position, removing tile spacing.
-        nx = (rect.x-bounding_rect.x) // tw
-        ny = (rect.y-bounding_rect.y) // th
-        rect.x = (move_center.x - diff.x) + nx * tw
-        rect.y = (move_center.y - diff.y) + ny * th
-        blit(image, rect)
+    
+    def __init__(self, alpha=255):
+        self.alpha = alpha
+        self.tiles = ()
+        self.image = None
+        self.offset = 0,0
+    
+    def invalidate(self):
+        """Compose the image again on the next draw.
+        """
+        self.tiles = ()
+        self.image = None
+    
+    def compose(self, tiles):
+        """Compose tiles into self.image. The tiles are laid out on their tile
+        sheet grid, with tile spacing removed.
+        """
+        self.tiles = tuple(tiles)
+        if not tiles:
+            self.image = None
+            return
+        # Get bounding rect for the sequence of tiles.
+        bounding_rect = tiles_bounding_rect(tiles)
+        bx,by = bounding_rect.topleft
+        tw,th = tiles[0].tile_rect.size
+        cells = [((t.tile_rect.x-bx)//tw, (t.tile_rect.y-by)//th) for t in tiles]
+        w = max([nx for nx,ny in cells]) + 1
+        h = max([ny for nx,ny in cells]) + 1
+        image = pygame.surface.Surface((w*tw,h*th), SRCALPHA)
+        image.fill((0,0,0,0))
+        for tile,(nx,ny) in zip(tiles, cells):
+            image.blit(tile.tile_image, (nx*tw,ny*th))
+        if self.alpha < 255:
+            image.fill((255,255,255,self.alpha), None, BLEND_RGBA_MULT)
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha()
+        self.image = image
+        # Offset from the image's topleft to the point it is centered on.
+        self.offset = bounding_rect.w//2, bounding_rect.h//2
+    
+    def draw(self, position, tiles):
+        """Draw a sequence of tiles centered on position.
+        """
+        if len(tiles) != len(self.tiles) or tuple(tiles) != self.tiles:
+            self.compose(tiles)
+        if self.image is None:
+            return
+        x,y = State.camera.world_to_screen(position)
+        ox,oy = self.offset
+        State.screen.blit(self.image, (x-ox,y-oy))
 
 
 def make_hud():
@@ -2122,7 +2753,7 @@ def make_hud():
         s = pygame.mouse.get_pos()
         w = State.camera.screen_to_world(s)
         return 'S%s W%s@%s' % (str(s), str((int(w.x),int(w.y),)),
-            str(State.world.level_of(State.app.mouse_shape)).lower())
+            State.world.branch_at(State.app.mouse_shape.rect).level)
     State.hud.add('Mouse',
         Statf(next_pos(), 'Mouse %s', callback=get_mouse, interval=100))
     
@@ -2161,10 +2792,13 @@ def make_menus(container):
     app = State.app
     menus = gui.Menus([
         ('File/Quit',         app.action_quit_app, None),
+        ('Edit/Undo',         app.action_undo, None),
+        ('Edit/Redo',         app.action_redo, None),
         ('Entities/Import',   app.action_entities_import, None),
         ('Entities/Save',     app.action_entities_save, None),
         ('Entities/Save As',  app.action_entities_save_as, None),
         ('Entities/Clear',    app.action_entities_clear, None),
+        ('Entities/Recover Autosave', app.action_entities_recover, None),
         ('Images/New Map',    app.action_map_new, None),
         ('Images/Load Map',   app.action_map_load, None),
         ('Images/Load Tiles', app.action_tiles_load, None),